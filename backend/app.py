@@ -6,24 +6,191 @@ import faiss
 import numpy as np
 import asyncio
 import uvicorn
-from fastapi import FastAPI, UploadFile, File, WebSocket, WebSocketDisconnect, HTTPException, Depends
+import httpx
+import websockets
+from fastapi import FastAPI, UploadFile, File, WebSocket, WebSocketDisconnect, HTTPException, Depends, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Dict, Any, Optional
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from typing import List, Dict, Any, Optional, Tuple, Callable, Iterator, AsyncIterator
 from pydantic import BaseModel
 from dotenv import load_dotenv
 import tiktoken
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain.vectorstores import FAISS
 from langchain.docstore.document import Document
 from langchain.prompts import ChatPromptTemplate
 from langchain_core.messages import SystemMessage, HumanMessage
 import time
+import pickle
+import re
+import bisect
+import math
+import hashlib
+import sqlite3
+import shutil
+import threading
+import uuid
+import random
+import openai
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import OrderedDict
+from contextlib import contextmanager
+from abc import ABC, abstractmethod
+import unicodedata
+import logging
+import copy
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem lock de escrita, um único processo
+    fcntl = None
 
 # Constantes
 UPLOADS_DIR = "uploads"
 FAISS_INDEX_PATH = os.path.abspath("faiss_index")
 
+# Persistência incremental do índice
+# Cada upload grava um segmento append-only; a compactação junta os segmentos num snapshot
+SEGMENTS_DIR = os.path.join(FAISS_INDEX_PATH, "segments")
+MANIFEST_PATH = os.path.join(FAISS_INDEX_PATH, "manifest.json")
+# Número de segmentos pendentes que dispara a compactação em background
+COMPACTION_SEGMENTS = int(os.getenv("COMPACTION_SEGMENTS", "16"))
+# Número de vetores apagados (tombstones) que também dispara a compactação
+COMPACTION_TOMBSTONES = int(os.getenv("COMPACTION_TOMBSTONES", "500"))
+# Vetores novos fora do índice principal (buscados de forma exata) que também disparam a compactação
+COMPACTION_DELTA_VECTORS = int(os.getenv("COMPACTION_DELTA_VECTORS", "20000"))
+
+# Vários processos com o mesmo faiss_index (uvicorn --workers N, réplicas com o mesmo volume)
+# Um único writer faz a ingestão e grava segmentos e snapshots; os readers só respondem perguntas
+# auto: o processo que obtém o lock de escrita é o writer, os demais são readers
+WORKER_ROLES = ("auto", "writer", "reader")
+WORKER_ROLE = os.getenv("WORKER_ROLE", "auto").lower()
+WRITER_LOCK_PATH = os.path.join(FAISS_INDEX_PATH, "writer.lock")
+# Socket Unix em que o writer atende os uploads, remoções e jobs repassados pelos readers
+WRITER_SOCKET_PATH = os.path.join(FAISS_INDEX_PATH, "writer.sock")
+# Intervalo em que os readers procuram novos segmentos e snapshots do writer
+INDEX_REFRESH_SECONDS = float(os.getenv("INDEX_REFRESH_SECONDS", "1.0"))
+
+# Cache persistente de embeddings dos chunks (chave: hash do texto + modelo)
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(FAISS_INDEX_PATH, "embedding_cache.sqlite"))
+# Número máximo de vetores no cache; os menos usados recentemente são removidos
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "50000"))
+
+# Texto e metadados dos chunks (chave: id do vetor no FAISS)
+CHUNK_STORE_PATH = os.getenv("CHUNK_STORE_PATH", os.path.join(FAISS_INDEX_PATH, "chunks.sqlite"))
+
+# Embedding em lote na ingestão
+# Tokens e textos máximos por requisição à API de embeddings
+EMBED_BATCH_MAX_TOKENS = int(os.getenv("EMBED_BATCH_MAX_TOKENS", "100000"))
+EMBED_BATCH_MAX_INPUTS = int(os.getenv("EMBED_BATCH_MAX_INPUTS", "512"))
+# Lotes em andamento ao mesmo tempo (somando todos os uploads do processo)
+EMBED_MAX_CONCURRENT_BATCHES = int(os.getenv("EMBED_MAX_CONCURRENT_BATCHES", "4"))
+# Tentativas por lote em caso de rate limit / erro transitório, com backoff exponencial
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "6"))
+EMBED_RETRY_BASE_DELAY = float(os.getenv("EMBED_RETRY_BASE_DELAY", "1.0"))
+
+# Uploads gravados em disco em blocos, sem carregar o arquivo inteiro na memória
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(200 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+# Folga para os cabeçalhos do multipart ao comparar o corpo da requisição com o limite
+UPLOAD_MULTIPART_OVERHEAD = 64 * 1024
+# Hash do conteúdo -> arquivo já processado, para não reprocessar arquivos idênticos
+UPLOAD_HASHES_PATH = os.path.join(UPLOADS_DIR, ".upload_hashes.json")
+
+# Fila de ingestão em background
+# Uploads processados ao mesmo tempo e processos para extração/divisão do texto
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_PROCESS_WORKERS = int(os.getenv("INGEST_PROCESS_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Páginas de PDF extraídas por tarefa no pool de processos
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "25"))
+# Caracteres extraídos acumulados antes de dividir e começar a embutir esse trecho
+INGEST_STREAM_CHARS = int(os.getenv("INGEST_STREAM_CHARS", "50000"))
+# Jobs finalizados mantidos em memória para consulta em /jobs
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", "200"))
+
+# Limites de concorrência do caminho de consulta
+# Número máximo de perguntas processando embedding + busca ao mesmo tempo
+QUERY_MAX_CONCURRENCY = int(os.getenv("QUERY_MAX_CONCURRENCY", "64"))
+# Threads dedicadas à busca no FAISS (fora do event loop)
+SEARCH_THREADS = int(os.getenv("SEARCH_THREADS", "4"))
+# Threads OpenMP usadas pelo FAISS em cada busca; o paralelismo vem do pool acima
+FAISS_OMP_THREADS = int(os.getenv("FAISS_OMP_THREADS", "1"))
+# Perguntas em andamento ao mesmo tempo em cada conexão do /ws/chat
+WS_MAX_CONCURRENT_REQUESTS = int(os.getenv("WS_MAX_CONCURRENT_REQUESTS", "4"))
+
+# Busca filtrada por documento
+# Seleções com até este número de vetores são pontuadas diretamente, sem varrer o índice
+FILTERED_SEARCH_EXACT_MAX = int(os.getenv("FILTERED_SEARCH_EXACT_MAX", "50000"))
+
+# Seleção e montagem do contexto enviado ao modelo
+# Orçamento de tokens do contexto (chunks que não cabem são cortados ou deixados de fora)
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "3000"))
+# Chunks com similaridade de cosseno acima desta com um chunk já escolhido são descartados (> 1 desativa)
+CONTEXT_DUPLICATE_SIMILARITY = float(os.getenv("CONTEXT_DUPLICATE_SIMILARITY", "0.97"))
+# MMR: peso da relevância contra a diversidade (1 = só relevância, sem MMR) e candidatos buscados por chunk
+# (também com o descarte de quase duplicatas ativo)
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "1.0"))
+MMR_FETCH_FACTOR = int(os.getenv("MMR_FETCH_FACTOR", "4"))
+
+# Busca híbrida: léxica (BM25, FTS5 do SQLite) + vetorial, combinadas por reciprocal rank fusion
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid")
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# Constante k do RRF (pontuação de cada lista: 1 / (k + posição))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Sem resposta da API de embeddings neste tempo, a pergunta usa só a busca léxica...
+QUERY_EMBED_TIMEOUT_SECONDS = float(os.getenv("QUERY_EMBED_TIMEOUT_SECONDS", "5"))
+# ...assim como as perguntas seguintes, por este tempo (0 desativa o fallback léxico)
+LEXICAL_FALLBACK_SECONDS = float(os.getenv("LEXICAL_FALLBACK_SECONDS", "30"))
+
+# Tipo do índice FAISS: flat (busca exata), hnsw, ivf_flat ou ivf_pq
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+INDEX_TYPE = os.getenv("INDEX_TYPE", "flat").lower()
+# HNSW: vizinhos por nó e esforço na construção e na busca (efSearch)
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "128"))
+# IVF: número de listas (0 = automático, ~4·√n) e listas visitadas por busca (nprobe)
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+# PQ: subquantizadores (devem dividir a dimensão) e bits por código
+PQ_M = int(os.getenv("PQ_M", "64"))
+PQ_NBITS = int(os.getenv("PQ_NBITS", "8"))
+# Armazenamento dos vetores nos índices flat, hnsw e ivf_flat: float32, float16 ou sq8 (8 bits por dimensão)
+VECTOR_ENCODINGS = {"float32": "Flat", "float16": "SQfp16", "sq8": "SQ8"}
+VECTOR_ENCODING = os.getenv("VECTOR_ENCODING", "float32").lower()
+# Dimensões mantidas de cada embedding (0 = todas); o text-embedding-3 aceita vetores encurtados
+VECTOR_DIMENSIONS = int(os.getenv("VECTOR_DIMENSIONS", "0"))
+# Carregar o índice com mmap (listas invertidas dos índices IVF), compartilhando as páginas entre workers
+INDEX_MMAP = os.getenv("INDEX_MMAP", "false").lower() in ("1", "true", "yes")
+# Máximo de vetores (amostra aleatória) usados no treino dos índices IVF
+INDEX_TRAIN_MAX_VECTORS = int(os.getenv("INDEX_TRAIN_MAX_VECTORS", "100000"))
+
+# Micro-batching das embeddings de perguntas
+# Tamanho máximo de um lote e tempo máximo de espera para completar o lote
+QUERY_EMBED_MAX_BATCH = int(os.getenv("QUERY_EMBED_MAX_BATCH", "32"))
+QUERY_EMBED_MAX_WAIT_MS = float(os.getenv("QUERY_EMBED_MAX_WAIT_MS", "10"))
+
+# Cache de respostas (exato + semântico), em memória
+# Número máximo de respostas (0 desativa o cache) e validade de cada uma
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+# Similaridade de cosseno mínima para reaproveitar a resposta de uma pergunta parecida (> 1 desativa)
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+
+# Divisão dos documentos em chunks (em tokens do cl100k_base)
+CHUNK_SIZE_TOKENS = int(os.getenv("CHUNK_SIZE_TOKENS", "1000"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "200"))
+
+# Observabilidade
+# Nível do log (DEBUG mostra cada pergunta, busca e lote); mensagens abaixo do nível nem são formatadas
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Limites (em segundos) dos buckets dos histogramas de latência expostos em /metrics
+METRICS_BUCKETS = tuple(float(bound) for bound in os.getenv(
+    "METRICS_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30,60"
+).split(","))
+
 # Carregar variáveis de ambiente
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -31,6 +198,11 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY não está definido no arquivo .env")
 
+# Configurar o log da aplicação
+logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger("super_cerebro")
+logger.setLevel(LOG_LEVEL)
+
 # Inicializar tokenizer para divisão de texto
 tokenizer = tiktoken.get_encoding("cl100k_base")
 
@@ -50,20 +222,909 @@ chat_model = ChatOpenAI(
 # Variável global para o banco de dados de vetores
 vector_db = None
 
+# Até quando as perguntas usam só a busca léxica (a API de embeddings falhou)
+embeddings_unavailable_until = 0.0
+
+# Estado da persistência: último segmento gravado e último incorporado a um snapshot
+index_lock = threading.Lock()
+segment_seq = 0
+compacted_seq = 0
+snapshot_version = 0
+compaction_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index-compaction")
+compaction_running = False
+
+# Papel deste processo ("writer" ou "reader", definido no startup) e o arquivo do lock de escrita
+worker_role = "writer"
+writer_lock_file = None
+index_refresh_task: Optional[asyncio.Task] = None
+
+# Pool de threads para as buscas no FAISS, que são síncronas e usam CPU
+faiss.omp_set_num_threads(FAISS_OMP_THREADS)
+search_executor = ThreadPoolExecutor(max_workers=SEARCH_THREADS, thread_name_prefix="faiss-search")
+
+# Semáforo que limita as consultas simultâneas (criado no startup, dentro do event loop)
+query_semaphore: Optional[asyncio.Semaphore] = None
+
+# Semáforo que limita os lotes de embedding da ingestão em andamento (criado no startup)
+embedding_semaphore: Optional[asyncio.Semaphore] = None
+
+# Fila de ingestão, workers e pool de processos (criados no startup)
+ingestion_queue: Optional[asyncio.Queue] = None
+ingestion_workers: List[asyncio.Task] = []
+ingest_process_pool: Optional[ProcessPoolExecutor] = None
+
+# Métricas no formato de texto do Prometheus
+class Metric(ABC):
+    """Base of the Prometheus metrics: one series per combination of label values.
+    
+    Updates are thread-safe (stages run on the event loop, the search and
+    compaction threads) and rendering follows the text exposition format.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._series: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = sorted(self._series.items())
+        for key, value in series:
+            lines.extend(self._render_series(key, value))
+        return lines
+
+    @abstractmethod
+    def _render_series(self, key: Tuple[str, ...], value: Any) -> List[str]:
+        """Return the exposition lines of one series."""
+
+class Counter(Metric):
+    """Monotonic counter."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def _render_series(self, key: Tuple[str, ...], value: float) -> List[str]:
+        return [f"{self.name}{self._labels(key)} {value}"]
+
+class Histogram(Metric):
+    """Histogram of durations in seconds, with cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = METRICS_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, seconds: float, **labels: str) -> None:
+        key = self._key(labels)
+        # Cada observação conta no primeiro bucket que a contém; o render acumula
+        position = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            series["counts"][position] += 1
+            series["sum"] += seconds
+            series["count"] += 1
+
+    def _render_series(self, key: Tuple[str, ...], series: Dict[str, Any]) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), series["counts"]):
+            cumulative += count
+            le = "+Inf" if bound == math.inf else repr(float(bound))
+            lines.append(f"{self.name}_bucket{self._labels(key, (('le', le),))} {cumulative}")
+        lines.append(f"{self.name}_sum{self._labels(key)} {series['sum']}")
+        lines.append(f"{self.name}_count{self._labels(key)} {series['count']}")
+        return lines
+
+# Duração de cada etapa, tokens enviados e consultas aos caches
+stage_seconds = Histogram(
+    "supercerebro_stage_duration_seconds",
+    "Duration of each ingestion and query stage (page_extraction is per page, embedding per API batch).",
+    ("stage",),
+)
+tokens_total = Counter(
+    "supercerebro_tokens_total",
+    "Tokens sent to the OpenAI APIs (prompt, embedding) and generated by the chat model (completion).",
+    ("kind",),
+)
+cache_lookups_total = Counter(
+    "supercerebro_cache_lookups_total",
+    "Lookups in the answer and embedding caches by result.",
+    ("cache", "result"),
+)
+metrics_registry: List[Metric] = [stage_seconds, tokens_total, cache_lookups_total]
+
+# Function to time a stage into the stage histogram
+@contextmanager
+def timed_stage(stage: str) -> Iterator[None]:
+    """Observe the duration of the block in `stage_seconds` (failed runs are not observed)."""
+    start = time.perf_counter()
+    yield
+    stage_seconds.observe(time.perf_counter() - start, stage=stage)
+
+# Micro-batcher for query embeddings
+class QueryEmbeddingBatcher:
+    """Combine concurrent query embeddings into a single batched API call.
+    
+    Questions arriving within `max_wait_ms` of the first pending one (or until
+    `max_batch_size` is reached) are sent together to `aembed_documents`, and
+    each caller receives its own vector.
+    """
+
+    def __init__(self, embeddings: OpenAIEmbeddings, max_batch_size: int = 32, max_wait_ms: float = 10.0):
+        self.embeddings = embeddings
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max(0.0, max_wait_ms)
+        self._pending: List[Tuple[str, asyncio.Future, float]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._running: set = set()
+        
+        # Métricas
+        self.requests = 0
+        self.batches = 0
+        self.api_inputs = 0
+        self.errors = 0
+        self.batch_sizes: Dict[int, int] = {}
+        self.total_wait_ms = 0.0
+        self.max_observed_wait_ms = 0.0
+
+    async def embed(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future, time.perf_counter()))
+        self.requests += 1
+        
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait_ms / 1000, self._flush)
+        
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run_batch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run_batch(self, batch: List[Tuple[str, asyncio.Future, float]]):
+        flushed = time.perf_counter()
+        for _, _, enqueued in batch:
+            wait_ms = (flushed - enqueued) * 1000
+            self.total_wait_ms += wait_ms
+            self.max_observed_wait_ms = max(self.max_observed_wait_ms, wait_ms)
+        self.batches += 1
+        self.batch_sizes[len(batch)] = self.batch_sizes.get(len(batch), 0) + 1
+        
+        # Perguntas idênticas no mesmo lote são enviadas uma única vez
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        self.api_inputs += len(texts)
+        
+        try:
+            vectors = await self.embeddings.aembed_documents(texts)
+        except Exception as e:
+            self.errors += 1
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        vectors_by_text = dict(zip(texts, vectors))
+        for text, future, _ in batch:
+            # Quem desistiu da pergunta (future cancelado) é ignorado
+            if not future.done():
+                future.set_result(vectors_by_text[text])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "requests": self.requests,
+            "batches": self.batches,
+            "api_inputs": self.api_inputs,
+            "errors": self.errors,
+            "avg_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "avg_wait_ms": round(self.total_wait_ms / self.requests, 2) if self.requests else 0.0,
+            "max_wait_ms_observed": round(self.max_observed_wait_ms, 2),
+        }
+
+query_embedder = QueryEmbeddingBatcher(embeddings_model, QUERY_EMBED_MAX_BATCH, QUERY_EMBED_MAX_WAIT_MS)
+
+# Persistent embedding cache
+class EmbeddingCache:
+    """SQLite-backed cache of chunk embeddings keyed by text hash and model.
+    
+    Lookups refresh the entry's `last_used` time and the least recently used
+    entries are evicted once `max_entries` is exceeded.
+    """
+
+    def __init__(self, path: str, model: str, max_entries: int = 50000):
+        self.path = path
+        self.model = model
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        
+        # Métricas
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Return the cached vector for each text (None on a miss)."""
+        keys = [self.key(text) for text in texts]
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            conn = self._connection()
+            unique_keys = list(dict.fromkeys(keys))
+            # Consultar em blocos para respeitar o limite de parâmetros do SQLite
+            for start in range(0, len(unique_keys), 500):
+                block = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(block))
+                rows = conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", block).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+            if found:
+                now = time.time()
+                conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+                conn.commit()
+        
+        vectors = [found.get(key) for key in keys]
+        hits = sum(1 for vector in vectors if vector is not None)
+        self.hits += hits
+        self.misses += len(vectors) - hits
+        return vectors
+
+    def put_many(self, texts: List[str], vectors: List[List[float]]) -> None:
+        """Store vectors for the given texts and evict the least recently used entries."""
+        now = time.time()
+        rows = [
+            (self.key(text), self.model, np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            conn = self._connection()
+            conn.executemany("INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)", rows)
+            count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            excess = count - self.max_entries
+            if excess > 0:
+                conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,)
+                )
+                self.evictions += excess
+            conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._connection().execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, embeddings_model.model, EMBEDDING_CACHE_MAX_ENTRIES)
+
+# Cache de respostas
+class AnswerCache:
+    """In-memory LRU cache of answers, looked up by exact question or by embedding similarity.
+    
+    Entries are scoped by `top_k`, the retrieval mode and the selected files, and keyed by the
+    version of that scope: adding or removing a document bumps the versions
+    of its file and of the unfiltered scope, so answers that may have changed
+    are dropped and answers computed while the change happened are not stored.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 3600, similarity: float = 0.95):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity = similarity
+        self._lock = threading.Lock()
+        self.entries: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+        # Versões: de cada arquivo e do corpus inteiro (consultas sem filtro)
+        self.file_versions: Dict[str, int] = {}
+        self.corpus_version = 0
+        # Matriz de embeddings por escopo, refeita quando o escopo muda
+        self._matrices: Dict[Tuple, Tuple[List[Tuple], np.ndarray]] = {}
+        
+        # Métricas
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @property
+    def semantic(self) -> bool:
+        return self.enabled and self.similarity <= 1
+
+    @staticmethod
+    def normalize(question: str) -> str:
+        """Case, spacing and final punctuation do not change the question."""
+        question = unicodedata.normalize("NFKC", question).casefold()
+        return " ".join(question.split()).rstrip(" ?!.")
+
+    def scope(self, top_k: int, file_paths: List[str], mode: str) -> Tuple:
+        """Return (top_k, mode, files, version of those files) under the lock."""
+        files = tuple(sorted(set(path for path in file_paths if path)))
+        version = tuple(self.file_versions.get(path, 0) for path in files) if files else self.corpus_version
+        return top_k, mode, files, version
+
+    def _alive(self, key: Tuple, entry: Dict[str, Any], now: float) -> bool:
+        if now - entry["created_at"] <= self.ttl_seconds:
+            return True
+        self._drop(key)
+        self.expirations += 1
+        return False
+
+    def _drop(self, key: Tuple) -> None:
+        entry = self.entries.pop(key)
+        self._matrices.pop(entry["scope"], None)
+
+    def get(self, question: str, top_k: int, file_paths: List[str], mode: str) -> Optional[Dict[str, Any]]:
+        """Return the entry cached for exactly this question (normalized) and scope."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            key = (self.normalize(question), self.scope(top_k, file_paths, mode))
+            entry = self.entries.get(key)
+            if entry is None or not self._alive(key, entry, time.time()):
+                return None
+            self.entries.move_to_end(key)
+            self.exact_hits += 1
+            return entry
+
+    def get_similar(self, embedding: List[float], top_k: int, file_paths: List[str], mode: str) -> Optional[Dict[str, Any]]:
+        """Return the entry of the most similar cached question of the same scope, if similar enough."""
+        if not self.semantic:
+            return None
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        with self._lock:
+            scope = self.scope(top_k, file_paths, mode)
+            if scope not in self._matrices:
+                keys = [key for key, entry in self.entries.items() if entry["scope"] == scope and entry["embedding"] is not None]
+                matrix = np.stack([self.entries[key]["embedding"] for key in keys]) if keys else np.zeros((0, len(query)), dtype=np.float32)
+                self._matrices[scope] = (keys, matrix)
+            keys, matrix = self._matrices[scope]
+            if not keys or matrix.shape[1] != len(query):
+                return None
+            similarities = matrix @ query
+            best = int(np.argmax(similarities))
+            key = keys[best]
+            if similarities[best] < self.similarity or not self._alive(key, self.entries[key], time.time()):
+                return None
+            self.entries.move_to_end(key)
+            self.semantic_hits += 1
+            return {**self.entries[key], "similarity": round(float(similarities[best]), 4)}
+
+    def miss(self) -> None:
+        with self._lock:
+            self.misses += 1
+
+    def version(self, top_k: int, file_paths: List[str], mode: str) -> Tuple:
+        """Return the scope to pass to put() once the answer is ready."""
+        with self._lock:
+            return self.scope(top_k, file_paths, mode)
+
+    def put(
+        self,
+        scope: Tuple,
+        question: str,
+        embedding: Optional[List[float]],
+        answer: str,
+        sources: List[Dict[str, Any]],
+    ) -> None:
+        """Store an answer computed for `scope` (as returned by version() before retrieval)."""
+        if not self.enabled:
+            return
+        top_k, mode, files, _ = scope
+        with self._lock:
+            # Os documentos mudaram durante a consulta: a resposta pode estar desatualizada
+            if self.scope(top_k, list(files), mode) != scope:
+                return
+            key = (self.normalize(question), scope)
+            if key in self.entries:
+                self._drop(key)
+            vector = None
+            if embedding is not None:
+                vector = np.asarray(embedding, dtype=np.float32)
+                vector = vector / (np.linalg.norm(vector) or 1.0)
+            self.entries[key] = {
+                "answer": answer,
+                "sources": sources,
+                "embedding": vector,
+                "scope": scope,
+                "created_at": time.time(),
+            }
+            if vector is not None:
+                self._matrices.pop(scope, None)
+            while len(self.entries) > self.max_entries:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, file_paths: Optional[List[str]]) -> int:
+        """Drop the answers that depend on `file_paths` (and every unfiltered answer); None drops every answer."""
+        with self._lock:
+            if file_paths is None:
+                file_paths = list(self.file_versions) + [path for entry in self.entries.values() for path in entry["scope"][2]]
+            changed = set(path for path in file_paths if path)
+            self.corpus_version += 1
+            for path in changed:
+                self.file_versions[path] = self.file_versions.get(path, 0) + 1
+            stale = [key for key, entry in self.entries.items() if not entry["scope"][2] or changed.intersection(entry["scope"][2])]
+            for key in stale:
+                self._drop(key)
+            self.invalidations += len(stale)
+            return len(stale)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "similarity": self.similarity,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.exact_hits + self.semantic_hits) / lookups, 4) if lookups else 0.0,
+            "exact_hit_rate": round(self.exact_hits / lookups, 4) if lookups else 0.0,
+            "semantic_hit_rate": round(self.semantic_hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+answer_cache = AnswerCache(ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_SIMILARITY)
+
+# Armazenamento dos chunks em SQLite
+class ChunkStore:
+    """SQLite store of chunk text and metadata keyed by FAISS id.
+    
+    Searches read only the chunks they return, and per-document lookups
+    (filtering, duplicate detection) use the indexes on `source`,
+    `file_path` and `upload_time` instead of scanning every chunk. Deleted
+    chunks are kept, flagged, until compaction removes their vectors. The
+    text is also indexed in an FTS5 table (kept in sync by triggers) for
+    BM25 lexical search.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Uma conexão por thread: as leituras das buscas não disputam um lock
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            # INSERT OR REPLACE também precisa disparar o trigger de remoção do índice léxico
+            conn.execute("PRAGMA recursive_triggers=ON")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                "faiss_id INTEGER PRIMARY KEY, text TEXT NOT NULL, metadata TEXT NOT NULL, "
+                "source TEXT, file_path TEXT, upload_time TEXT, content_hash TEXT, "
+                "deleted INTEGER NOT NULL DEFAULT 0)"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(chunks)")}
+            if "deleted" not in columns:
+                conn.execute("ALTER TABLE chunks ADD COLUMN deleted INTEGER NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source)")
+            conn.execute("CREATE INDEX IF NOT EXISTS chunks_file_path ON chunks (file_path, content_hash)")
+            conn.execute("CREATE INDEX IF NOT EXISTS chunks_upload_time ON chunks (upload_time)")
+            # Só os tombstones: deleted_ids() não percorre a tabela inteira
+            conn.execute("CREATE INDEX IF NOT EXISTS chunks_deleted ON chunks (faiss_id) WHERE deleted = 1")
+            
+            # Índice léxico (BM25) sobre o texto dos chunks, sem acentos
+            has_fts = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunks_fts'").fetchone()
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5("
+                "text, content='chunks', content_rowid='faiss_id', tokenize='unicode61 remove_diacritics 2')"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS chunks_fts_insert AFTER INSERT ON chunks BEGIN "
+                "INSERT INTO chunks_fts (rowid, text) VALUES (new.faiss_id, new.text); END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS chunks_fts_delete AFTER DELETE ON chunks BEGIN "
+                "INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.faiss_id, old.text); END"
+            )
+            if not has_fts:
+                # Bancos anteriores ao índice léxico: indexar os chunks existentes
+                conn.execute("INSERT INTO chunks_fts (chunks_fts) VALUES ('rebuild')")
+            conn.commit()
+            self._local.conn = conn
+        return conn
+
+    def add_many(self, faiss_ids: List[int], texts: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        """Store chunks under the given FAISS ids (replacing existing rows)."""
+        rows = [
+            (
+                int(faiss_id), text, json.dumps(metadata, ensure_ascii=False),
+                metadata.get("source"), metadata.get("file_path"), metadata.get("upload_time"),
+                metadata.get("content_hash") or chunk_hash(text),
+            )
+            for faiss_id, text, metadata in zip(faiss_ids, texts, metadatas)
+        ]
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunks (faiss_id, text, metadata, source, file_path, upload_time, content_hash) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            conn.commit()
+
+    def _update_ids(self, sql: str, faiss_ids: List[int]) -> int:
+        ids = [int(faiss_id) for faiss_id in faiss_ids]
+        changed = 0
+        with self._lock:
+            conn = self._connection()
+            for start in range(0, len(ids), 500):
+                block = ids[start:start + 500]
+                placeholders = ",".join("?" * len(block))
+                changed += conn.execute(sql.format(placeholders=placeholders), block).rowcount
+            conn.commit()
+        return changed
+
+    def mark_deleted(self, faiss_ids: List[int]) -> int:
+        """Flag chunks as deleted (they stop being returned) and return how many changed."""
+        return self._update_ids("UPDATE chunks SET deleted = 1 WHERE deleted = 0 AND faiss_id IN ({placeholders})", faiss_ids)
+
+    def remove(self, faiss_ids: List[int]) -> int:
+        """Delete chunks for good (after compaction removed their vectors)."""
+        return self._update_ids("DELETE FROM chunks WHERE faiss_id IN ({placeholders})", faiss_ids)
+
+    def deleted_ids(self) -> List[int]:
+        """Return the FAISS ids of the chunks flagged as deleted (read from the partial index)."""
+        return [faiss_id for (faiss_id,) in self._connection().execute("SELECT faiss_id FROM chunks WHERE deleted = 1")]
+
+    def get_many(self, faiss_ids: List[int]) -> List[Optional[Document]]:
+        """Return the chunk stored for each FAISS id (None if missing), in the given order."""
+        ids = [int(faiss_id) for faiss_id in faiss_ids]
+        found: Dict[int, Document] = {}
+        conn = self._connection()
+        for start in range(0, len(ids), 500):
+            block = ids[start:start + 500]
+            placeholders = ",".join("?" * len(block))
+            rows = conn.execute(
+                f"SELECT faiss_id, text, metadata FROM chunks WHERE deleted = 0 AND faiss_id IN ({placeholders})", block
+            )
+            for faiss_id, text, metadata in rows:
+                found[faiss_id] = Document(page_content=text, metadata=json.loads(metadata))
+        return [found.get(faiss_id) for faiss_id in ids]
+
+    def ids_for_documents(self, keys: List[str]) -> List[int]:
+        """Return the sorted FAISS ids of the chunks whose `source` or `file_path` is in `keys`."""
+        keys = [key for key in dict.fromkeys(keys) if key]
+        if not keys:
+            return []
+        placeholders = ",".join("?" * len(keys))
+        rows = self._connection().execute(
+            f"SELECT faiss_id FROM chunks WHERE deleted = 0 AND file_path IN ({placeholders}) "
+            f"UNION SELECT faiss_id FROM chunks WHERE deleted = 0 AND source IN ({placeholders}) ORDER BY faiss_id",
+            keys + keys
+        )
+        return [faiss_id for (faiss_id,) in rows]
+
+    def existing(self, keys: List[Tuple[str, str]]) -> set:
+        """Return which of the (file_path, content hash) pairs are already stored."""
+        by_path: Dict[str, List[str]] = {}
+        for file_path, content_hash in keys:
+            by_path.setdefault(file_path, []).append(content_hash)
+        found = set()
+        conn = self._connection()
+        for file_path, hashes in by_path.items():
+            for start in range(0, len(hashes), 500):
+                block = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(block))
+                rows = conn.execute(
+                    f"SELECT content_hash FROM chunks WHERE deleted = 0 AND file_path IS ? AND content_hash IN ({placeholders})",
+                    [file_path] + block
+                )
+                found.update((file_path, content_hash) for (content_hash,) in rows)
+        return found
+
+    def truncate(self, next_id: int) -> int:
+        """Delete the chunks whose FAISS id is not below `next_id` and return how many were removed."""
+        with self._lock:
+            conn = self._connection()
+            removed = conn.execute("DELETE FROM chunks WHERE faiss_id >= ?", (next_id,)).rowcount
+            conn.commit()
+        return removed
+
+    def search_lexical(self, question: str, k: int, keys: Optional[List[str]] = None) -> List[int]:
+        """Return the FAISS ids of the `k` chunks that best match `question` by BM25.
+        
+        Each word of the question is an optional term (an identifier such as
+        "ERR-1234" must match as a phrase); `keys` restricts the search to the
+        chunks of those documents (`source` or `file_path`), as in
+        ids_for_documents().
+        """
+        query = lexical_query(question)
+        if not query or k <= 0:
+            return []
+        sql = (
+            "SELECT chunks.faiss_id FROM chunks_fts JOIN chunks ON chunks.faiss_id = chunks_fts.rowid "
+            "WHERE chunks_fts MATCH ? AND chunks.deleted = 0"
+        )
+        params: List[Any] = [query]
+        keys = [key for key in dict.fromkeys(keys or []) if key]
+        if keys:
+            placeholders = ",".join("?" * len(keys))
+            sql += f" AND (chunks.file_path IN ({placeholders}) OR chunks.source IN ({placeholders}))"
+            params += keys + keys
+        sql += " ORDER BY bm25(chunks_fts) LIMIT ?"
+        params.append(k)
+        return [faiss_id for (faiss_id,) in self._connection().execute(sql, params)]
+
+    def count(self, include_deleted: bool = True) -> int:
+        where = "" if include_deleted else " WHERE deleted = 0"
+        return self._connection().execute(f"SELECT COUNT(*) FROM chunks{where}").fetchone()[0]
+
+    def sync(self) -> None:
+        """Write the WAL into the database file and fsync it."""
+        with self._lock:
+            self._connection().execute("PRAGMA wal_checkpoint(FULL)")
+
+    def stats(self) -> Dict[str, Any]:
+        conn = self._connection()
+        return {
+            "chunks": self.count(include_deleted=False),
+            "deleted_chunks": conn.execute("SELECT COUNT(*) FROM chunks WHERE deleted = 1").fetchone()[0],
+            "documents": conn.execute("SELECT COUNT(DISTINCT file_path) FROM chunks WHERE deleted = 0").fetchone()[0],
+            "size_bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+        }
+
+# Function to turn a question into an FTS5 query
+def lexical_query(question: str, max_terms: int = 32) -> str:
+    """Return an FTS5 query matching any word of `question` (words are quoted, so they match literally)."""
+    terms = []
+    for word in question.split():
+        word = word.strip(".,;:!?()[]{}<>\"'«»“”‘’¿¡")
+        if not re.search(r"\w", word):
+            continue
+        term = '"' + word.replace('"', '""') + '"'
+        if term not in terms:
+            terms.append(term)
+    return " OR ".join(terms[:max_terms])
+
+chunk_store = ChunkStore(CHUNK_STORE_PATH)
+
+# Banco de dados vetorial: índice FAISS + chunks no SQLite
+class VectorStore:
+    """FAISS index plus the chunk store holding the text and metadata of each vector.
+    
+    Vectors are identified by FAISS ids that never change: `ids` maps each
+    position to its id and is always increasing, so positions are found by
+    binary search. Positions past the end of the FAISS index belong to the
+    delta: vectors added after the index was built, kept as float32 and
+    searched exactly until compaction merges them into a new index. Deleted
+    ids are tombstoned (skipped by the searches) until compaction rebuilds
+    the index without them.
+    
+    A store is never modified once searches can see it: with_added() and
+    with_deleted() return a new store sharing the index and the buffers, which
+    the writer publishes by replacing `vector_db`, so searches run while
+    vectors are being added and keep a consistent view. Writes must start
+    from the latest store (they are serialized by `index_lock`).
+    """
+
+    def __init__(self, index: Any, chunks: ChunkStore, ids: Optional[np.ndarray] = None, mapped_from: Optional[str] = None):
+        self.index = index
+        self.chunks = chunks
+        # Arquivo do snapshot de onde o índice está mapeado (INDEX_MMAP)
+        self.mapped_from = mapped_from
+        ids = np.arange(index.ntotal, dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+        if len(ids) != index.ntotal:
+            raise ValueError(f"Index has {index.ntotal} vectors but {len(ids)} ids")
+        self._id_buffer = ids.copy()
+        self.ids = self._id_buffer[:len(ids)]
+        self._delta_buffer = np.empty((0, index.d), dtype=np.float32)
+        self.delta = self._delta_buffer[:0]
+        self.deleted: frozenset = frozenset()
+        self.next_id = int(ids[-1]) + 1 if len(ids) else 0
+
+    @property
+    def ntotal(self) -> int:
+        """Number of vectors in the index and in the delta (tombstoned ones included)."""
+        return len(self.ids)
+
+    def positions(self, faiss_ids: List[int]) -> np.ndarray:
+        """Return the positions of the given FAISS ids (ids not in the store are dropped)."""
+        ids = self.ids
+        faiss_ids = np.asarray(faiss_ids, dtype=np.int64)
+        positions = np.searchsorted(ids, faiss_ids)
+        found = positions < len(ids)
+        found[found] = ids[positions[found]] == faiss_ids[found]
+        return positions[found]
+
+    def with_added(self, embeddings: np.ndarray, faiss_ids: List[int]) -> "VectorStore":
+        """Return a store with the vectors added to the delta under `faiss_ids` (greater than every id in this one)."""
+        new_ids = np.asarray(faiss_ids, dtype=np.int64)
+        if len(self.ids) and len(new_ids) and new_ids[0] <= self.ids[-1]:
+            raise ValueError(f"FAISS id {new_ids[0]} is not greater than the last id {self.ids[-1]}")
+        store = copy.copy(self)
+        # Os buffers crescem em dobro; cada store só lê as posições da sua visão,
+        # então as buscas em andamento não enxergam o que é escrito depois dela
+        count, needed = len(self.ids), len(self.ids) + len(new_ids)
+        if needed > len(self._id_buffer):
+            store._id_buffer = np.empty(max(needed, 2 * len(self._id_buffer), 1024), dtype=np.int64)
+            store._id_buffer[:count] = self.ids
+        store._id_buffer[count:needed] = new_ids
+        store.ids = store._id_buffer[:needed]
+        
+        count, needed = len(self.delta), len(self.delta) + len(new_ids)
+        if needed > len(self._delta_buffer):
+            store._delta_buffer = np.empty((max(needed, 2 * len(self._delta_buffer), 1024), self.index.d), dtype=np.float32)
+            store._delta_buffer[:count] = self.delta
+        store._delta_buffer[count:needed] = embeddings
+        store.delta = store._delta_buffer[:needed]
+        if len(new_ids):
+            store.next_id = max(self.next_id, int(new_ids[-1]) + 1)
+        return store
+
+    def with_deleted(self, faiss_ids: List[int]) -> "VectorStore":
+        """Return a store with the given FAISS ids tombstoned."""
+        store = copy.copy(self)
+        store.deleted = self.deleted | frozenset(self.ids[self.positions(faiss_ids)].tolist())
+        return store
+
+    def reconstruct(self, positions: np.ndarray) -> np.ndarray:
+        """Return the vectors stored at `positions` (decoded, for quantized indexes)."""
+        positions = np.asarray(positions, dtype=np.int64)
+        vectors = np.empty((len(positions), self.index.d), dtype=np.float32)
+        in_index = positions < self.index.ntotal
+        if in_index.any():
+            vectors[in_index] = self.index.reconstruct_batch(np.ascontiguousarray(positions[in_index]))
+        if not in_index.all():
+            vectors[~in_index] = self.delta[positions[~in_index] - self.index.ntotal]
+        return vectors
+
+    def search(self, query: np.ndarray, k: int, params: Any = None, delta_positions: Optional[np.ndarray] = None) -> List[int]:
+        """Return the FAISS ids of the `k` nearest live vectors to `query` (a 1 x d array).
+        
+        `params` restricts the search of the index (IDSelector); `delta_positions`
+        restricts the delta to those positions.
+        """
+        ids, deleted, delta = self.ids, self.deleted, self.delta
+        base = self.index.ntotal
+        # Buscar alguns vetores a mais para compensar os apagados ainda no índice
+        fetch = k + len(deleted)
+        candidates: List[Tuple[float, int]] = []
+        if min(fetch, base) > 0:
+            if params is None:
+                distances, labels = self.index.search(query, min(fetch, base))
+            else:
+                distances, labels = self.index.search(query, min(fetch, base), params=params)
+            candidates += [(float(d), int(p)) for d, p in zip(distances[0], labels[0]) if 0 <= p < base]
+        
+        positions = np.arange(base, base + len(delta)) if delta_positions is None else delta_positions
+        if len(positions):
+            vectors = delta if delta_positions is None else delta[positions - base]
+            distances, labels = faiss.knn(query, np.ascontiguousarray(vectors), min(fetch, len(positions)))
+            candidates += [(float(d), int(positions[i])) for d, i in zip(distances[0], labels[0]) if i >= 0]
+        
+        candidates.sort()
+        found = [int(ids[position]) for _, position in candidates]
+        return [faiss_id for faiss_id in found if faiss_id not in deleted][:k]
+
+
 # WebSocket connection manager
 class ConnectionManager:
+    """Track the open WebSockets and the requests running on each of them."""
+
     def __init__(self):
         self.active_connections: List[WebSocket] = []
+        # Tarefas em andamento por conexão (request_id -> tarefa)
+        self.requests: Dict[WebSocket, Dict[str, asyncio.Task]] = {}
+        # As tarefas de uma conexão enviam mensagens uma de cada vez
+        self.send_locks: Dict[WebSocket, asyncio.Lock] = {}
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
         self.active_connections.append(websocket)
+        self.requests[websocket] = {}
+        self.send_locks[websocket] = asyncio.Lock()
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        """Forget the connection and cancel its requests (nobody will read the answers)."""
+        if websocket in self.active_connections:
+            self.active_connections.remove(websocket)
+        for task in self.requests.pop(websocket, {}).values():
+            task.cancel()
+        self.send_locks.pop(websocket, None)
+
+    def start_request(self, websocket: WebSocket, request_id: str, coro: Any) -> asyncio.Task:
+        """Run `coro` as a tracked task of the connection, forgotten when it finishes."""
+        requests = self.requests[websocket]
+        task = asyncio.create_task(coro)
+        requests[request_id] = task
+        task.add_done_callback(lambda _: requests.pop(request_id, None) if requests.get(request_id) is task else None)
+        return task
+
+    def in_flight(self, websocket: WebSocket) -> List[str]:
+        """Return the ids of the requests still running on the connection."""
+        return list(self.requests.get(websocket, {}))
+
+    def cancel_request(self, websocket: WebSocket, request_id: Optional[str] = None) -> List[str]:
+        """Cancel one request (or all of them, without `request_id`); returns the ids cancelled."""
+        requests = self.requests.get(websocket, {})
+        request_ids = [request_id] if request_id is not None else list(requests)
+        cancelled = []
+        for rid in request_ids:
+            task = requests.get(rid)
+            if task is not None and task.cancel():
+                cancelled.append(rid)
+        return cancelled
 
     async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+        lock = self.send_locks.get(websocket)
+        if lock is None:
+            await websocket.send_text(message)
+            return
+        async with lock:
+            await websocket.send_text(message)
 
     async def broadcast(self, message: str):
         for connection in self.active_connections:
@@ -76,17 +1137,50 @@ class QuestionRequest(BaseModel):
     question: str
     top_k: int = 5
     file_paths: List[str] = []  # Lista de caminhos de arquivos para filtrar a consulta
+    mode: Optional[str] = None  # vector, lexical ou hybrid (padrão: RETRIEVAL_MODE)
 
 class QuestionResponse(BaseModel):
     answer: str
     sources: List[Dict[str, Any]] = []
+    timings: Dict[str, float] = {}  # Tempo de cada etapa em milissegundos
+    cache: Optional[str] = None  # "exact" ou "semantic" quando a resposta veio do cache
 
 class DocumentInfo(BaseModel):
+    document_id: str  # Nome do arquivo em uploads/ (usado em DELETE/PUT /documents/{document_id})
     filename: str
     upload_time: str
     file_path: str
     size: int
 
+class JobInfo(BaseModel):
+    job_id: str
+    filename: str
+    file_path: str
+    status: str = "queued"  # queued, extracting, embedding, indexing, done, failed
+    pages_total: int = 0
+    pages_done: int = 0
+    failed_pages: List[Dict[str, Any]] = []  # Páginas ignoradas por erro na extração
+    chunks_total: int = 0
+    chunks_done: int = 0
+    chunks_per_second: float = 0.0
+    created_at: float
+    started_at: Optional[float] = None
+    stage_started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    stage_timings: Dict[str, float] = {}  # Duração de cada etapa em milissegundos
+    result: Dict[str, Any] = {}
+    error: Optional[str] = None
+    content_hash: Optional[str] = None
+    replaces: Optional[str] = None  # Documento (file_path) removido quando o job terminar
+
+# Jobs de ingestão (em andamento e os últimos finalizados) e quem acompanha cada um
+ingestion_jobs: Dict[str, JobInfo] = {}
+job_subscribers: Dict[str, List[asyncio.Queue]] = {}
+
+# Arquivos já processados e jobs em andamento, por hash do conteúdo
+upload_hashes: Dict[str, str] = {}
+inflight_uploads: Dict[str, str] = {}
+
 # Initialize FastAPI app
 app = FastAPI(title="IA do Super Cérebro")
 
@@ -99,6 +1193,85 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Middleware rejecting oversized request bodies
+class UploadSizeLimitMiddleware:
+    """Answer 413 once a request body exceeds MAX_UPLOAD_BYTES.
+    
+    A larger Content-Length is rejected before the body is read; otherwise
+    the bytes are counted as they are received, so a chunked body is cut
+    off as soon as it crosses the limit (Starlette spools the multipart
+    body before the endpoint runs, so the endpoint's own check comes too late).
+    """
+
+    def __init__(self, app: ASGIApp, limit: int) -> None:
+        self.app = app
+        self.limit = limit
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.limit:
+            response = JSONResponse(
+                status_code=413,
+                content={"detail": f"File too large (limit: {MAX_UPLOAD_BYTES} bytes)"},
+            )
+            await response(scope, receive, send)
+            return
+        
+        received = 0
+        
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.limit:
+                    # Convertida em resposta 413 pelo tratamento de HTTPException do app
+                    raise HTTPException(status_code=413, detail=f"File too large (limit: {MAX_UPLOAD_BYTES} bytes)")
+            return message
+        
+        await self.app(scope, limited_receive, send)
+
+app.add_middleware(UploadSizeLimitMiddleware, limit=MAX_UPLOAD_BYTES + UPLOAD_MULTIPART_OVERHEAD)
+
+# Cabeçalhos de uma conexão que não são repassados ao writer
+HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "upgrade", "host", "content-length", "content-encoding"}
+
+# Function to tell the requests that only the writer can answer
+def served_by_writer(method: str, path: str) -> bool:
+    """Return True for uploads, replacements, deletes and ingestion jobs."""
+    if path == "/jobs" or path.startswith("/jobs/"):
+        return True
+    return (method == "POST" and path == "/upload") or (method in ("PUT", "DELETE") and path.startswith("/documents/"))
+
+# Forward the writer's requests from reader workers
+@app.middleware("http")
+async def forward_to_writer(request: Request, call_next):
+    """On readers, relay uploads, deletes and job queries to the writer over WRITER_SOCKET_PATH."""
+    if worker_role == "writer" or not served_by_writer(request.method, request.url.path):
+        return await call_next(request)
+    headers = [(name, value) for name, value in request.headers.raw if name.decode("latin-1").lower() not in HOP_BY_HOP_HEADERS]
+    try:
+        async with httpx.AsyncClient(transport=httpx.AsyncHTTPTransport(uds=WRITER_SOCKET_PATH), timeout=None) as client:
+            upstream = await client.request(
+                request.method,
+                f"http://writer{request.url.path}",
+                params=request.query_params,
+                headers=headers,
+                content=request.stream(),
+            )
+    except httpx.TransportError as e:
+        logger.warning("Writer unavailable at %s: %s", WRITER_SOCKET_PATH, e)
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "The writer process is not available; try again shortly"},
+            headers={"Retry-After": str(max(1, math.ceil(INDEX_REFRESH_SECONDS)))},
+        )
+    response_headers = {name: value for name, value in upstream.headers.items() if name.lower() not in HOP_BY_HOP_HEADERS}
+    return Response(content=upstream.content, status_code=upstream.status_code, headers=response_headers)
+
 # Endpoint to list uploaded documents
 @app.get("/documents", response_model=List[DocumentInfo])
 async def list_documents():
@@ -111,7 +1284,8 @@ async def list_documents():
         documents = []
         for filename in os.listdir(UPLOADS_DIR):
             file_path = os.path.join(UPLOADS_DIR, filename)
-            if os.path.isfile(file_path):
+            # Arquivos ocultos são uploads em andamento ou o registro de hashes
+            if os.path.isfile(file_path) and not filename.startswith("."):
                 # Get file stats
                 stats = os.stat(file_path)
                 # Format upload time from filename (assuming format: timestamp_filename)
@@ -126,6 +1300,7 @@ async def list_documents():
                 
                 # Create document info
                 doc_info = DocumentInfo(
+                    document_id=filename,
                     filename=original_filename,  # Nome original sem o timestamp
                     upload_time=upload_time,
                     file_path=file_path,
@@ -137,320 +1312,1997 @@ async def list_documents():
         documents.sort(key=lambda x: x.upload_time, reverse=True)
         return documents
     except Exception as e:
-        print(f"Error listing documents: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error listing documents: %s", e)
         raise HTTPException(status_code=500, detail=f"Error listing documents: {str(e)}")
 
 
+# Function to list the units of work of a document extraction
+def page_ranges(file_path: str) -> List[Tuple[int, int]]:
+    """Split a document into [start, end) page ranges to extract in parallel."""
+    file_extension = os.path.splitext(file_path)[1].lower()
+    if file_extension != '.pdf':
+        return [(0, 1)]
+    with pdfplumber.open(file_path) as pdf:
+        total = len(pdf.pages)
+    return [(start, min(start + PDF_PAGES_PER_TASK, total)) for start in range(0, total, PDF_PAGES_PER_TASK)]
+
+# Function to extract a range of pages (runs on the ingestion process pool)
+def extract_pages(file_path: str, start: int, end: int) -> List[Dict[str, Any]]:
+    """Extract pages [start, end) of a document.
+    
+    Each result has the 1-based `page`, its `text`, the extraction time in
+    `ms` and an `error` message when the page could not be read (the page is
+    reported instead of failing the whole document). TXT and Markdown files
+    are a single page.
+    """
+    file_extension = os.path.splitext(file_path)[1].lower()
+    
+    if file_extension == '.pdf':
+        # Extract text from PDF
+        results = []
+        with pdfplumber.open(file_path) as pdf:
+            for number in range(start, min(end, len(pdf.pages))):
+                page_start = time.perf_counter()
+                page = pdf.pages[number]
+                try:
+                    text, error = page.extract_text() or "", None
+                except Exception as e:
+                    text, error = "", f"{type(e).__name__}: {e}"
+                finally:
+                    page.flush_cache()
+                results.append({
+                    "page": number + 1,
+                    "text": text,
+                    "ms": round((time.perf_counter() - page_start) * 1000, 2),
+                    "error": error,
+                })
+        return results
+    
+    elif file_extension in ('.txt', '.md'):
+        # Extract text from TXT / Markdown
+        page_start = time.perf_counter()
+        with open(file_path, 'r', encoding='utf-8') as file:
+            text = file.read()
+        return [{"page": 1, "text": text, "ms": round((time.perf_counter() - page_start) * 1000, 2), "error": None}]
+    
+    else:
+        # Unsupported file type
+        raise ValueError(f"Unsupported file type: {file_extension}")
+
+# Generator over the pages of a document
+def iter_document_pages(file_path: str) -> Iterator[Dict[str, Any]]:
+    """Yield the extracted pages of a document in order, one range at a time."""
+    for start, end in page_ranges(file_path):
+        yield from extract_pages(file_path, start, end)
+
 # Function to extract text from a file
 def extract_text(file_path: str) -> str:
-    """Extract text from a file based on its extension."""
+    """Extract text from a file based on its extension (pages that fail are skipped)."""
     try:
-        file_extension = os.path.splitext(file_path)[1].lower()
-        
-        if file_extension == '.pdf':
-            # Extract text from PDF
-            text = ""
-            with pdfplumber.open(file_path) as pdf:
-                for page in pdf.pages:
-                    page_text = page.extract_text() or ""
-                    text += page_text + "\n\n"
-            return text
-        
-        elif file_extension == '.txt':
-            # Extract text from TXT
-            with open(file_path, 'r', encoding='utf-8') as file:
-                return file.read()
-        
-        elif file_extension == '.md':
-            # Extract text from Markdown
-            with open(file_path, 'r', encoding='utf-8') as file:
-                return file.read()
-        
-        else:
-            # Unsupported file type
-            raise ValueError(f"Unsupported file type: {file_extension}")
+        pages = []
+        for page in iter_document_pages(file_path):
+            if page["error"]:
+                logger.warning("Skipping page %s of %s: %s", page["page"], file_path, page["error"])
+                continue
+            pages.append(page["text"])
+        return "\n\n".join(pages)
     
     except Exception as e:
-        print(f"Error extracting text from {file_path}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error extracting text from %s: %s", file_path, e)
         return ""
 
+# Padrões de pontos de corte preferidos, do melhor para o pior
+PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n\s*")
+SENTENCE_BREAK = re.compile(r"[.!?;:\u2026][\"'\)\]]*(?=\s)|\n")
+WORD_BREAK = re.compile(r"\s+")
+
+# Tabelas por token do vocabulário, montadas uma vez por processo
+token_tables: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+def get_token_tables() -> Tuple[np.ndarray, np.ndarray]:
+    """Return, for every token id, how many characters start in it and whether it starts mid-character."""
+    global token_tables
+    if token_tables is None:
+        size = tokenizer.max_token_value + 1
+        char_starts = np.zeros(size, dtype=np.int64)
+        starts_mid_char = np.zeros(size, dtype=np.int64)
+        for token in range(size):
+            try:
+                data = tokenizer.decode_single_token_bytes(token)
+            except KeyError:
+                continue
+            # Bytes de continuação UTF-8 (10xxxxxx) não iniciam um caractere
+            char_starts[token] = sum(1 for byte in data if byte & 0xC0 != 0x80)
+            starts_mid_char[token] = bool(data) and data[0] & 0xC0 == 0x80
+        token_tables = (char_starts, starts_mid_char)
+    return token_tables
+
+# Function to map each token to the character where it starts
+def token_char_offsets(tokens: List[int]) -> np.ndarray:
+    """Return the start character of each token without decoding the tokens."""
+    char_starts, starts_mid_char = get_token_tables()
+    ids = np.asarray(tokens, dtype=np.int64)
+    chars_before = np.concatenate(([0], np.cumsum(char_starts[ids])[:-1]))
+    # Um token que começa no meio de um caractere pertence a esse caractere
+    return chars_before - starts_mid_char[ids]
+
+# Function to split text into token chunks
+def chunk_text(
+    text: str,
+    chunk_size: int = CHUNK_SIZE_TOKENS,
+    chunk_overlap: int = CHUNK_OVERLAP_TOKENS,
+    page_starts: Optional[List[Tuple[int, int]]] = None,
+) -> List[Dict[str, Any]]:
+    """Split text into chunks of at most `chunk_size` tokens.
+    
+    The text is tokenized once and chunks are cut on token offsets, preferring
+    paragraph breaks, then sentence ends, then whitespace, and consecutive
+    chunks overlap by up to `chunk_overlap` tokens. Each chunk is returned with
+    its `text`, character span (`start_char`, `end_char`), token count and,
+    when `page_starts` ((start_char, page_number) pairs) is given, its `page`.
+    """
+    tokens = tokenizer.encode_ordinary(text)
+    if not tokens:
+        return []
+    n = len(tokens)
+    offsets = token_char_offsets(tokens)
+    if offsets[-1] >= len(text):
+        # Texto com caracteres que não fazem o caminho de ida e volta: usar o texto decodificado
+        text = tokenizer.decode(tokens)
+        offsets = token_char_offsets(tokens)
+    char_bounds = np.append(offsets, len(text))
+    
+    # Índices de token onde é possível cortar, por prioridade
+    def break_tokens(pattern: re.Pattern) -> np.ndarray:
+        positions = np.fromiter((m.end() for m in pattern.finditer(text)), dtype=np.int64)
+        return np.unique(np.searchsorted(offsets, positions, side="left"))
+    levels = [break_tokens(PARAGRAPH_BREAK), break_tokens(SENTENCE_BREAK), break_tokens(WORD_BREAK)]
+    
+    chunk_overlap = min(chunk_overlap, chunk_size // 2)
+    min_tokens = max(1, chunk_size // 2)
+    spans = []
+    start = 0
+    while start < n:
+        end = min(start + chunk_size, n)
+        if end < n:
+            # Último ponto de corte preferido dentro da janela (sem deixar o chunk curto demais)
+            for level in levels:
+                i = np.searchsorted(level, end, side="right") - 1
+                if i >= 0 and level[i] >= start + min_tokens:
+                    end = int(level[i])
+                    break
+        spans.append((start, end))
+        if end >= n:
+            break
+        
+        # Sobreposição começando no primeiro início de frase (ou palavra) dentro da janela
+        next_start = end - chunk_overlap
+        if chunk_overlap > 0:
+            for level in levels[1:]:
+                i = np.searchsorted(level, next_start, side="left")
+                if i < len(level) and level[i] < end:
+                    next_start = int(level[i])
+                    break
+        start = max(next_start, start + 1)
+    
+    page_offsets = [offset for offset, _ in page_starts] if page_starts else []
+    chunks = []
+    for start, end in spans:
+        start_char, end_char = int(char_bounds[start]), int(char_bounds[end])
+        raw = text[start_char:end_char]
+        stripped = raw.strip()
+        if not stripped:
+            continue
+        start_char += len(raw) - len(raw.lstrip())
+        end_char = start_char + len(stripped)
+        chunk = {"text": stripped, "start_char": start_char, "end_char": end_char, "tokens": end - start}
+        if page_starts:
+            chunk["page"] = page_starts[max(0, bisect.bisect_right(page_offsets, start_char) - 1)][1]
+        chunks.append(chunk)
+    return chunks
+
 # Function to split text into chunks
 def split_text(text: str, chunk_size: int = 500) -> List[Document]:
     """Split text into chunks with a maximum token count."""
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=50,
-        length_function=lambda text: len(tokenizer.encode(text)),
-    )
-    texts = text_splitter.split_text(text)
+    texts = [chunk["text"] for chunk in chunk_text(text, chunk_size=chunk_size, chunk_overlap=50)]
     return [Document(page_content=t, metadata={"source": "document"}) for t in texts]
 
+# Function to choose the number of IVF lists for a corpus size
+def ivf_nlist(ntotal: int) -> int:
+    """Return IVF_NLIST, or ~4·√n lists keeping at least 39 training points per list."""
+    if IVF_NLIST > 0:
+        return IVF_NLIST
+    return max(1, min(int(4 * math.sqrt(ntotal)), ntotal // 39))
+
+# Function to shorten embeddings to fewer dimensions
+def truncate_vectors(vectors: np.ndarray, dimensions: int) -> np.ndarray:
+    """Keep the first `dimensions` components of each vector and re-normalize them.
+    
+    This is how text-embedding-3 embeddings are shortened, so truncated
+    vectors stay comparable with each other.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if not dimensions or vectors.shape[1] <= dimensions:
+        return vectors
+    vectors = np.ascontiguousarray(vectors[:, :dimensions])
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+# Function to create an empty FAISS index of the configured type
+def new_faiss_index(vectors: np.ndarray, index_type: str = INDEX_TYPE, encoding: str = VECTOR_ENCODING) -> Any:
+    """Create an empty index of `index_type`, trained on `vectors` when the type needs it.
+    
+    Vectors are stored with `encoding` (ignored by ivf_pq, which has its own
+    codes). IVF types need enough vectors to train their centroids (and PQ
+    its codebooks); with fewer the index falls back to flat until it is rebuilt.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type} (expected one of {', '.join(INDEX_TYPES)})")
+    if encoding not in VECTOR_ENCODINGS:
+        raise ValueError(f"Unknown vector encoding: {encoding} (expected one of {', '.join(VECTOR_ENCODINGS)})")
+    ntotal, dimension = vectors.shape
+    codec = VECTOR_ENCODINGS[encoding]
+    
+    if index_type == "hnsw":
+        description = f"HNSW{HNSW_M}" if codec == "Flat" else f"HNSW{HNSW_M},{codec}"
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        nlist = ivf_nlist(ntotal)
+        min_train = max(nlist, 2 ** PQ_NBITS if index_type == "ivf_pq" else 1)
+        if ntotal < min_train:
+            logger.warning("Not enough vectors to train %s (%d < %d), using flat index", index_type, ntotal, min_train)
+            return new_faiss_index(vectors, "flat", encoding)
+        if index_type == "ivf_pq":
+            codec = f"PQ{PQ_M}x{PQ_NBITS}"
+        description = f"IVF{nlist},{codec}"
+    else:
+        description = codec
+    
+    index = faiss.index_factory(dimension, description, faiss.METRIC_L2)
+    if index_type == "hnsw":
+        faiss.downcast_index(index).hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    if not index.is_trained:
+        sample = vectors
+        if ntotal > INDEX_TRAIN_MAX_VECTORS:
+            sample = vectors[np.random.default_rng(0).choice(ntotal, INDEX_TRAIN_MAX_VECTORS, replace=False)]
+        start = time.perf_counter()
+        index.train(sample)
+        logger.info("Trained %s index on %d vectors in %.1fs", description, len(sample), time.perf_counter() - start)
+    
+    configure_index(index)
+    return index
+
+# Function to get the type of a FAISS index
+def index_type_of(index: Any) -> str:
+    """Return the INDEX_TYPES name of `index`."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+# Function to get how an index stores its vectors
+def index_encoding_of(index: Any) -> str:
+    """Return the VECTOR_ENCODINGS name of `index`, or "pq" for IVF-PQ."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "pq"
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return "float16" if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    return "float32"
+
+# Function to check whether an index is memory-mapped from its snapshot file
+def index_is_mmapped(index: Any) -> bool:
+    """Return True when the IVF inverted lists of `index` are mapped from disk."""
+    if index_type_of(index) not in ("ivf_flat", "ivf_pq"):
+        return False
+    invlists = faiss.downcast_InvertedLists(faiss.extract_index_ivf(index).invlists)
+    return isinstance(invlists, faiss.OnDiskInvertedLists)
+
+# Function to read a snapshot from disk
+def read_snapshot(path: str) -> VectorStore:
+    """Load the index of a snapshot, memory-mapping it when INDEX_MMAP is set."""
+    index_path = os.path.join(path, "index.faiss")
+    if INDEX_MMAP:
+        index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP)
+        if not index_is_mmapped(index):
+            logger.warning("INDEX_MMAP only maps IVF indexes; the %s index was loaded into memory", index_type_of(index))
+    else:
+        index = faiss.read_index(index_path)
+    configure_index(index)
+    if worker_role == "writer":
+        import_pickled_docstore(path, index.ntotal)
+    # Snapshots sem ids.npy são anteriores às remoções: o id é a posição no índice
+    ids_path = os.path.join(path, "ids.npy")
+    ids = np.load(ids_path) if os.path.exists(ids_path) else None
+    return VectorStore(index, chunk_store, ids, mapped_from=index_path if index_is_mmapped(index) else None)
+
+# Function to migrate a pickled docstore into the chunk store
+def import_pickled_docstore(path: str, ntotal: int) -> None:
+    """Copy the chunks of an old `index.pkl` (langchain InMemoryDocstore) into the chunk store.
+    
+    Runs once: snapshots no longer contain a docstore, and stores that already
+    hold every chunk of the index are left untouched.
+    """
+    pickle_path = os.path.join(path, "index.pkl")
+    if not os.path.exists(pickle_path) or chunk_store.count() >= ntotal:
+        return
+    start = time.perf_counter()
+    with open(pickle_path, "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    texts, metadatas = [], []
+    for faiss_id in range(ntotal):
+        doc = docstore.search(index_to_docstore_id.get(faiss_id))
+        if not isinstance(doc, Document):
+            raise ValueError(f"Chunk for FAISS id {faiss_id} missing from {pickle_path}")
+        texts.append(doc.page_content)
+        metadatas.append(doc.metadata)
+    chunk_store.add_many(list(range(ntotal)), texts, metadatas)
+    chunk_store.sync()
+    logger.info("Imported %d chunks from %s in %.1fs", ntotal, pickle_path, time.perf_counter() - start)
+
+# Function to apply the search parameters to a FAISS index
+def configure_index(index: Any, ef_search: Optional[int] = None, nprobe: Optional[int] = None) -> None:
+    """Set efSearch (HNSW) or nprobe (IVF) and keep IVF vectors reconstructible by id."""
+    index_type = index_type_of(index)
+    if index_type == "hnsw":
+        faiss.downcast_index(index).hnsw.efSearch = ef_search or HNSW_EF_SEARCH
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        ivf = faiss.extract_index_ivf(index)
+        ivf.nprobe = nprobe or IVF_NPROBE
+        # Necessário para reconstruct_batch (busca filtrada e reconstrução do índice)
+        if ivf.direct_map.type == faiss.DirectMap.NoMap:
+            ivf.make_direct_map()
+
+# Function to read the search parameters of a FAISS index
+def search_params_of(index: Any) -> Dict[str, int]:
+    """Return the configure_index() arguments that reproduce the search settings of `index`."""
+    index_type = index_type_of(index)
+    if index_type == "hnsw":
+        return {"ef_search": faiss.downcast_index(index).hnsw.efSearch}
+    if index_type in ("ivf_flat", "ivf_pq"):
+        return {"nprobe": faiss.extract_index_ivf(index).nprobe}
+    return {}
+
+# Function to describe the index for /stats and the manifest
+def index_info(index: Any) -> Dict[str, Any]:
+    """Return the type, size and search parameters of `index`."""
+    index_type = index_type_of(index)
+    info: Dict[str, Any] = {
+        "type": index_type,
+        "encoding": index_encoding_of(index),
+        "vectors": index.ntotal,
+        "dimension": index.d,
+        "mmap": index_is_mmapped(index),
+    }
+    if index_type == "hnsw":
+        hnsw = faiss.downcast_index(index).hnsw
+        info.update(M=hnsw.nb_neighbors(1), ef_search=hnsw.efSearch, ef_construction=hnsw.efConstruction)
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        ivf = faiss.extract_index_ivf(index)
+        info.update(nlist=ivf.nlist, nprobe=ivf.nprobe)
+    return info
+
 # Create a function to create a vector database
-def create_vector_db(documents: List[Document]) -> FAISS:
-    """Create a FAISS vector database from documents."""
+def create_vector_db(embeddings: List[List[float]], faiss_ids: List[int]) -> VectorStore:
+    """Create a vector database (index of type INDEX_TYPE) from the vectors of already stored chunks."""
     try:
-        print(f"Creating vector database with {len(documents)} documents")
-        db = FAISS.from_documents(documents, embeddings_model)
-        return db
+        logger.info("Creating vector database with %d documents", len(faiss_ids))
+        vectors = truncate_vectors(embeddings, VECTOR_DIMENSIONS)
+        index = new_faiss_index(vectors)
+        index.add(vectors)
+        return VectorStore(index, chunk_store, faiss_ids)
     except Exception as e:
-        print(f"Error creating vector database: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error creating vector database: %s", e)
         raise ValueError(f"Error creating vector database: {str(e)}")
 
+# Function to rebuild the vector database with another index type
+def rebuild_vector_db(
+    db: VectorStore,
+    index_type: str = INDEX_TYPE,
+    encoding: str = VECTOR_ENCODING,
+    dimensions: int = VECTOR_DIMENSIONS,
+) -> VectorStore:
+    """Return a copy of `db` whose vectors are in a new index of `index_type`.
+    
+    Vectors can also be re-encoded and shortened to `dimensions`. FAISS ids are
+    kept, so the chunk store stays valid, and deleted vectors are left out.
+    Vectors are read back from the current index, which is lossy when it is
+    quantized (sq8, IVF-PQ) or already truncated.
+    """
+    keep = live_positions(db)
+    ntotal = len(keep)
+    vectors = truncate_vectors(db.reconstruct(keep), dimensions)
+    index = new_faiss_index(vectors, index_type, encoding)
+    start = time.perf_counter()
+    index.add(vectors)
+    logger.info("Added %d vectors to the %s index in %.1fs", ntotal, index_type_of(index), time.perf_counter() - start)
+    rebuilt = VectorStore(index, db.chunks, db.ids[keep])
+    rebuilt.next_id = db.next_id
+    return rebuilt
+
+# Function to list the positions of the vectors that were not deleted
+def live_positions(db: VectorStore) -> np.ndarray:
+    """Return the positions of the vectors of `db` that are not tombstoned."""
+    deleted = db.positions(sorted(db.deleted))
+    return np.setdiff1d(np.arange(db.ntotal, dtype=np.int64), deleted)
+
+# Function to merge the delta and drop tombstoned vectors
+def merge_vector_db(db: VectorStore) -> VectorStore:
+    """Return a copy of `db` whose index holds the delta and none of the tombstoned vectors.
+    
+    The index keeps its type and training (IVF centroids, quantizer
+    parameters, HNSW settings). Without tombstones the delta is added to a
+    copy of the index; otherwise the live vectors are added to an empty one.
+    `db` itself is left untouched, so searches can keep using it meanwhile.
+    """
+    # clone_index não aceita listas mapeadas: ler uma cópia do arquivo do snapshot
+    index = faiss.read_index(db.mapped_from) if db.mapped_from else faiss.clone_index(db.index)
+    configure_index(index, **search_params_of(db.index))
+    if db.deleted:
+        keep = live_positions(db)
+        vectors = db.reconstruct(keep)
+        index.reset()
+        index.add(vectors)
+        ids = db.ids[keep]
+        logger.info("Purged %d deleted vectors (%d kept)", db.ntotal - len(keep), len(keep))
+    else:
+        index.add(db.delta)
+        ids = db.ids
+    merged = VectorStore(index, db.chunks, ids)
+    # Ids apagados nunca são reutilizados enquanto o processo estiver no ar
+    merged.next_id = db.next_id
+    return merged
+
+# Function to write a file atomically (temp file + fsync + rename)
+def write_file_atomic(path: str, data: bytes) -> None:
+    """Write `data` to `path` so readers only ever see the old or the new content."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_dir(os.path.dirname(path))
+
+# Function to persist a directory entry change (rename/create)
+def fsync_dir(path: str) -> None:
+    """Flush directory metadata so renames survive a crash (no-op where unsupported)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+# Function to read the index manifest
+def read_manifest() -> Optional[Dict[str, Any]]:
+    """Return the current manifest, or None for a legacy/empty index directory."""
+    if not os.path.exists(MANIFEST_PATH):
+        return None
+    with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+# Function to list the segments on disk
+def list_segments() -> List[Tuple[int, str]]:
+    """List the committed segment files as (sequence, path), oldest first."""
+    if not os.path.isdir(SEGMENTS_DIR):
+        return []
+    segments = []
+    for name in os.listdir(SEGMENTS_DIR):
+        stem, ext = os.path.splitext(name)
+        if ext == ".seg" and stem.isdigit():
+            segments.append((int(stem), os.path.join(SEGMENTS_DIR, name)))
+    return sorted(segments)
+
+# Function to read a segment from disk
+def read_segment(path: str) -> Optional[Dict[str, Any]]:
+    """Return the record of a segment file, or None when it is missing or truncated.
+    
+    A truncated segment (lost by a crash before it reached the disk) is
+    logged and treated as missing: the replay stops there, and the writer's
+    next segment takes its number.
+    """
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except (EOFError, pickle.UnpicklingError) as e:
+        logger.warning("Skipping unreadable segment %s: %s", path, e)
+        return None
+
+# Function to append a segment with new vectors and chunk metadata
+def append_segment(record: Dict[str, Any]) -> int:
+    """Durably append a segment record and return its sequence number.
+    
+    Must be called with `index_lock` held. The cost is proportional to the
+    record, not to the size of the index.
+    """
+    global segment_seq
+    os.makedirs(SEGMENTS_DIR, exist_ok=True)
+    seq = segment_seq + 1
+    path = os.path.join(SEGMENTS_DIR, f"{seq:010d}.seg")
+    write_file_atomic(path, pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL))
+    segment_seq = seq
+    return seq
+
+# Function to apply a segment record to the in-memory database
+def apply_segment(db: Optional[VectorStore], record: Dict[str, Any]) -> Optional[VectorStore]:
+    """Return `db` with a segment record applied (a new store; `db` itself is not modified).
+    
+    "add" records insert vectors and chunks under their FAISS ids, "delete"
+    records tombstone ids. Chunks are written under their FAISS ids, so
+    re-applying a segment whose effect is already in the chunk store is
+    harmless; readers leave the chunk store to the writer.
+    """
+    if record["op"] == "delete":
+        if worker_role == "writer":
+            chunk_store.mark_deleted(record["faiss_ids"])
+        return db.with_deleted(record["faiss_ids"]) if db is not None else None
+    if record["op"] != "add":
+        raise ValueError(f"Unknown segment operation: {record['op']}")
+    texts, embeddings, metadatas = record["texts"], record["embeddings"], record["metadatas"]
+    faiss_ids = record.get("faiss_ids")
+    if faiss_ids is None:
+        # Segmentos anteriores às remoções: o id é a posição no índice
+        start = db.ntotal if db is not None else 0
+        faiss_ids = list(range(start, start + len(texts)))
+    # Os chunks são gravados antes de os vetores ficarem visíveis para as buscas
+    if worker_role == "writer":
+        chunk_store.add_many(faiss_ids, texts, metadatas)
+    if db is None:
+        return create_vector_db(embeddings, faiss_ids)
+    return db.with_added(truncate_vectors(embeddings, db.index.d), faiss_ids)
+
 # Function to save the vector database
-def save_vector_db(db: FAISS) -> None:
-    """Save the vector database to disk."""
+def save_vector_db(db: VectorStore, watermark: Optional[int] = None) -> None:
+    """Write a full snapshot of the index and point the manifest at it.
+    
+    `db` must hold every segment up to `watermark` (by default the last one
+    written); its delta is merged first. The snapshot is written to a
+    temporary directory and published by atomically replacing
+    `manifest.json`, so a crash mid-save leaves the previous snapshot and its
+    segments intact, and readers only ever see complete snapshots. Chunks
+    live in the chunk store, which is flushed before the segments already
+    included in the new snapshot are removed.
+    """
+    global compacted_seq, snapshot_version
+    start = time.perf_counter()
     try:
-        # Ensure the directory exists
         os.makedirs(FAISS_INDEX_PATH, exist_ok=True)
+        with index_lock:
+            watermark = segment_seq if watermark is None else watermark
+            version = snapshot_version + 1
+        if len(db.delta):
+            db = merge_vector_db(db)
+        
+        # O índice de um store publicado não muda mais: serializar sem o lock
+        index_bytes = faiss.serialize_index(db.index)
+        ids = db.ids
+        
+        name = f"snapshot-{version:06d}"
+        tmp_dir = os.path.join(FAISS_INDEX_PATH, f".{name}.tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        with open(os.path.join(tmp_dir, "index.faiss"), "wb") as f:
+            f.write(index_bytes.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(os.path.join(tmp_dir, "ids.npy"), "wb") as f:
+            np.save(f, ids)
+            f.flush()
+            os.fsync(f.fileno())
+        snapshot_dir = os.path.join(FAISS_INDEX_PATH, name)
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+        os.replace(tmp_dir, snapshot_dir)
+        fsync_dir(FAISS_INDEX_PATH)
+        
+        # Os chunks dos segmentos que serão removidos precisam estar no disco
+        db.chunks.sync()
+        
+        # Publicar o snapshot
+        manifest = {
+            "version": version,
+            "snapshot": name,
+            "segment": watermark,
+            "created_at": time.time(),
+            "index_type": index_type_of(db.index),
+        }
+        write_file_atomic(MANIFEST_PATH, json.dumps(manifest).encode("utf-8"))
+        compacted_seq = watermark
+        snapshot_version = version
         
-        # Save the vector database
-        db.save_local(FAISS_INDEX_PATH)
-        print(f"Vector database saved to {FAISS_INDEX_PATH}")
+        # Remover o que já está no snapshot
+        for seq, path in list_segments():
+            if seq <= watermark:
+                os.remove(path)
+        for entry in os.listdir(FAISS_INDEX_PATH):
+            if entry.startswith("snapshot-") and entry != name:
+                shutil.rmtree(os.path.join(FAISS_INDEX_PATH, entry), ignore_errors=True)
+        
+        stage_seconds.observe(time.perf_counter() - start, stage="index_save")
+        logger.info("Vector database snapshot %s saved to %s (segments <= %d)", name, FAISS_INDEX_PATH, watermark)
     except Exception as e:
-        print(f"Error saving vector database: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error saving vector database: %s", e)
         raise ValueError(f"Error saving vector database: {str(e)}")
 
+# Function to compact the pending segments in the background
+def compact_vector_db() -> None:
+    """Merge the delta and pending segments into a new snapshot and purge deleted vectors (runs on the compaction thread).
+    
+    The new index is built from the store published when compaction
+    starts, without `index_lock`, so uploads and deletes go on meanwhile;
+    the writes that arrived during the build are then replayed on it under
+    the lock, and the result replaces the current store. Searches keep using
+    the current one until then.
+    """
+    global compaction_running, vector_db
+    try:
+        with index_lock:
+            db = vector_db
+            if db is None or (segment_seq == compacted_seq and not db.deleted):
+                return
+            purged = sorted(db.deleted)
+            watermark = segment_seq
+        
+        merged = db
+        if purged or len(db.delta):
+            merged = merge_vector_db(db)
+            with index_lock:
+                current = vector_db
+                if current is None or current.index is not db.index:
+                    # O índice foi trocado por outro caminho (recarga): descartar esta compactação
+                    logger.warning("Vector database replaced during compaction, discarding the merged index")
+                    return
+                vector_db = replay_writes(merged, db, current)
+        
+        # O snapshot tem exatamente os segmentos até o watermark; os seguintes continuam no disco
+        save_vector_db(merged, watermark)
+        if purged:
+            # Só agora, com o snapshot publicado, os chunks podem sair do disco
+            db.chunks.remove(purged)
+        if INDEX_MMAP and index_type_of(merged.index) in ("ivf_flat", "ivf_pq"):
+            remap_index(merged)
+    except Exception as e:
+        logger.exception("Error compacting vector database: %s", e)
+    finally:
+        compaction_running = False
+
+# Function to bring a compacted store up to date
+def replay_writes(merged: VectorStore, base: VectorStore, current: VectorStore) -> VectorStore:
+    """Return `merged` (built from `base`) with the adds and deletes published since `base` up to `current`.
+    
+    Must be called with `index_lock` held. Stores only grow, so the writes
+    are the ids after the last one of `base` (whose vectors are at the end
+    of the delta of `current`) and the tombstones `base` did not have.
+    """
+    added = len(current.ids) - len(base.ids)
+    if added:
+        merged = merged.with_added(current.delta[len(current.delta) - added:], current.ids[len(base.ids):].tolist())
+    deleted = current.deleted - base.deleted
+    if deleted:
+        merged = merged.with_deleted(sorted(deleted))
+    if added or deleted:
+        logger.info("Replayed %d added and %d deleted vectors written during compaction", added, len(deleted))
+    return merged
+
+# Function to switch the index back to the memory-mapped snapshot
+def remap_index(db: VectorStore) -> None:
+    """Publish the current store with the in-memory index of `db` replaced by the mapped copy of the snapshot just saved."""
+    global vector_db
+    manifest = read_manifest()
+    index_path = os.path.join(FAISS_INDEX_PATH, manifest["snapshot"], "index.faiss")
+    index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP)
+    configure_index(index, **search_params_of(db.index))
+    with index_lock:
+        # Uma compactação mais nova já pode ter trocado o índice
+        current = vector_db
+        if current is None or current.index is not db.index or index.ntotal != db.index.ntotal:
+            return
+        # Os vetores adicionados depois do snapshot estão no delta, que continua o mesmo
+        mapped = copy.copy(current)
+        mapped.index, mapped.mapped_from = index, index_path
+        vector_db = mapped
+    logger.info("Index memory-mapped from %s", manifest["snapshot"])
+
+# Function to schedule a compaction when enough segments are pending
+def maybe_schedule_compaction() -> None:
+    """Start a background compaction once COMPACTION_SEGMENTS segments, COMPACTION_TOMBSTONES deleted vectors or COMPACTION_DELTA_VECTORS new vectors are pending."""
+    global compaction_running
+    tombstones = len(vector_db.deleted) if vector_db is not None else 0
+    delta = len(vector_db.delta) if vector_db is not None else 0
+    if compaction_running or (
+        segment_seq - compacted_seq < COMPACTION_SEGMENTS and tombstones < COMPACTION_TOMBSTONES and delta < COMPACTION_DELTA_VECTORS
+    ):
+        return
+    compaction_running = True
+    compaction_executor.submit(compact_vector_db)
+
 # Function to load the vector database
-def load_vector_db() -> Optional[FAISS]:
-    """Load the vector database from disk."""
+def load_vector_db() -> Optional[VectorStore]:
+    """Load the latest snapshot from disk and replay the segments written after it.
+    
+    The writer also repairs the chunk store (rows left without a vector by a
+    crash or an interrupted compaction); readers only read it.
+    """
+    global segment_seq, compacted_seq, snapshot_version
     try:
-        # Check if the index file exists
-        if not os.path.exists(os.path.join(FAISS_INDEX_PATH, "index.faiss")):
-            print(f"Vector database file not found at {FAISS_INDEX_PATH}")
-            return None
+        # Localizar o snapshot atual (ou o formato antigo, direto em faiss_index/)
+        manifest = read_manifest()
+        if manifest:
+            base_path = os.path.join(FAISS_INDEX_PATH, manifest["snapshot"])
+            compacted_seq = manifest["segment"]
+            snapshot_version = manifest["version"]
+        else:
+            base_path = FAISS_INDEX_PATH
+            compacted_seq = 0
+            snapshot_version = 0
+        segment_seq = compacted_seq
         
-        # Load the vector database
-        db = FAISS.load_local(FAISS_INDEX_PATH, embeddings_model)
+        db = None
+        if os.path.exists(os.path.join(base_path, "index.faiss")):
+            # Load the vector database
+            # (os embeddings são sempre gerados fora do FAISS: em lote na ingestão e
+            # pelo micro-batcher nas consultas)
+            db = read_snapshot(base_path)
         
-        # Monkey patch the _embed_query method
-        def patched_embed_query(self, text):
-            return embeddings_model.embed_query(text)
+        # Reaplicar os segmentos gravados depois do snapshot
+        replayed = 0
+        for seq, path in list_segments():
+            if seq <= compacted_seq:
+                continue
+            record = read_segment(path)
+            if record is None:
+                # Segmento incompleto: nada depois dele foi confirmado
+                break
+            db = apply_segment(db, record)
+            segment_seq = seq
+            replayed += 1
         
-        # Apply the monkey patch
-        import types
-        db._embed_query = types.MethodType(patched_embed_query, db)
+        # Chunks apagados com vetor no índice viram tombstones até a compactação;
+        # os demais são sobras de uma compactação interrompida
+        deleted = chunk_store.deleted_ids()
+        if db is not None:
+            db = db.with_deleted(deleted)
+        if worker_role == "writer":
+            # Chunks sem vetor correspondente no índice não podem ser retornados pelas buscas
+            removed = chunk_store.truncate(db.next_id if db is not None else 0)
+            removed += chunk_store.remove([faiss_id for faiss_id in deleted if db is None or faiss_id not in db.deleted])
+            if removed:
+                logger.warning("Removed %d chunks without vectors from the chunk store", removed)
         
-        # Also patch the _embed_documents method
-        def patched_embed_documents(self, texts):
-            return [embeddings_model.embed_query(text) for text in texts]
+        if db is None:
+            logger.info("Vector database file not found at %s", FAISS_INDEX_PATH)
+            return None
         
-        # Apply the patch
-        db._embed_documents = types.MethodType(patched_embed_documents, db)
+        configure_index(db.index)
+        if index_encoding_of(db.index) not in (VECTOR_ENCODING, "pq"):
+            logger.warning("Index encoding is %s but VECTOR_ENCODING=%s; run rebuild_index.py to convert it", index_encoding_of(db.index), VECTOR_ENCODING)
+        if index_type_of(db.index) != INDEX_TYPE:
+            logger.warning("Index type is %s but INDEX_TYPE=%s; run rebuild_index.py to convert it", index_type_of(db.index), INDEX_TYPE)
         
-        print(f"Vector database loaded from {FAISS_INDEX_PATH}")
+        logger.info("Vector database loaded from %s (%d segments replayed)", base_path, replayed)
         return db
     except Exception as e:
-        print(f"Error loading vector database: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error loading vector database: %s", e)
         return None
 
-# Function to query the vector database
-@app.get("/query")
-async def query_vector_db(question: str, top_k: int = 5, file_paths: List[str] = []):
-    """Query the vector database for relevant documents."""
-    global vector_db
+# Function to bring a reader up to date with the writer
+def refresh_vector_db() -> bool:
+    """Apply the segments and the snapshot published by the writer since the last refresh; returns True when the index changed.
+    
+    A new snapshot is loaded next to the current one and swapped in with the
+    segments written after it; new segments are applied to the delta. The
+    searches in progress finish on the store they started with. A segment or
+    snapshot removed by a concurrent compaction ends the refresh early, and
+    the next one starts from the new manifest.
+    """
+    global vector_db, segment_seq, compacted_seq, snapshot_version
+    db, seq, watermark, version = vector_db, segment_seq, compacted_seq, snapshot_version
+    changed_paths: List[str] = []
+    applied = 0
+    manifest = read_manifest()
+    if manifest and manifest["version"] != snapshot_version:
+        try:
+            db = read_snapshot(os.path.join(FAISS_INDEX_PATH, manifest["snapshot"]))
+        except (FileNotFoundError, RuntimeError) as e:
+            logger.debug("Snapshot %s not readable yet: %s", manifest["snapshot"], e)
+            return False
+        seq = watermark = manifest["segment"]
+        version = manifest["version"]
+        db = db.with_deleted(chunk_store.deleted_ids())
     
-    if not vector_db:
+    for segment, path in list_segments():
+        if segment <= seq:
+            continue
+        # Um buraco na sequência significa uma compactação no meio do caminho
+        if segment != seq + 1:
+            break
+        record = read_segment(path)
+        if record is None:
+            break
+        db = apply_segment(db, record)
+        seq = segment
+        applied += 1
+        if record["op"] == "add":
+            changed_paths += answer_cache_keys(record["metadatas"])
+        else:
+            changed_paths += record.get("file_paths", [])
+    
+    if version == snapshot_version and seq == segment_seq:
+        return False
+    # Um snapshot novo só reorganiza o que já chegou pelos segmentos, a não ser que
+    # este reader tenha ficado para trás: os segmentos que ele pulou são desconhecidos
+    skipped = version != snapshot_version and segment_seq < watermark
+    swapped = version != snapshot_version
+    vector_db, segment_seq, compacted_seq, snapshot_version = db, seq, watermark, version
+    if skipped:
+        answer_cache.invalidate(None)
+    elif applied:
+        answer_cache.invalidate(changed_paths)
+    (logger.info if swapped else logger.debug)("Vector database refreshed (snapshot %d, segment %d, %d vectors)", version, seq, db.ntotal if db is not None else 0)
+    return True
+
+# Function to take the writer lock
+def acquire_writer_lock() -> bool:
+    """Take the exclusive lock on WRITER_LOCK_PATH without waiting; returns False when another process holds it.
+    
+    The lock is held until the process exits (it is released by the OS even
+    if the process crashes). Without fcntl (Windows) there is no lock and
+    the process assumes it is alone.
+    """
+    global writer_lock_file
+    if writer_lock_file is not None or fcntl is None:
+        return True
+    os.makedirs(FAISS_INDEX_PATH, exist_ok=True)
+    lock_file = open(WRITER_LOCK_PATH, "a+")
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(f"{os.getpid()}\n")
+    lock_file.flush()
+    writer_lock_file = lock_file
+    return True
+
+# Function to decide the role of this process
+def resolve_worker_role() -> str:
+    """Return "writer" or "reader" according to WORKER_ROLE, taking the writer lock when writing."""
+    if WORKER_ROLE not in WORKER_ROLES:
+        raise ValueError(f"Invalid WORKER_ROLE {WORKER_ROLE!r}; use one of {', '.join(WORKER_ROLES)}")
+    if WORKER_ROLE == "reader":
+        return "reader"
+    if acquire_writer_lock():
+        return "writer"
+    if WORKER_ROLE == "writer":
+        raise RuntimeError(f"Another process is the writer of {FAISS_INDEX_PATH} (lock {WRITER_LOCK_PATH})")
+    return "reader"
+
+# Endpoint with runtime statistics
+@app.get("/stats")
+async def get_stats():
+    """Return runtime statistics of the query path and of the index storage."""
+    db = vector_db
+    return {
+        "query_embedding": query_embedder.stats(),
+        "embedding_cache": embedding_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "chunk_store": chunk_store.stats(),
+        "index": {
+            **(index_info(db.index) if db is not None else {"vectors": 0}),
+            "delta_vectors": len(db.delta) if db is not None else 0,
+            "deleted_vectors": len(db.deleted) if db is not None else 0,
+            "role": worker_role,
+            "snapshot_version": snapshot_version,
+            "segment_seq": segment_seq,
+            "compacted_seq": compacted_seq,
+            "pending_segments": segment_seq - compacted_seq,
+            "compaction_running": compaction_running,
+        },
+    }
+
+# Endpoint with the metrics in the Prometheus text format
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Return the stage latency histograms and the token and cache counters for Prometheus."""
+    lines = [line for metric in metrics_registry for line in metric.render()]
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+# Function to hash a chunk's content
+def chunk_hash(text: str) -> str:
+    """Return the content hash used to detect duplicate chunks."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+# Function to resolve FAISS ids into documents
+def documents_for_ids(db: VectorStore, faiss_ids: List[int]) -> List[Document]:
+    """Fetch the documents stored for the given FAISS ids, keeping their order."""
+    return [doc for doc in db.chunks.get_many(faiss_ids) if doc is not None]
+
+# Function to run the similarity search (blocking, runs on the search thread pool)
+def search_vector_db(
+    db: VectorStore,
+    embedding: Optional[List[float]],
+    top_k: int,
+    file_paths: List[str],
+    question: str = "",
+    mode: str = "vector",
+) -> List[Document]:
+    """Run the similarity search for an already computed query embedding.
+    
+    `mode` "lexical" ranks chunks by BM25 over `question` only, and "hybrid"
+    fuses the BM25 and vector rankings by reciprocal rank fusion; without an
+    embedding (embeddings API unavailable) the search is lexical. The
+    candidates are re-ranked by maximal marginal relevance, whose relevance
+    term is the cosine similarity in "vector" mode and the fused score
+    otherwise (so exact keyword matches keep their rank), and near-duplicate
+    chunks are dropped; whenever either is on, MMR_FETCH_FACTOR times more
+    candidates are fetched so that `top_k` chunks are still returned.
+    """
+    # A pergunta é encurtada para as dimensões do índice (VECTOR_DIMENSIONS)
+    query = truncate_vectors(np.array([embedding], dtype=np.float32), db.index.d) if embedding is not None else None
+    # As quase duplicatas descartadas também precisam de candidatos a mais
+    rerank = MMR_LAMBDA < 1 or CONTEXT_DUPLICATE_SIMILARITY <= 1
+    fetch_k = top_k * MMR_FETCH_FACTOR if rerank else top_k
+    if mode == "hybrid":
+        # Cada lista contribui com mais candidatos do que o necessário para a fusão
+        fetch_k = max(fetch_k, 2 * top_k)
+    filters = file_paths if file_paths and len(file_paths) > 0 and file_paths[0] is not None else []
+    
+    result_ids: List[int] = []
+    fused: Optional[Dict[int, float]] = None
+    if mode != "lexical" and query is not None:
+        with timed_stage("faiss_search"):
+            result_ids = vector_candidates(db, query, fetch_k, filters)
+    if mode != "vector" or query is None:
+        with timed_stage("lexical_search"):
+            lexical_ids = db.chunks.search_lexical(question, fetch_k, filters)
+        fused = reciprocal_rank_fusion([result_ids, lexical_ids])
+        result_ids = list(fused)
+    
+    if query is not None and len(result_ids) > 1 and rerank:
+        # Re-ranquear com os vetores guardados no índice (na ordem dos resultados;
+        # chunks ainda sem vetor no índice ficam de fora)
+        positions = db.positions(result_ids)
+        result_ids = db.ids[positions].tolist()
+        vectors = db.reconstruct(positions)
+        relevance = None
+        if fused is not None:
+            # A relevância é a pontuação da fusão, não o cosseno: com MMR_LAMBDA = 1
+            # a ordem do RRF é mantida e só as quase duplicatas saem
+            scores = np.array([fused[faiss_id] for faiss_id in result_ids], dtype=np.float32)
+            relevance = scores / max(float(scores.max()), 1e-12) if len(scores) else scores
+        chosen = mmr_select(query[0], vectors, top_k, MMR_LAMBDA, CONTEXT_DUPLICATE_SIMILARITY, relevance)
+        result_ids = [result_ids[i] for i in chosen]
+    return documents_for_ids(db, result_ids[:top_k])
+
+# Function to run the FAISS part of a search
+def vector_candidates(db: VectorStore, query: np.ndarray, k: int, file_paths: List[str]) -> List[int]:
+    """Return the FAISS ids of the `k` vectors nearest to `query` (a 1 x d array), in order."""
+    if file_paths:
+        # Buscar apenas entre os vetores dos documentos selecionados
+        # (os chunks apagados já ficam de fora; as posições vêm do mapa de ids do índice)
+        positions = db.positions(db.chunks.ids_for_documents(file_paths))
+        logger.debug("Filtering results by %d file paths (%d vectors)", len(file_paths), len(positions))
+        if not len(positions):
+            return []
+        
+        k = min(k, len(positions))
+        
+        index_type = index_type_of(db.index)
+        if len(positions) <= FILTERED_SEARCH_EXACT_MAX or index_type == "hnsw":
+            # Pontuar só os vetores selecionados: o custo não depende do resto do corpus
+            vectors = db.reconstruct(positions)
+            distances = ((vectors - query) ** 2).sum(axis=1)
+            best = np.argpartition(distances, k - 1)[:k]
+            result_ids = db.ids[positions[best[np.argsort(distances[best])]]].tolist()
+        else:
+            # Seleções grandes usam a busca do FAISS restrita às posições selecionadas
+            # (o HNSW não aceita seletores, por isso fica sempre no caminho exato)
+            in_index = positions < db.index.ntotal
+            selector = faiss.IDSelectorBatch(positions[in_index])
+            if index_type == "flat":
+                params = faiss.SearchParameters(sel=selector)
+            else:
+                params = faiss.SearchParametersIVF(sel=selector, nprobe=faiss.extract_index_ivf(db.index).nprobe)
+            result_ids = db.search(query, k, params, delta_positions=positions[~in_index])
+    else:
+        # Se não houver filtros, retornar todos os documentos relevantes
+        result_ids = db.search(query, k)
+    return result_ids
+
+# Function to merge rankings
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = RRF_K) -> Dict[int, float]:
+    """Merge ranked id lists: each id scores the sum of 1 / (k + rank) over the lists it appears in.
+    
+    Returns the scores ordered from the best id to the worst.
+    """
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, faiss_id in enumerate(ranking, start=1):
+            scores[faiss_id] = scores.get(faiss_id, 0.0) + 1.0 / (k + rank)
+    return {faiss_id: scores[faiss_id] for faiss_id in sorted(scores, key=scores.__getitem__, reverse=True)}
+
+# Function to pick relevant and diverse results
+def mmr_select(
+    query: np.ndarray,
+    vectors: np.ndarray,
+    k: int,
+    lambda_mult: float = MMR_LAMBDA,
+    duplicate_similarity: float = CONTEXT_DUPLICATE_SIMILARITY,
+    relevance: Optional[np.ndarray] = None,
+) -> List[int]:
+    """Return the indices of up to `k` rows of `vectors` chosen by maximal marginal relevance.
+    
+    Each pick maximizes `lambda_mult * relevance - (1 - lambda_mult) * max
+    similarity to the rows already picked`, where `relevance` defaults to the
+    cosine similarity to the query; rows at least `duplicate_similarity`
+    similar to a picked row are never picked.
+    """
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    if relevance is None:
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        relevance = vectors @ query
+    similarity = vectors @ vectors.T
+    
+    redundancy = np.zeros(len(vectors), dtype=np.float32)
+    available = np.ones(len(vectors), dtype=bool)
+    chosen: List[int] = []
+    while len(chosen) < k and available.any():
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        chosen.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+        available &= similarity[best] < duplicate_similarity
+    return chosen
+
+# Function to retrieve relevant documents without blocking the event loop
+async def retrieve_documents(
+    question: str,
+    top_k: int = 5,
+    file_paths: Optional[List[str]] = None,
+    embedding: Optional[List[float]] = None,
+    mode: Optional[str] = None,
+) -> Tuple[List[Document], Dict[str, float]]:
+    """Embed the question asynchronously and search on the thread pool.
+    
+    `mode` is "vector", "lexical" or "hybrid" (default RETRIEVAL_MODE);
+    the lexical search needs no embedding, and is also used when the
+    embeddings API fails or times out. `embedding` skips the embedding step
+    when the question was already embedded (semantic cache lookup). Returns
+    the documents found and the time spent in each stage (in ms);
+    `lexical_fallback` is set when the search fell back to BM25.
+    """
+    db = vector_db
+    
+    if not db:
         raise ValueError("Vector database not initialized")
+    mode = retrieval_mode(mode)
     
-    print(f"Querying vector database with question: '{question}'")
-    print(f"Vector database type: {type(vector_db)}")
-    print(f"Filtering by file paths: {file_paths}")
-    print(f"Embeddings model type: {type(embeddings_model)}")
+    file_paths = file_paths or []
+    logger.debug("Querying vector database with question: %r (file paths: %s)", question, file_paths)
     
     try:
-        print("Generating embeddings for the question...")
-        # Gerar embeddings para a pergunta usando o método embed_query diretamente
-        embedding = embeddings_model.embed_query(question)
-        print(f"Successfully generated embeddings of length {len(embedding)}")
-        
-        print("Performing similarity search...")
-        # Realizar a busca por similaridade
-        if file_paths and len(file_paths) > 0 and file_paths[0] is not None:
-            print(f"Filtering results by {len(file_paths)} file paths")
-            # Primeiro, obter todos os documentos relevantes
-            all_docs = vector_db.similarity_search_by_vector(embedding, k=top_k * 3)
+        start = time.perf_counter()
+        async with query_semaphore:
+            acquired = time.perf_counter()
             
-            # Filtrar manualmente os documentos com base nos caminhos de arquivo
-            filtered_docs = [
-                doc for doc in all_docs 
-                if 'source' in doc.metadata and doc.metadata['source'] in file_paths
-            ]
+            # Gerar embeddings para a pergunta (agrupada com as perguntas simultâneas)
+            embedded_before = embedding is not None or mode == "lexical"
+            if not embedded_before:
+                embedding = await embed_question(question)
+            embedded = time.perf_counter()
             
-            # Limitar ao número solicitado
-            docs = filtered_docs[:top_k]
-        else:
-            # Se não houver filtros, retornar todos os documentos relevantes
-            docs = vector_db.similarity_search_by_vector(embedding, k=top_k)
+            # Realizar a busca por similaridade no pool de threads
+            loop = asyncio.get_running_loop()
+            docs = await loop.run_in_executor(search_executor, search_vector_db, db, embedding, top_k, file_paths, question, mode)
+            searched = time.perf_counter()
         
-        print(f"Found {len(docs)} documents")
-        return docs
+        timings = {
+            "queue_ms": round((acquired - start) * 1000, 2),
+            "embedding_ms": round((embedded - acquired) * 1000, 2),
+            "search_ms": round((searched - embedded) * 1000, 2),
+            "retrieval_ms": round((searched - start) * 1000, 2),
+        }
+        if embedded_before:
+            del timings["embedding_ms"]
+        if embedding is None and mode != "lexical":
+            timings["lexical_fallback"] = 1
+        stage_seconds.observe(acquired - start, stage="query_queue")
+        stage_seconds.observe(searched - embedded, stage="search")
+        logger.debug("Found %d documents (%s) - timings: %s", len(docs), mode, timings)
+        return docs, timings
     
     except Exception as e:
-        print(f"Error querying vector database: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error querying vector database: %s", e)
         raise ValueError(f"Error querying vector database: {str(e)}")
 
-# Function to generate answer using OpenAI
-async def generate_answer(question: str, context_docs: List[Document]) -> str:
-    """Generate an answer using OpenAI based on the question and context documents."""
-    # Extract context from documents
-    context_text = "\n\n".join([doc.page_content for doc in context_docs])
-    print(f"Context length: {len(context_text)} characters")
+# Function to validate the retrieval mode of a request
+def retrieval_mode(mode: Optional[str]) -> str:
+    """Return `mode` (RETRIEVAL_MODE when empty), raising ValueError if it is unknown."""
+    mode = mode or RETRIEVAL_MODE
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode: {mode} (expected one of {', '.join(RETRIEVAL_MODES)})")
+    return mode
+
+# Function to embed a question, falling back to lexical search when the API is unavailable
+async def embed_question(question: str) -> Optional[List[float]]:
+    """Return the embedding of `question`, or None when the search must be lexical.
+    
+    When the embeddings API fails or takes longer than
+    QUERY_EMBED_TIMEOUT_SECONDS, None is returned for this question and for
+    every question of the next LEXICAL_FALLBACK_SECONDS, which then skip the
+    API call. With LEXICAL_FALLBACK_SECONDS = 0 the error is raised.
+    """
+    global embeddings_unavailable_until
+    if LEXICAL_FALLBACK_SECONDS <= 0:
+        with timed_stage("query_embedding"):
+            return await query_embedder.embed(question)
+    if time.time() < embeddings_unavailable_until:
+        return None
+    try:
+        with timed_stage("query_embedding"):
+            return await asyncio.wait_for(query_embedder.embed(question), QUERY_EMBED_TIMEOUT_SECONDS)
+    except Exception as e:
+        logger.warning("Query embedding failed (%s: %s); using lexical search for %ss", type(e).__name__, e, LEXICAL_FALLBACK_SECONDS)
+        embeddings_unavailable_until = time.time() + LEXICAL_FALLBACK_SECONDS
+        return None
+
+# Function to look a question up in the answer cache
+async def lookup_answer_cache(question: str, top_k: int, file_paths: List[str], mode: str) -> Tuple[Optional[Dict[str, Any]], Optional[List[float]], Dict[str, float]]:
+    """Look for a cached answer: same question first, then a similar enough one.
+    
+    Returns the cached entry (with `cache` set to "exact" or "semantic") or
+    None, the question embedding when it was computed for the semantic
+    lookup (so retrieval does not compute it again) and the timings in ms.
+    """
+    timings: Dict[str, float] = {}
+    if not answer_cache.enabled:
+        return None, None, timings
     
+    start = time.perf_counter()
+    embedding = None
+    entry = answer_cache.get(question, top_k, file_paths, mode)
+    if entry is not None:
+        entry = {**entry, "cache": "exact"}
+    elif answer_cache.semantic and mode != "lexical":
+        async with query_semaphore:
+            embedding = await embed_question(question)
+        timings["embedding_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        entry = answer_cache.get_similar(embedding, top_k, file_paths, mode) if embedding is not None else None
+        if entry is not None:
+            entry = {**entry, "cache": "semantic"}
+    if entry is None:
+        answer_cache.miss()
+        cache_lookups_total.inc(cache="answer", result="miss")
+    else:
+        cache_lookups_total.inc(cache="answer", result=entry["cache"])
+        logger.debug("Answer cache hit (%s) for question: %r", entry["cache"], question)
+    timings["cache_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return entry, embedding, timings
+
+# Function to pack the retrieved documents, recording the time spent
+def pack_documents(docs: List[Document], timings: Dict[str, float]) -> List[Document]:
+    """Run pack_context() and add `packing_ms` and `context_tokens` to `timings`."""
+    start = time.perf_counter()
+    packed, tokens = pack_context(docs)
+    timings["packing_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    timings["context_tokens"] = tokens
+    stage_seconds.observe(time.perf_counter() - start, stage="packing")
+    logger.debug("Packed %d chunks into %d (%d tokens)", len(docs), len(packed), tokens)
+    return packed
+
+# Function to query the vector database
+@app.get("/query")
+async def query_vector_db(question: str, top_k: int = 5, file_paths: List[str] = [], mode: Optional[str] = None):
+    """Query the vector database for relevant documents."""
     try:
-        print("Creating prompt...")
-        
-        # Create messages for the chat model
-        system_message = SystemMessage(content="Você é um assistente de IA especializado em responder perguntas com base no contexto fornecido. Use apenas as informações do contexto para responder. Se a informação não estiver no contexto, diga que não tem informações suficientes.")
+        docs, _ = await retrieve_documents(question, top_k, file_paths, mode=retrieval_mode(mode))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return docs
+
+# Function to fit the retrieved chunks into the context budget
+def pack_context(docs: List[Document], max_tokens: int = CONTEXT_MAX_TOKENS) -> Tuple[List[Document], int]:
+    """Return the chunks to send to the model, in rank order, and their token count.
+    
+    Repeated chunks are dropped and the text a chunk shares with a better
+    ranked chunk of the same file (the overlap between consecutive chunks)
+    is cut, using the character spans stored with each chunk. Chunks are
+    added until `max_tokens`; the first one that does not fit is truncated.
+    """
+    packed: List[Document] = []
+    covered: Dict[str, List[Tuple[int, int]]] = {}
+    seen_texts: set = set()
+    used = 0
+    for doc in docs:
+        text = doc.page_content
+        metadata = dict(doc.metadata)
+        if text in seen_texts:
+            continue
+        seen_texts.add(text)
         
-        user_message = HumanMessage(content=f"Contexto:\n\n{context_text}\n\nPergunta: {question}\n\nResponda usando apenas as informações do contexto acima.")
+        # Cortar o trecho já coberto por chunks do mesmo arquivo (início ou fim do chunk)
+        start, end = metadata.get("start_char"), metadata.get("end_char")
+        spans = covered.setdefault(metadata.get("file_path") or metadata.get("source") or "", [])
+        if isinstance(start, int) and isinstance(end, int) and end - start == len(text):
+            for span_start, span_end in spans:
+                if span_start <= start and end <= span_end:
+                    start = end
+                    break
+                if span_start <= start < span_end:
+                    start = span_end
+                elif span_start < end <= span_end:
+                    end = span_start
+            if start >= end:
+                continue
+            offset = metadata["start_char"]
+            raw = text[start - offset:end - offset]
+            text = raw.strip()
+            if not text:
+                continue
+            start += len(raw) - len(raw.lstrip())
+            metadata["start_char"], metadata["end_char"] = start, start + len(text)
+            spans.append((start, start + len(text)))
         
-        messages = [system_message, user_message]
+        # Encaixar no orçamento ("\n\n" entre os chunks conta como um token)
+        tokens = tokenizer.encode_ordinary(text)
+        remaining = max_tokens - used - (1 if packed else 0)
+        if remaining <= 0:
+            break
+        if len(tokens) > remaining:
+            text = tokenizer.decode(tokens[:remaining]).strip()
+            tokens = tokens[:remaining]
+            metadata["truncated"] = True
+        used += len(tokens) + (1 if packed else 0)
+        packed.append(Document(page_content=text, metadata=metadata))
+        if len(tokens) == remaining:
+            break
+    return packed, used
+
+# Function to build the prompt of an answer
+def build_answer_messages(question: str, context_docs: List[Document]) -> List[Any]:
+    """Build the chat messages asking the model to answer `question` from the context documents."""
+    # Extract context from documents
+    context_text = "\n\n".join([doc.page_content for doc in context_docs])
+    logger.debug("Context length: %d characters", len(context_text))
+    
+    # Create messages for the chat model
+    system_message = SystemMessage(content="Você é um assistente de IA especializado em responder perguntas com base no contexto fornecido. Use apenas as informações do contexto para responder. Se a informação não estiver no contexto, diga que não tem informações suficientes.")
+    
+    user_message = HumanMessage(content=f"Contexto:\n\n{context_text}\n\nPergunta: {question}\n\nResponda usando apenas as informações do contexto acima.")
+    
+    return [system_message, user_message]
+
+# Prefixo das respostas de erro de generate_answer (que não vão para o cache)
+ANSWER_ERROR_PREFIX = "Erro ao gerar resposta: "
+
+# Function to count the tokens of a chat exchange
+def count_chat_tokens(messages: List[Any], answer: str) -> None:
+    """Add the prompt and completion tokens of an answer to `tokens_total`."""
+    tokens_total.inc(sum(len(tokenizer.encode_ordinary(message.content)) for message in messages), kind="prompt")
+    tokens_total.inc(len(tokenizer.encode_ordinary(answer)), kind="completion")
+
+# Function to generate an answer using OpenAI
+async def generate_answer(question: str, context_docs: List[Document]) -> str:
+    """Generate an answer using OpenAI based on the question and context documents."""
+    try:
+        messages = build_answer_messages(question, context_docs)
         
         # Send request to OpenAI
-        print("Sending request to OpenAI...")
-        response = await chat_model.agenerate([messages])
+        logger.debug("Sending request to OpenAI...")
+        with timed_stage("llm_generation"):
+            response = await chat_model.agenerate([messages])
         
-        print("Received response from OpenAI")
-        return response.generations[0][0].text.strip()
+        logger.debug("Received response from OpenAI")
+        answer = response.generations[0][0].text.strip()
+        count_chat_tokens(messages, answer)
+        return answer
     
     except Exception as e:
-        print(f"Error generating answer: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return f"Erro ao gerar resposta: {str(e)}"
+        logger.exception("Error generating answer: %s", e)
+        return f"{ANSWER_ERROR_PREFIX}{str(e)}"
 
-# Function to process a document
-def process_document(file_path: str, file_name: str, upload_time: str) -> List[Document]:
-    """Process a document and split it into chunks."""
-    print(f"Processing file: {file_path}")
-    
-    # Extract text from the document
-    text = extract_text(file_path)
-    if not text:
-        raise ValueError(f"Não foi possível extrair texto do arquivo: {file_name}")
-    
-    print(f"Extracted text length: {len(text)} characters")
+# Function to stream an answer from OpenAI
+async def stream_answer(question: str, context_docs: List[Document]) -> AsyncIterator[str]:
+    """Yield the answer to `question` piece by piece, as the model generates it."""
+    messages = build_answer_messages(question, context_docs)
+    logger.debug("Streaming request to OpenAI...")
+    start = time.perf_counter()
+    parts = []
+    async for chunk in chat_model.astream(messages):
+        if chunk.content:
+            if not parts:
+                stage_seconds.observe(time.perf_counter() - start, stage="llm_ttft")
+            parts.append(chunk.content)
+            yield chunk.content
+    stage_seconds.observe(time.perf_counter() - start, stage="llm_generation")
+    count_chat_tokens(messages, "".join(parts))
+    logger.debug("Received response from OpenAI")
+
+# Function to split extracted text into chunk documents
+def split_document(
+    text: str,
+    file_path: str,
+    file_name: str,
+    upload_time: str,
+    first_chunk: int = 0,
+    page_starts: Optional[List[Tuple[int, int]]] = None,
+    char_offset: int = 0,
+) -> List[Document]:
+    """Split the extracted text of a document into chunks with metadata.
     
+    Chunks are numbered from `first_chunk` and their character spans are
+    shifted by `char_offset`, so a document can be split in pieces.
+    """
     # Split text into chunks
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=lambda text: len(tokenizer.encode(text)),
-    )
-    chunks = text_splitter.split_text(text)
+    chunks = chunk_text(text, page_starts=page_starts)
     
-    print(f"Split into {len(chunks)} chunks")
+    logger.debug("Split into %d chunks", len(chunks))
     
     # Create documents with metadata
     documents = []
-    for i, chunk in enumerate(chunks):
+    for i, chunk in enumerate(chunks, start=first_chunk):
         metadata = {
             "source": file_name,
             "chunk": i,
             "filename": file_name,
             "upload_time": upload_time,
-            "file_path": file_path
+            "file_path": file_path,
+            "start_char": char_offset + chunk["start_char"],
+            "end_char": char_offset + chunk["end_char"],
         }
-        documents.append(Document(page_content=chunk, metadata=metadata))
+        if "page" in chunk:
+            metadata["page"] = chunk["page"]
+        documents.append(Document(page_content=chunk["text"], metadata=metadata))
     
     return documents
 
-# Função para adicionar documentos ao vector database
-def add_documents_to_vector_db(documents: List[Document]) -> None:
-    """Add documents to the vector database."""
+# Function to split a group of extracted pages (runs on the ingestion process pool)
+def split_pages(
+    pages: List[Dict[str, Any]],
+    file_path: str,
+    file_name: str,
+    upload_time: str,
+    first_chunk: int = 0,
+    char_offset: int = 0,
+) -> List[Document]:
+    """Split consecutive extracted pages into chunk documents tagged with their page."""
+    page_starts = []
+    position = 0
+    for page in pages:
+        page_starts.append((position, page["page"]))
+        position += len(page["text"]) + 2
+    text = "\n\n".join(page["text"] for page in pages)
+    return split_document(text, file_path, file_name, upload_time, first_chunk, page_starts, char_offset)
+
+# Function to group texts into token-budgeted batches
+def make_embedding_batches(texts: List[str]) -> Tuple[List[List[int]], List[int]]:
+    """Group text positions into batches bounded by EMBED_BATCH_MAX_TOKENS and EMBED_BATCH_MAX_INPUTS.
+    
+    Returns the batches and the number of tokens of each one.
+    """
+    batches: List[List[int]] = []
+    batch_tokens: List[int] = []
+    current: List[int] = []
+    current_tokens = 0
+    for position, tokens in enumerate(tokenizer.encode_ordinary_batch(texts)):
+        if current and (current_tokens + len(tokens) > EMBED_BATCH_MAX_TOKENS or len(current) >= EMBED_BATCH_MAX_INPUTS):
+            batches.append(current)
+            batch_tokens.append(current_tokens)
+            current, current_tokens = [], 0
+        current.append(position)
+        current_tokens += len(tokens)
+    if current:
+        batches.append(current)
+        batch_tokens.append(current_tokens)
+    return batches, batch_tokens
+
+# Function to embed one batch with retry on rate limits
+async def embed_batch_with_retry(texts: List[str]) -> List[List[float]]:
+    """Embed a batch, retrying rate-limit and transient API errors with exponential backoff."""
+    attempt = 0
+    while True:
+        try:
+            async with embedding_semaphore:
+                with timed_stage("embedding"):
+                    return await embeddings_model.aembed_documents(texts)
+        except (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError) as e:
+            attempt += 1
+            if attempt > EMBED_MAX_RETRIES:
+                raise
+            delay = EMBED_RETRY_BASE_DELAY * (2 ** (attempt - 1)) * (1 + random.random())
+            logger.warning("Embedding batch of %d texts failed (%s), retrying in %.1fs", len(texts), type(e).__name__, delay)
+            await asyncio.sleep(delay)
+
+# Function to embed chunks in concurrent batches
+async def embed_documents_batched(texts: List[str], on_progress: Optional[Callable[[int], None]] = None) -> List[List[float]]:
+    """Embed `texts` in token-budgeted batches, several batches in flight at once.
+    
+    `on_progress` is called with the number of texts of each finished batch.
+    """
+    batches, batch_tokens = make_embedding_batches(texts)
+    
+    async def embed_batch(batch: List[int], tokens: int) -> List[List[float]]:
+        vectors = await embed_batch_with_retry([texts[i] for i in batch])
+        tokens_total.inc(tokens, kind="embedding")
+        if on_progress:
+            on_progress(len(batch))
+        return vectors
+    
+    results = await asyncio.gather(*[embed_batch(batch, tokens) for batch, tokens in zip(batches, batch_tokens)])
+    vectors: List[Optional[List[float]]] = [None] * len(texts)
+    for batch, batch_vectors in zip(batches, results):
+        for position, vector in zip(batch, batch_vectors):
+            vectors[position] = vector
+    return vectors
+
+# Function to embed chunks, reusing cached vectors
+async def embed_documents_cached(texts: List[str], on_progress: Optional[Callable[[int], None]] = None) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """Embed `texts`, calling the API only for texts missing from the embedding cache.
+    
+    Returns the vectors and the embedding statistics of this call.
+    """
+    start = time.perf_counter()
+    vectors = await asyncio.to_thread(embedding_cache.get_many, texts)
+    missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+    cache_hits = len(texts) - sum(vector is None for vector in vectors)
+    cache_lookups_total.inc(cache_hits, cache="embedding", result="hit")
+    cache_lookups_total.inc(len(texts) - cache_hits, cache="embedding", result="miss")
+    logger.debug("Embedding cache: %d hits, %d texts to embed", cache_hits, len(missing))
+    if on_progress:
+        on_progress(len(texts) - len(missing))
+    
+    if missing:
+        new_vectors = await embed_documents_batched(missing, on_progress)
+        await asyncio.to_thread(embedding_cache.put_many, missing, new_vectors)
+        by_text = dict(zip(missing, new_vectors))
+        vectors = [vector if vector is not None else by_text[text] for text, vector in zip(texts, vectors)]
+    
+    elapsed = time.perf_counter() - start
+    stats = {
+        "chunks": len(texts),
+        "cache_hits": cache_hits,
+        "embedded": len(missing),
+        "seconds": round(elapsed, 3),
+        "chunks_per_second": round(len(texts) / elapsed, 1) if elapsed > 0 else 0.0,
+    }
+    return np.array(vectors, dtype=np.float32), stats
+
+# Function to list the answer cache keys of a set of chunks
+def answer_cache_keys(metadatas: List[Dict[str, Any]]) -> List[str]:
+    """Return the `file_path` and `source` of the chunks (the keys a question can be filtered by)."""
+    return [path for metadata in metadatas for path in (metadata.get("file_path"), metadata.get("source")) if path]
+
+# Function to write new chunks to the index (blocking: segment write + FAISS add)
+def commit_documents(texts: List[str], metadatas: List[Dict[str, Any]], embeddings: np.ndarray) -> None:
+    """Append the embedded chunks to the segment log and to the in-memory index."""
     global vector_db
+    # Gravar os vetores já com as dimensões do índice
+    embeddings = truncate_vectors(embeddings, vector_db.index.d if vector_db is not None else VECTOR_DIMENSIONS)
     
-    if not documents:
-        print("No documents to add")
-        return
+    with index_lock:
+        # Os novos vetores (e seus chunks) ocupam ids sequenciais a partir do último id usado
+        first_id = vector_db.next_id if vector_db is not None else 0
+        record = {
+            "op": "add",
+            "texts": texts,
+            "metadatas": metadatas,
+            "embeddings": embeddings,
+            "faiss_ids": list(range(first_id, first_id + len(texts))),
+        }
+        
+        # Gravar o segmento antes de alterar a memória: se o processo cair, ele é reaplicado
+        logger.debug("Appending segment to disk")
+        with timed_stage("segment_write"):
+            append_segment(record)
+        vector_db = apply_segment(vector_db, record)
+    
+    # Respostas que podem mudar com os novos chunks deixam o cache
+    answer_cache.invalidate(answer_cache_keys(metadatas))
+
+# Function to remove a document from the index
+def remove_document(file_path: str) -> int:
+    """Delete the uploaded file and tombstone its vectors; returns how many chunks were removed.
+    
+    The delete is logged as a segment, so it survives a restart; the vectors
+    stay in the index (skipped by the searches) until the next compaction.
+    """
+    global vector_db
+    with index_lock:
+        faiss_ids = chunk_store.ids_for_documents([file_path])
+        # As mesmas chaves invalidadas quando os chunks foram adicionados
+        file_paths = list(dict.fromkeys([file_path] + answer_cache_keys(
+            [doc.metadata for doc in chunk_store.get_many(faiss_ids) if doc is not None]
+        )))
+        if faiss_ids:
+            # Os caminhos permitem aos readers invalidar as respostas desse documento
+            record = {"op": "delete", "faiss_ids": faiss_ids, "file_paths": file_paths}
+            append_segment(record)
+            vector_db = apply_segment(vector_db, record)
+    answer_cache.invalidate(file_paths)
+    
+    if os.path.exists(file_path):
+        os.remove(file_path)
+    # Permitir que o mesmo arquivo seja enviado de novo
+    stale = [content_hash for content_hash, path in upload_hashes.items() if path == file_path]
+    for content_hash in stale:
+        del upload_hashes[content_hash]
+    if stale:
+        save_upload_hashes()
+    logger.info("Removed document %s (%d chunks)", file_path, len(faiss_ids))
+    return len(faiss_ids)
+
+# Function to drop chunks that are already indexed
+def dedupe_documents(documents: List[Document], seen: set) -> List[Document]:
+    """Return the documents whose (file_path, content hash) is neither indexed nor in `seen`.
+    
+    Sets `content_hash` in each document's metadata and adds the kept keys to `seen`.
+    """
+    for doc in documents:
+        doc.metadata["content_hash"] = chunk_hash(doc.page_content)
+    indexed = chunk_store.existing([(doc.metadata.get("file_path"), doc.metadata["content_hash"]) for doc in documents])
+    
+    unique_documents = []
+    for doc in documents:
+        key = (doc.metadata.get("file_path"), doc.metadata["content_hash"])
+        if key in seen or key in indexed:
+            continue
+        seen.add(key)
+        unique_documents.append(doc)
+    
+    skipped = len(documents) - len(unique_documents)
+    if skipped:
+        logger.debug("Skipping %d duplicate chunks", skipped)
+    return unique_documents
+
+# Function to notify the subscribers of a job
+def publish_job(job: JobInfo) -> None:
+    """Push the current state of a job to the WebSockets following it."""
+    for queue in job_subscribers.get(job.job_id, []):
+        queue.put_nowait(job.model_dump())
+
+# Function to move a job to a new stage
+def set_job_status(job: JobInfo, status: str) -> None:
+    """Record the duration of the current stage and move the job to `status`."""
+    now = time.time()
+    if job.stage_started_at is not None:
+        job.stage_timings[job.status] = round((now - job.stage_started_at) * 1000, 2)
+    job.status = status
+    if status in ("done", "failed"):
+        job.stage_started_at = None
+        job.finished_at = now
+    else:
+        job.stage_started_at = now
+    publish_job(job)
+
+# Function to drop old finished jobs from memory
+def prune_jobs() -> None:
+    """Keep at most INGEST_JOB_HISTORY finished jobs."""
+    finished = [job for job in ingestion_jobs.values() if job.status in ("done", "failed")]
+    finished.sort(key=lambda job: job.finished_at or 0)
+    for job in finished[:max(0, len(finished) - INGEST_JOB_HISTORY)]:
+        ingestion_jobs.pop(job.job_id, None)
+
+# Function to run one ingestion job
+async def run_ingestion_job(job: JobInfo, upload_time: str) -> None:
+    """Extract, split, embed and index an uploaded file, updating the job as it goes.
     
-    print(f"Adding {len(documents)} documents to vector database")
+    Page ranges are extracted in parallel on the process pool and consumed in
+    order; every INGEST_STREAM_CHARS of extracted text is split and starts
+    embedding while the remaining pages are still being extracted. The chunks
+    are written to the index at the end, in a single segment.
+    """
+    loop = asyncio.get_running_loop()
+    job.started_at = time.time()
+    logger.info("Processing file: %s (job %s)", job.file_path, job.job_id)
     
+    extractions: List[asyncio.Future] = []
+    pieces: List[asyncio.Task] = []
     try:
-        if vector_db is None:
-            # Criar um novo banco de dados de vetores
-            print("Creating new vector database")
-            vector_db = create_vector_db(documents)
-        else:
-            # Adicionar ao banco de dados existente
-            
-            # Usar o método from_documents diretamente para adicionar novos documentos
-            new_db = FAISS.from_documents(documents, embeddings_model)
-            
-            # Mesclar com o banco de dados existente
-            vector_db.merge_from(new_db)
+        # Extração e divisão rodam no pool de processos (CPU, fora do event loop)
+        set_job_status(job, "extracting")
+        extraction_start = time.perf_counter()
+        ranges = await loop.run_in_executor(ingest_process_pool, page_ranges, job.file_path)
+        job.pages_total = ranges[-1][1] if ranges else 0
+        extractions = [
+            loop.run_in_executor(ingest_process_pool, extract_pages, job.file_path, start, end)
+            for start, end in ranges
+        ]
+        
+        embedding_start = time.perf_counter()
+        
+        def on_progress(count: int) -> None:
+            job.chunks_done += count
+            elapsed = time.perf_counter() - embedding_start
+            job.chunks_per_second = round(job.chunks_done / elapsed, 1) if elapsed > 0 else 0.0
+            publish_job(job)
+        
+        async def embed_piece(documents: List[Document]) -> Tuple[List[Document], np.ndarray, Dict[str, Any]]:
+            embeddings, stats = await embed_documents_cached([doc.page_content for doc in documents], on_progress)
+            return documents, embeddings, stats
+        
+        seen: set = set()
+        buffer: List[Dict[str, Any]] = []
+        buffer_chars = 0
+        chunks_split = 0
+        chars_split = 0
+        skipped = 0
+        page_ms: List[float] = []
+        
+        async def flush_buffer() -> None:
+            nonlocal buffer, buffer_chars, chunks_split, chars_split, skipped
+            with timed_stage("chunking"):
+                documents = await loop.run_in_executor(
+                    ingest_process_pool, split_pages, buffer, job.file_path, job.filename, upload_time, chunks_split, chars_split
+                )
+            # Posição do próximo trecho no texto completo ("\n\n" entre as páginas)
+            chars_split += sum(len(page["text"]) + 2 for page in buffer)
+            buffer, buffer_chars = [], 0
+            chunks_split += len(documents)
+            # Hash e consulta ao chunk store fora do event loop; os flushes são sequenciais,
+            # então só esta chamada mexe em `seen`
+            unique_documents = await asyncio.to_thread(dedupe_documents, documents, seen)
+            skipped += len(documents) - len(unique_documents)
+            if unique_documents:
+                job.chunks_total += len(unique_documents)
+                pieces.append(asyncio.create_task(embed_piece(unique_documents)))
+        
+        for extraction in extractions:
+            for page in await extraction:
+                job.pages_done += 1
+                page_ms.append(page["ms"])
+                stage_seconds.observe(page["ms"] / 1000, stage="page_extraction")
+                if page["error"]:
+                    logger.warning("Skipping page %s of %s: %s", page["page"], job.file_path, page["error"])
+                    job.failed_pages.append({"page": page["page"], "error": page["error"]})
+                    continue
+                buffer.append(page)
+                buffer_chars += len(page["text"])
+            publish_job(job)
+            if buffer_chars >= INGEST_STREAM_CHARS:
+                await flush_buffer()
+        if buffer_chars:
+            await flush_buffer()
+        extraction_seconds = time.perf_counter() - extraction_start
         
-        # Salvar o banco de dados atualizado
-        print("Saving updated vector database to disk")
-        save_vector_db(vector_db)
+        if chunks_split == 0:
+            raise ValueError(f"Não foi possível extrair texto do arquivo: {job.filename}")
+        logger.info("Extracted %d pages (%d failed) into %d chunks", job.pages_done, len(job.failed_pages), chunks_split)
         
+        # Aguardar os embeddings restantes e gravar tudo no índice de uma vez
+        set_job_status(job, "embedding")
+        results = await asyncio.gather(*pieces)
+        
+        set_job_status(job, "indexing")
+        texts, metadatas, vectors = [], [], []
+        for documents, embeddings, _ in results:
+            texts.extend(doc.page_content for doc in documents)
+            metadatas.extend(doc.metadata for doc in documents)
+            vectors.append(embeddings)
+        if texts:
+            await asyncio.to_thread(commit_documents, texts, metadatas, np.concatenate(vectors))
+            maybe_schedule_compaction()
+        
+        embedding_seconds = time.perf_counter() - embedding_start
+        job.result = {
+            "chunks": chunks_split,
+            "embedded": sum(stats["embedded"] for _, _, stats in results),
+            "cache_hits": sum(stats["cache_hits"] for _, _, stats in results),
+            "duplicates_skipped": skipped,
+            "chunks_per_second": round(len(texts) / embedding_seconds, 1) if embedding_seconds > 0 else 0.0,
+            "extraction": {
+                "pages": job.pages_done,
+                "failed_pages": len(job.failed_pages),
+                "seconds": round(extraction_seconds, 3),
+                "avg_page_ms": round(sum(page_ms) / len(page_ms), 2) if page_ms else 0.0,
+                "max_page_ms": max(page_ms, default=0.0),
+                "page_ms": page_ms,
+            },
+        }
+        if job.content_hash:
+            upload_hashes[job.content_hash] = job.file_path
+            await asyncio.to_thread(save_upload_hashes)
+        if job.replaces:
+            # A nova versão já está no índice: só agora a anterior sai das buscas
+            job.result["replaced_chunks"] = await asyncio.to_thread(remove_document, job.replaces)
+            maybe_schedule_compaction()
+        set_job_status(job, "done")
+        logger.info("Job %s done: %d chunks, %s chunks/s", job.job_id, job.result["chunks"], job.result["chunks_per_second"])
+    
     except Exception as e:
-        print(f"Error adding documents to vector database: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        raise ValueError(f"Error adding documents to vector database: {str(e)}")
+        logger.exception("Error processing document: %s", e)
+        for pending in extractions + pieces:
+            pending.cancel()
+        job.error = str(e)
+        set_job_status(job, "failed")
+    
+    finally:
+        if job.content_hash:
+            inflight_uploads.pop(job.content_hash, None)
+        prune_jobs()
 
-# Endpoint to upload a document
-@app.post("/upload")
-async def upload_document(file: UploadFile = File(...)):
-    """Upload a document and add it to the vector database."""
-    global vector_db
+# Background worker consuming the ingestion queue
+async def ingestion_worker() -> None:
+    """Process queued ingestion jobs one at a time (INGEST_WORKERS run in parallel)."""
+    while True:
+        job, upload_time = await ingestion_queue.get()
+        try:
+            await run_ingestion_job(job, upload_time)
+        finally:
+            ingestion_queue.task_done()
+
+# Function to load the registry of processed file hashes
+def load_upload_hashes() -> Dict[str, str]:
+    """Return the content hash -> file path map of already processed uploads."""
+    if not os.path.exists(UPLOAD_HASHES_PATH):
+        return {}
+    with open(UPLOAD_HASHES_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+# Function to persist the registry of processed file hashes
+def save_upload_hashes() -> None:
+    """Write the content hash registry atomically."""
+    os.makedirs(UPLOADS_DIR, exist_ok=True)
+    write_file_atomic(UPLOAD_HASHES_PATH, json.dumps(upload_hashes).encode("utf-8"))
+
+# Function to stream an upload to disk
+async def save_upload_stream(file: UploadFile, dest_dir: str) -> Tuple[str, str, int]:
+    """Copy the upload to a temporary file in fixed-size chunks.
+    
+    Starlette has already spooled the body (to disk past 1 MB), so this is a
+    second copy; the content hash is computed on the way and the file itself
+    is checked against MAX_UPLOAD_BYTES (the whole body is limited while it
+    is received, by UploadSizeLimitMiddleware). Returns (temp path, sha256, size).
+    """
+    tmp_path = os.path.join(dest_dir, f".upload-{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as buffer:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail=f"File too large (limit: {MAX_UPLOAD_BYTES} bytes)")
+                digest.update(chunk)
+                buffer.write(chunk)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return tmp_path, digest.hexdigest(), size
+
+# Function to save an upload and queue its ingestion
+async def queue_upload(file: UploadFile, replaces: Optional[str] = None) -> JSONResponse:
+    """Save an uploaded document and queue it for processing.
     
+    With `replaces`, the document at that path is removed once the new one is
+    indexed. A file identical to one already processed (or being processed)
+    is not processed again.
+    """
     # Create uploads directory if it doesn't exist
     uploads_dir = UPLOADS_DIR
     os.makedirs(uploads_dir, exist_ok=True)
     
+    # Save the file (em blocos, calculando o hash durante a cópia)
+    tmp_path, content_hash, size = await save_upload_stream(file, uploads_dir)
+    
+    # Arquivo idêntico já processado ou na fila: devolver o existente
+    existing_job_id = inflight_uploads.get(content_hash)
+    existing_path = upload_hashes.get(content_hash)
+    if existing_job_id or (existing_path and os.path.exists(existing_path)):
+        os.remove(tmp_path)
+        file_saved = ingestion_jobs[existing_job_id].file_path if existing_job_id else existing_path
+        logger.info("Duplicate upload of %s (%s), skipping processing", file.filename, content_hash[:12])
+        replaced_chunks = 0
+        if replaces and file_saved != replaces:
+            # O novo conteúdo já está indexado em outro documento: basta remover o antigo
+            replaced_chunks = await asyncio.to_thread(remove_document, replaces)
+            maybe_schedule_compaction()
+        return JSONResponse(status_code=200, content={
+            "message": "Document unchanged" if file_saved == replaces else "Document already uploaded",
+            "duplicate": True,
+            "job_id": existing_job_id,
+            "status_url": f"/jobs/{existing_job_id}" if existing_job_id else None,
+            "file_saved": file_saved,
+            "content_hash": content_hash,
+            "replaced_chunks": replaced_chunks,
+        })
+    
     # Generate a timestamp for the file name to avoid collisions
     timestamp = time.time()
-    file_name = f"{int(timestamp)}_{file.filename}"
+    original_name = os.path.basename(file.filename or "document")
+    file_name = f"{int(timestamp)}_{original_name}"
     file_path = os.path.join(uploads_dir, file_name)
+    if file_path == replaces:
+        file_name = f"{int(timestamp)}_{uuid.uuid4().hex[:8]}_{original_name}"
+        file_path = os.path.join(uploads_dir, file_name)
+    os.replace(tmp_path, file_path)
+    logger.info("Saved upload %s (%d bytes)", file_path, size)
     
-    # Save the file
-    with open(file_path, "wb") as buffer:
-        buffer.write(await file.read())
+    # Criar o job e colocá-lo na fila de ingestão
+    job = JobInfo(
+        job_id=str(uuid.uuid4()),
+        filename=original_name,
+        file_path=file_path,
+        created_at=timestamp,
+        stage_started_at=timestamp,
+        content_hash=content_hash,
+        replaces=replaces,
+    )
+    ingestion_jobs[job.job_id] = job
+    inflight_uploads[content_hash] = job.job_id
+    upload_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+    await ingestion_queue.put((job, upload_time))
     
-    try:
-        # Process the document
-        documents = process_document(file_path, file.filename, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp)))
-        
-        # Add documents to the vector database
-        add_documents_to_vector_db(documents)
-        
-        return {"message": "Document processed successfully", "chunks": len(documents), "file_saved": file_path}
+    return JSONResponse(status_code=202, content={
+        "message": "Document queued for processing",
+        "job_id": job.job_id,
+        "status_url": f"/jobs/{job.job_id}",
+        "file_saved": file_path,
+        "content_hash": content_hash,
+    })
+
+# Function to resolve the path of an uploaded document
+def document_path(document_id: str) -> str:
+    """Return the path of `document_id` in the uploads directory (404 if it is not a document)."""
+    if document_id != os.path.basename(document_id) or document_id.startswith("."):
+        raise HTTPException(status_code=404, detail=f"Document not found: {document_id}")
+    file_path = os.path.join(UPLOADS_DIR, document_id)
+    if not os.path.isfile(file_path) and not chunk_store.ids_for_documents([file_path]):
+        raise HTTPException(status_code=404, detail=f"Document not found: {document_id}")
+    # Não remover um documento que ainda está sendo indexado (ou substituído)
+    for job in ingestion_jobs.values():
+        if job.status not in ("done", "failed") and file_path in (job.file_path, job.replaces):
+            raise HTTPException(status_code=409, detail=f"Document is being processed by job {job.job_id}")
+    return file_path
+
+# Endpoint to upload a document
+@app.post("/upload", status_code=202)
+async def upload_document(file: UploadFile = File(...)):
+    """Save an uploaded document and queue it for processing.
+    
+    Returns immediately with a job id; progress is available at
+    `/jobs/{job_id}` and `/ws/jobs/{job_id}`. A file identical to one
+    already processed (or being processed) is not processed again.
+    """
+    return await queue_upload(file)
+
+# Endpoint to replace a document
+@app.put("/documents/{document_id}", status_code=202)
+async def replace_document(document_id: str, file: UploadFile = File(...)):
+    """Upload a new version of a document.
+    
+    The new version is indexed like any upload (chunks whose text did not
+    change reuse their cached embeddings) and the old one is removed from
+    the index once the job is done, so searches always see one of the versions.
+    """
+    return await queue_upload(file, replaces=document_path(document_id))
+
+# Endpoint to delete a document
+@app.delete("/documents/{document_id}")
+async def delete_document(document_id: str):
+    """Delete an uploaded document and remove its chunks from the searches.
     
+    The vectors are tombstoned right away and dropped from the index by the
+    next compaction, without re-embedding the rest of the corpus.
+    """
+    file_path = document_path(document_id)
+    try:
+        chunks_deleted = await asyncio.to_thread(remove_document, file_path)
+        maybe_schedule_compaction()
+        return {"document_id": document_id, "chunks_deleted": chunks_deleted}
     except Exception as e:
-        print(f"Error processing document: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
+        logger.exception("Error deleting document: %s", e)
+        raise HTTPException(status_code=500, detail=f"Error deleting document: {str(e)}")
+
+# Endpoint to list ingestion jobs
+@app.get("/jobs", response_model=List[JobInfo])
+async def list_jobs():
+    """List the ingestion jobs in progress and the most recent finished ones."""
+    return sorted(ingestion_jobs.values(), key=lambda job: job.created_at, reverse=True)
+
+# Endpoint to get the status of an ingestion job
+@app.get("/jobs/{job_id}", response_model=JobInfo)
+async def get_job(job_id: str):
+    """Return the stage, chunk progress and throughput of an ingestion job."""
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job
+
+# WebSocket endpoint pushing ingestion job progress
+@app.websocket("/ws/jobs/{job_id}")
+async def job_progress_endpoint(websocket: WebSocket, job_id: str):
+    """Send the job state on every change until it finishes."""
+    await websocket.accept()
+    if worker_role != "writer":
+        await relay_job_progress(websocket, job_id)
+        return
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        await websocket.send_text(json.dumps({"error": f"Job not found: {job_id}"}))
+        await websocket.close()
+        return
+    
+    queue: asyncio.Queue = asyncio.Queue()
+    job_subscribers.setdefault(job_id, []).append(queue)
+    try:
+        state = job.model_dump()
+        while True:
+            await websocket.send_text(json.dumps(state))
+            if state["status"] in ("done", "failed"):
+                break
+            state = await queue.get()
+        await websocket.close()
+    except WebSocketDisconnect:
+        logger.debug("Job progress WebSocket disconnected (%s)", job_id)
+    finally:
+        job_subscribers[job_id].remove(queue)
+        if not job_subscribers[job_id]:
+            del job_subscribers[job_id]
+
+# Function to relay the progress of a job from the writer
+async def relay_job_progress(websocket: WebSocket, job_id: str) -> None:
+    """Forward the messages of the writer's /ws/jobs/{job_id} (readers only)."""
+    try:
+        async with websockets.unix_connect(WRITER_SOCKET_PATH, f"ws://writer/ws/jobs/{job_id}") as upstream:
+            async for message in upstream:
+                await websocket.send_text(message)
+        await websocket.close()
+    except (OSError, websockets.WebSocketException) as e:
+        logger.warning("Writer unavailable at %s: %s", WRITER_SOCKET_PATH, e)
+        await websocket.send_text(json.dumps({"error": "The writer process is not available; try again shortly"}))
+        await websocket.close()
+    except WebSocketDisconnect:
+        logger.debug("Job progress WebSocket disconnected (%s)", job_id)
 
 # HTTP endpoint to ask a question
 @app.post("/perguntar", response_model=QuestionResponse)
 async def ask_question(request: QuestionRequest):
     """Ask a question and get an answer based on the document context."""
     try:
+        # Perguntas repetidas (ou muito parecidas) são respondidas pelo cache
+        mode = retrieval_mode(request.mode)
+        cached, embedding, timings = await lookup_answer_cache(request.question, request.top_k, request.file_paths, mode)
+        if cached is not None:
+            return {"answer": cached["answer"], "sources": cached["sources"], "timings": timings, "cache": cached["cache"]}
+        scope = answer_cache.version(request.top_k, request.file_paths, mode)
+        
         # Query vector database for relevant documents
-        docs = await query_vector_db(request.question, request.top_k, request.file_paths)
+        docs, retrieval_timings = await retrieve_documents(request.question, request.top_k, request.file_paths, embedding, mode)
+        timings.update(retrieval_timings)
+        docs = pack_documents(docs, timings)
         
         # Generate answer
+        generation_start = time.perf_counter()
         answer = await generate_answer(request.question, docs)
+        timings["generation_ms"] = round((time.perf_counter() - generation_start) * 1000, 2)
         
         # Prepare sources information
         sources = [{"content": doc.page_content, "metadata": doc.metadata} for doc in docs]
+        # Respostas de erro ou do fallback léxico não vão para o cache
+        if not answer.startswith(ANSWER_ERROR_PREFIX) and "lexical_fallback" not in timings:
+            answer_cache.put(scope, request.question, embedding, answer, sources)
         
-        return {"answer": answer, "sources": sources}
+        return {"answer": answer, "sources": sources, "timings": timings}
     
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -458,108 +3310,296 @@ async def ask_question(request: QuestionRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating answer: {str(e)}")
 
+# Function to answer a chat question, streaming the answer over the WebSocket
+async def stream_chat_answer(websocket: WebSocket, request_id: str, question: str, top_k: int, file_paths: List[str], mode: Optional[str] = None) -> None:
+    """Send the sources, then the answer as "delta" frames, then a "done" frame.
+    
+    Every frame carries `request_id`. The "done" frame repeats the full
+    answer and the sources (clients that ignore the other frames still work)
+    and carries the timings, including the time until the first token
+    reached the client.
+    """
+    start = time.perf_counter()
+    
+    # Perguntas repetidas (ou muito parecidas) são respondidas pelo cache, sem deltas
+    mode = retrieval_mode(mode)
+    cached, embedding, timings = await lookup_answer_cache(question, top_k, file_paths, mode)
+    if cached is not None:
+        await manager.send_personal_message(
+            json.dumps({"type": "sources", "request_id": request_id, "sources": cached["sources"], "timings": timings}),
+            websocket
+        )
+        timings["ttft_ms"] = timings["total_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        await manager.send_personal_message(
+            json.dumps({"type": "done", "request_id": request_id, "answer": cached["answer"], "sources": cached["sources"], "timings": timings, "cache": cached["cache"]}),
+            websocket
+        )
+        return
+    scope = answer_cache.version(top_k, file_paths, mode)
+    
+    # Query vector database for relevant documents
+    docs, retrieval_timings = await retrieve_documents(question, top_k, file_paths, embedding, mode)
+    timings.update(retrieval_timings)
+    docs = pack_documents(docs, timings)
+    
+    # Prepare sources information (enviadas antes da resposta)
+    sources = [{"content": doc.page_content, "metadata": doc.metadata} for doc in docs]
+    await manager.send_personal_message(
+        json.dumps({"type": "sources", "request_id": request_id, "sources": sources, "timings": timings}),
+        websocket
+    )
+    
+    # Generate answer (cada pedaço é enviado assim que chega da OpenAI)
+    generation_start = time.perf_counter()
+    first_token = None
+    parts = []
+    async for delta in stream_answer(question, docs):
+        if first_token is None:
+            first_token = time.perf_counter()
+        parts.append(delta)
+        await manager.send_personal_message(json.dumps({"type": "delta", "request_id": request_id, "delta": delta}), websocket)
+    end = time.perf_counter()
+    
+    answer = "".join(parts).strip()
+    logger.debug("Generated answer: %.100r", answer)
+    timings["ttft_ms"] = round(((first_token or end) - start) * 1000, 2)
+    timings["generation_ms"] = round((end - generation_start) * 1000, 2)
+    timings["total_ms"] = round((end - start) * 1000, 2)
+    if "lexical_fallback" not in timings:
+        answer_cache.put(scope, question, embedding, answer, sources)
+    
+    # Send response back to client
+    await manager.send_personal_message(
+        json.dumps({"type": "done", "request_id": request_id, "answer": answer, "sources": sources, "timings": timings}),
+        websocket
+    )
+    logger.debug("Response sent to client - timings: %s", timings)
+
+# Function to answer one chat request (runs as a task of the connection)
+async def handle_chat_request(websocket: WebSocket, request_id: str, question: str, top_k: int, file_paths: List[str], mode: Optional[str] = None) -> None:
+    """Answer a question, reporting errors as frames of `request_id` (cancellation is acknowledged by the cancel message handler)."""
+    try:
+        await stream_chat_answer(websocket, request_id, question, top_k, file_paths, mode)
+        
+    except asyncio.CancelledError:
+        # Cancelada pelo cliente ou pela desconexão: a chamada à OpenAI é interrompida
+        # (a confirmação "cancelled" é enviada por quem cancelou)
+        logger.debug("Request %s cancelled", request_id)
+        raise
+        
+    except ValueError as e:
+        logger.warning("ValueError during processing: %s", e)
+        await manager.send_personal_message(
+            json.dumps({"type": "error", "request_id": request_id, "error": str(e)}),
+            websocket
+        )
+        
+    except Exception as e:
+        if websocket not in manager.active_connections:
+            logger.debug("Exception after the WebSocket disconnected: %s", e)
+            return
+        logger.exception("Exception during processing: %s", e)
+        await manager.send_personal_message(
+            json.dumps({"type": "error", "request_id": request_id, "error": f"Error generating answer: {str(e)}"}),
+            websocket
+        )
+
 # WebSocket endpoint for chat
 @app.websocket("/ws/chat")
 async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket endpoint for real-time chat."""
+    """WebSocket endpoint for real-time chat.
+    
+    Each question runs as its own task, so the connection keeps reading:
+    up to WS_MAX_CONCURRENT_REQUESTS questions can be answered at once and
+    {"type": "cancel", "request_id": ...} stops one of them (all of them
+    without a request_id). Closing the connection cancels its requests.
+    """
     await manager.connect(websocket)
     try:
         while True:
             # Receive message from client
             data = await websocket.receive_text()
-            print(f"Received data from client: {data}")
+            logger.debug("Received data from client: %s", data)
             
             try:
                 data_json = json.loads(data)
-                print(f"Parsed JSON data: {data_json}")
                 
-                if "question" not in data_json:
-                    await manager.send_personal_message(
-                        json.dumps({"error": "Question is required"}),
-                        websocket
-                    )
+                if data_json.get("type") == "cancel":
+                    cancelled = manager.cancel_request(websocket, data_json.get("request_id"))
+                    if not cancelled:
+                        await manager.send_personal_message(
+                            json.dumps({"type": "error", "request_id": data_json.get("request_id"), "error": "No such request in flight"}),
+                            websocket
+                        )
+                    # Confirmar aqui: uma tarefa cancelada antes de começar não chega ao seu except
+                    for cancelled_id in cancelled:
+                        await manager.send_personal_message(
+                            json.dumps({"type": "cancelled", "request_id": cancelled_id}),
+                            websocket
+                        )
                     continue
                 
-                question = data_json["question"]
-                top_k = data_json.get("top_k", 5)
-                file_paths = data_json.get("file_paths", [])
+                request_id = str(data_json.get("request_id") or uuid.uuid4())
                 
-                print(f"Processing question: '{question}' with top_k={top_k}")
-                print(f"Selected file paths: {file_paths}")
-                
-                try:
-                    # Query vector database for relevant documents
-                    print("Querying vector database...")
-                    docs = await query_vector_db(question, top_k, file_paths)
-                    print(f"Found {len(docs)} relevant documents")
-                    
-                    # Generate answer
-                    print("Generating answer...")
-                    answer = await generate_answer(question, docs)
-                    print(f"Generated answer: '{answer[:100]}...'")
-                    
-                    # Prepare sources information
-                    sources = [{"content": doc.page_content, "metadata": doc.metadata} for doc in docs]
-                    
-                    # Send response back to client
+                if "question" not in data_json:
                     await manager.send_personal_message(
-                        json.dumps({"answer": answer, "sources": sources}),
+                        json.dumps({"type": "error", "request_id": request_id, "error": "Question is required"}),
                         websocket
                     )
-                    print("Response sent to client")
-                    
-                except ValueError as e:
-                    print(f"ValueError during processing: {str(e)}")
+                    continue
+                
+                in_flight = manager.in_flight(websocket)
+                if request_id in in_flight:
                     await manager.send_personal_message(
-                        json.dumps({"error": str(e)}),
+                        json.dumps({"type": "error", "request_id": request_id, "error": "Request id already in flight"}),
                         websocket
                     )
-                    
-                except Exception as e:
-                    print(f"Exception during processing: {str(e)}")
-                    import traceback
-                    traceback.print_exc()
+                    continue
+                if len(in_flight) >= WS_MAX_CONCURRENT_REQUESTS:
                     await manager.send_personal_message(
-                        json.dumps({"error": f"Error generating answer: {str(e)}"}),
+                        json.dumps({"type": "error", "request_id": request_id, "error": f"Too many requests in flight (limit: {WS_MAX_CONCURRENT_REQUESTS})"}),
                         websocket
                     )
+                    continue
+                
+                question = data_json["question"]
+                top_k = data_json.get("top_k", 5)
+                file_paths = data_json.get("file_paths", [])
+                mode = data_json.get("mode")
+                
+                logger.debug("Processing question: %r with top_k=%s (request %s, file paths: %s)", question, top_k, request_id, file_paths)
+                manager.start_request(websocket, request_id, handle_chat_request(websocket, request_id, question, top_k, file_paths, mode))
             
             except json.JSONDecodeError as e:
-                print(f"JSON decode error: {str(e)}")
+                logger.warning("JSON decode error: %s", e)
                 await manager.send_personal_message(
-                    json.dumps({"error": f"Invalid JSON format: {str(e)}"}),
+                    json.dumps({"type": "error", "error": f"Invalid JSON format: {str(e)}"}),
                     websocket
                 )
                 
             except Exception as e:
-                print(f"Unexpected error: {str(e)}")
-                import traceback
-                traceback.print_exc()
+                logger.exception("Unexpected error: %s", e)
                 await manager.send_personal_message(
-                    json.dumps({"error": f"Unexpected error: {str(e)}"}),
+                    json.dumps({"type": "error", "error": f"Unexpected error: {str(e)}"}),
                     websocket
                 )
     
     except WebSocketDisconnect:
-        print("WebSocket disconnected")
+        logger.debug("WebSocket disconnected")
+    
+    finally:
+        # Cancelar as perguntas em andamento: ninguém vai ler as respostas
         manager.disconnect(websocket)
 
 # Função para carregar o banco de dados de vetores na inicialização
 @app.on_event("startup")
 async def startup_db_client():
-    """Load the vector database on startup."""
-    global vector_db
+    """Load the vector database on startup (and start the ingestion queue on the writer)."""
+    global vector_db, query_semaphore, embedding_semaphore, worker_role, index_refresh_task
+    
+    # Criar os semáforos dentro do event loop que vai atender as requisições
+    query_semaphore = asyncio.Semaphore(QUERY_MAX_CONCURRENCY)
+    embedding_semaphore = asyncio.Semaphore(EMBED_MAX_CONCURRENT_BATCHES)
+    
+    worker_role = resolve_worker_role()
+    if worker_role == "writer":
+        start_ingestion()
+        start_writer_socket()
+    
     try:
-        print("Loading vector database...")
+        logger.info("Loading vector database (%s)...", worker_role)
         vector_db = load_vector_db()
         if vector_db:
-            print("Vector database loaded successfully")
+            logger.info("Vector database loaded successfully (%d vectors)", vector_db.ntotal)
+            if worker_role == "writer":
+                maybe_schedule_compaction()
         else:
-            print("No existing vector database found. Will create one when documents are uploaded.")
+            logger.info("No existing vector database found. Will create one when documents are uploaded.")
     except Exception as e:
-        print(f"Error loading vector database: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error loading vector database: %s", e)
+    
+    if worker_role == "reader":
+        index_refresh_task = asyncio.create_task(index_refresher())
+
+# Function to start the ingestion queue, its workers and the extraction process pool
+def start_ingestion() -> None:
+    """Start the ingestion of uploads (writer only)."""
+    global ingestion_queue, ingestion_workers, ingest_process_pool, upload_hashes
+    # "spawn" evita herdar threads e locks do servidor no fork
+    ingest_process_pool = ProcessPoolExecutor(
+        max_workers=INGEST_PROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn")
+    )
+    upload_hashes = load_upload_hashes()
+    ingest_process_pool.submit(os.getpid)  # Sobe os processos já no startup, não no primeiro upload
+    ingestion_queue = asyncio.Queue()
+    ingestion_workers = [asyncio.create_task(ingestion_worker()) for _ in range(INGEST_WORKERS)]
+
+# uvicorn server for the writer's Unix socket
+class WriterSocketServer(uvicorn.Server):
+    """Serve the app on WRITER_SOCKET_PATH, next to the main server, for the requests relayed by readers."""
+
+    def install_signal_handlers(self) -> None:
+        # Os sinais ficam com o servidor principal, que encerra este no shutdown
+        pass
+
+writer_socket_server: Optional[WriterSocketServer] = None
+writer_socket_task: Optional[asyncio.Task] = None
+
+# Function to start serving the readers
+def start_writer_socket() -> None:
+    """Start the writer's Unix socket server (writer only)."""
+    global writer_socket_server, writer_socket_task
+    if fcntl is None:
+        # Sem o lock de escrita não há readers (todo processo é writer)
+        return
+    # Sem lifespan: o startup já rodou neste processo; o log continua o do servidor principal
+    config = uvicorn.Config(app, uds=WRITER_SOCKET_PATH, lifespan="off", log_config=None, access_log=False)
+    writer_socket_server = WriterSocketServer(config)
+    writer_socket_task = asyncio.create_task(writer_socket_server.serve())
+
+# Background task keeping a reader up to date
+async def index_refresher() -> None:
+    """Poll the index directory every INDEX_REFRESH_SECONDS and hot-swap the reader's index.
+    
+    With WORKER_ROLE=auto, a reader that gets the writer lock (the writer
+    exited) becomes the writer: it reloads the index with the chunk store
+    repairs and starts the ingestion queue.
+    """
+    while True:
+        await asyncio.sleep(INDEX_REFRESH_SECONDS)
+        try:
+            if WORKER_ROLE == "auto" and acquire_writer_lock():
+                logger.warning("Writer lock acquired: this worker is now the writer")
+                start_ingestion()
+                await asyncio.to_thread(become_writer)
+                start_writer_socket()
+                maybe_schedule_compaction()
+                return
+            await asyncio.to_thread(refresh_vector_db)
+        except Exception as e:
+            logger.exception("Error refreshing the vector database: %s", e)
+
+# Function to switch a reader to the writer role
+def become_writer() -> None:
+    """Reload the index as the writer (the writer lock must be held)."""
+    global vector_db, worker_role
+    # Sob o lock, nenhum upload é aplicado ao índice antes da recarga
+    with index_lock:
+        worker_role = "writer"
+        vector_db = load_vector_db()
+
+# Função para encerrar a fila de ingestão no desligamento
+@app.on_event("shutdown")
+async def shutdown_ingestion():
+    """Stop the ingestion workers, the extraction process pool, the writer's socket and the index refresh."""
+    if index_refresh_task is not None:
+        index_refresh_task.cancel()
+    if writer_socket_server is not None:
+        writer_socket_server.should_exit = True
+    for worker in ingestion_workers:
+        worker.cancel()
+    if ingest_process_pool is not None:
+        ingest_process_pool.shutdown(wait=False, cancel_futures=True)
 
 # Run the application
 if __name__ == "__main__":
@@ -0,0 +1,566 @@
+"""Benchmark do servidor completo sem a API da OpenAI: ingestão, perguntas, chat e startup.
+
+Uso:
+    python bench_app.py                                   # corpus sintético padrão
+    python bench_app.py --docs 200 --doc-chars 50000 --json report.json
+    python bench_app.py --queries 1000 --concurrency 32 --ws-connections 64
+    python bench_app.py --json new.json --baseline old.json --tolerance 0.2
+
+O app roda num uvicorn local com os modelos trocados por substitutos
+determinísticos: embeddings por hashing das palavras com projeção aleatória
+fixa (textos com as mesmas palavras ficam próximos) e um chat que responde
+com latência fixa até o primeiro token e entre os tokens. A latência da API
+de embeddings também é simulada. As perguntas são frases dos próprios
+documentos, então a busca encontra trechos relevantes.
+
+Etapas medidas: startup com o índice vazio, ingestão do corpus via /upload
+(até todos os jobs terminarem), latência de /perguntar com perguntas
+concorrentes, carga de conexões simultâneas no /ws/chat (tempo até o
+primeiro delta e total), startup com o índice carregado do disco (num
+processo Python novo, sem o import e o aquecimento do benchmark) e pico de
+memória (RSS do processo, que inclui o cliente; os processos de extração
+aparecem à parte, no Linux). O cache de respostas fica desligado, salvo com
+--answer-cache. Com --baseline, as métricas principais são comparadas com
+um relatório anterior e o script sai com código 1 se alguma piorar mais do
+que --tolerance.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import zlib
+import random
+import shutil
+import socket
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+import importlib
+
+import numpy as np
+
+# Os caminhos do índice e dos uploads são relativos ao diretório atual: o app só é
+# importado depois do chdir para o diretório de trabalho (ver load_app)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Métricas comparadas com --baseline: caminho no relatório e se valores maiores são melhores
+REGRESSION_METRICS = [
+    ("ingestion.chunks_per_second", True),
+    ("query.p50_ms", False),
+    ("query.p95_ms", False),
+    ("ws.ttft_p95_ms", False),
+    ("ws.total_p95_ms", False),
+    ("startup.loaded_ms", False),
+    ("memory.peak_rss_mb", False),
+]
+
+# Startup com o índice gravado, medido num processo novo: no processo do benchmark o
+# app já está importado e aquecido (argumentos: diretório do script, workdir, args em JSON)
+LOADED_STARTUP_SCRIPT = (
+    "import sys, json, argparse; sys.path.insert(0, sys.argv[1]); import bench_app; "
+    "print(json.dumps(bench_app.measure_startup(sys.argv[2], argparse.Namespace(**json.loads(sys.argv[3])))))"
+)
+
+SYLLABLES = "ba be bi bo bu ca ce ci co da de di do fa fe fi ga go la le li lo ma me mi mo na ne ni no pa pe pi po ra re ri ro sa se si so ta te ti to va ve vi".split()
+
+class HashEmbeddings:
+    """Deterministic stand-in for OpenAIEmbeddings: hashed bag of words times a fixed random projection.
+
+    Each call waits `latency_ms` (the API round trip) and computes the vectors
+    on a thread, as the real client does not use the server's CPU.
+    """
+
+    def __init__(self, dimension: int = 1536, buckets: int = 4096, latency_ms: float = 0.0, model: str = "text-embedding-3-small"):
+        rng = np.random.default_rng(0)
+        self.projection = (rng.standard_normal((buckets, dimension)) / np.sqrt(dimension)).astype(np.float32)
+        self.buckets = buckets
+        self.latency = latency_ms / 1000
+        self.model = model
+        self.calls = 0
+        self.inputs = 0
+
+    def _embed(self, texts):
+        vectors = np.zeros((len(texts), self.projection.shape[1]), dtype=np.float32)
+        for row, text in enumerate(texts):
+            buckets = [zlib.crc32(word.encode("utf-8")) % self.buckets for word in text.lower().split()]
+            if buckets:
+                ids, counts = np.unique(buckets, return_counts=True)
+                vectors[row] = counts.astype(np.float32) @ self.projection[ids]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return (vectors / np.maximum(norms, 1e-12)).tolist()
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        self.inputs += len(texts)
+        time.sleep(self.latency)
+        return self._embed(texts)
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        self.calls += 1
+        self.inputs += len(texts)
+        await asyncio.sleep(self.latency)
+        return await asyncio.to_thread(self._embed, texts)
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+class CannedChat:
+    """Stand-in for ChatOpenAI: a fixed answer after `ttft_ms`, then one token every `token_ms`."""
+
+    def __init__(self, ttft_ms: float = 300.0, token_ms: float = 10.0, answer_tokens: int = 60):
+        self.ttft = ttft_ms / 1000
+        self.token = token_ms / 1000
+        self.words = [f" {SYLLABLES[i % len(SYLLABLES)]}{SYLLABLES[(i * 7) % len(SYLLABLES)]}" for i in range(answer_tokens)]
+        self.calls = 0
+
+    async def agenerate(self, batches):
+        from langchain_core.messages import AIMessage
+        from langchain_core.outputs import ChatGeneration, LLMResult
+        self.calls += len(batches)
+        await asyncio.sleep(self.ttft + self.token * (len(self.words) - 1))
+        answer = "".join(self.words).strip()
+        return LLMResult(generations=[[ChatGeneration(message=AIMessage(content=answer))] for _ in batches])
+
+    async def astream(self, messages):
+        from langchain_core.messages import AIMessageChunk
+        self.calls += 1
+        await asyncio.sleep(self.ttft)
+        for position, word in enumerate(self.words):
+            if position:
+                await asyncio.sleep(self.token)
+            yield AIMessageChunk(content=word)
+
+def synthetic_corpus(docs: int, chars: int, seed: int = 42):
+    """Generate documents (alternating .txt and .md) whose topics use distinct vocabularies.
+
+    Returns (file name, text, sentences) tuples; the sentences are the pool of questions.
+    """
+    rng = random.Random(seed)
+    vocabulary = sorted({"".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(20000)})
+    common = vocabulary[:300]
+    topics = [vocabulary[300 + i * 400:300 + (i + 1) * 400] for i in range(max(1, (len(vocabulary) - 300) // 400))]
+    corpus = []
+    for number in range(docs):
+        topic = topics[number % len(topics)]
+        markdown = number % 2 == 1
+        paragraphs, sentences = [], []
+        size = 0
+        while size < chars:
+            paragraph = []
+            for _ in range(rng.randint(2, 6)):
+                words = [rng.choice(topic if rng.random() < 0.7 else common) for _ in range(rng.randint(6, 30))]
+                sentence = " ".join(words).capitalize() + "."
+                paragraph.append(sentence)
+                sentences.append(sentence)
+            if markdown and len(paragraphs) % 5 == 0:
+                paragraphs.append(f"## Seção {len(paragraphs) // 5 + 1}")
+            paragraphs.append(" ".join(paragraph))
+            size += sum(len(sentence) + 1 for sentence in paragraph) + 2
+        name = f"bench-{number:04d}.{'md' if markdown else 'txt'}"
+        corpus.append((name, "\n\n".join(paragraphs)[:chars], sentences))
+    return corpus
+
+def make_questions(corpus, count: int, seed: int = 7):
+    """Pick sentences of the corpus, shortened to at most 12 words, as questions."""
+    rng = random.Random(seed)
+    questions = []
+    for _ in range(count):
+        _, _, sentences = corpus[rng.randrange(len(corpus))]
+        words = rng.choice(sentences).rstrip(".").split()[:12]
+        questions.append(" ".join(words) + "?")
+    return questions
+
+def percentiles(values, prefix: str = ""):
+    if not values:
+        return {f"{prefix}p50_ms": None, f"{prefix}p95_ms": None, f"{prefix}p99_ms": None, f"{prefix}max_ms": None}
+    values = np.array(values)
+    return {
+        f"{prefix}p50_ms": round(float(np.percentile(values, 50)), 2),
+        f"{prefix}p95_ms": round(float(np.percentile(values, 95)), 2),
+        f"{prefix}p99_ms": round(float(np.percentile(values, 99)), 2),
+        f"{prefix}max_ms": round(float(values.max()), 2),
+    }
+
+def peak_rss_mb() -> float:
+    # ru_maxrss é em KB no Linux e em bytes no macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20, 1)
+
+def pool_peak_rss_mb(app):
+    """Sum of the peak RSS of the extraction processes (Linux only; None elsewhere)."""
+    total = 0
+    for pid in list(app.ingest_process_pool._processes):
+        try:
+            with open(f"/proc/{pid}/status", encoding="ascii") as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+        except (OSError, StopIteration):
+            return None
+    return round(total / 1024, 1)
+
+def warm_up_pool(app) -> float:
+    """Start every extraction process and return the seconds it took.
+    
+    The processes are spawned on demand and import app.py on their first
+    task; warming them up keeps that one-time cost out of the ingestion numbers.
+    """
+    start = time.perf_counter()
+    # Uma função do app obriga o processo a importá-lo; enquanto um processo importa,
+    # as tarefas seguintes ficam para os outros
+    tasks = [app.ingest_process_pool.submit(app.page_ranges, "warmup.txt") for _ in range(app.INGEST_PROCESS_WORKERS)]
+    for task in tasks:
+        task.result()
+    return time.perf_counter() - start
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def load_app(workdir: str, args):
+    """Import app.py inside `workdir` and swap its models for the local stand-ins."""
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    if not args.answer_cache:
+        os.environ["ANSWER_CACHE_MAX_ENTRIES"] = "0"
+    os.chdir(workdir)
+    app = importlib.import_module("app")
+
+    app.embeddings_model = HashEmbeddings(args.dimension, latency_ms=args.embed_latency_ms, model=app.embeddings_model.model)
+    app.query_embedder.embeddings = app.embeddings_model
+    app.chat_model = CannedChat(args.llm_ttft_ms, args.llm_token_ms, args.answer_tokens)
+    return app
+
+class BenchServer:
+    """Run the app on a local uvicorn in a background thread."""
+
+    def __init__(self, app, port: int):
+        self.app = app
+        self.port = port
+        self.server = None
+        self.thread = None
+
+    def start(self) -> float:
+        """Start the server and return the seconds until it accepted connections (startup included)."""
+        import uvicorn
+        config = uvicorn.Config(self.app.app, host="127.0.0.1", port=self.port, log_level="warning", lifespan="on")
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        start = time.perf_counter()
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("O servidor não subiu")
+            time.sleep(0.002)
+        return time.perf_counter() - start
+
+    def stop(self) -> None:
+        self.server.should_exit = True
+        self.thread.join()
+
+def measure_startup(workdir: str, args) -> dict:
+    """Import the app in `workdir`, start the server and return the times (runs in the fresh process)."""
+    start = time.perf_counter()
+    app = load_app(workdir, args)
+    imported = time.perf_counter() - start
+    server = BenchServer(app, free_port())
+    startup = server.start()
+    vectors = app.vector_db.ntotal if app.vector_db is not None else 0
+    server.stop()
+    return {"import_ms": round(imported * 1000, 1), "startup_ms": round(startup * 1000, 1), "vectors": vectors}
+
+def run_loaded_startup(workdir: str, args) -> dict:
+    """Measure the startup with the saved index in a new Python process."""
+    options = {key: value for key, value in vars(args).items() if key not in ("json", "baseline", "workdir")}
+    result = subprocess.run(
+        [sys.executable, "-c", LOADED_STARTUP_SCRIPT, os.path.dirname(os.path.abspath(__file__)), workdir, json.dumps(options)],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"O servidor não subiu no processo novo:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+async def run_ingestion(base_url: str, corpus, concurrency: int):
+    """Upload the corpus and wait for every ingestion job to finish."""
+    import httpx
+    semaphore = asyncio.Semaphore(concurrency)
+    upload_ms, jobs = [], []
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as client:
+        async def upload(name: str, text: str):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/upload", files={"file": (name, text.encode("utf-8"))})
+                upload_ms.append((time.perf_counter() - start) * 1000)
+                response.raise_for_status()
+                job_id = response.json().get("job_id")
+            # Acompanhar o job até o fim
+            while job_id:
+                job = (await client.get(f"/jobs/{job_id}")).json()
+                if job["status"] in ("done", "failed"):
+                    jobs.append(job)
+                    return
+                await asyncio.sleep(0.05)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[upload(name, text) for name, text, _ in corpus])
+        seconds = time.perf_counter() - start
+
+    done = [job for job in jobs if job["status"] == "done"]
+    chunks = sum(job["result"].get("chunks", 0) for job in done)
+    size = sum(len(text.encode("utf-8")) for _, text, _ in corpus)
+    return {
+        "documents": len(corpus),
+        "failed": len(jobs) - len(done),
+        "chunks": chunks,
+        "megabytes": round(size / 2**20, 2),
+        "seconds": round(seconds, 3),
+        "documents_per_second": round(len(corpus) / seconds, 2),
+        "chunks_per_second": round(chunks / seconds, 1),
+        "megabytes_per_second": round(size / 2**20 / seconds, 3),
+        **percentiles(upload_ms, "upload_"),
+        **percentiles([(job["finished_at"] - job["created_at"]) * 1000 for job in done], "job_"),
+    }
+
+async def run_queries(base_url: str, questions, concurrency: int, top_k: int, mode):
+    """Ask the questions on /perguntar, `concurrency` at a time."""
+    import httpx
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+    server_timings = {}
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as client:
+        async def ask(question: str):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/perguntar", json={"question": question, "top_k": top_k, "mode": mode})
+                elapsed = (time.perf_counter() - start) * 1000
+            if response.status_code != 200:
+                errors += 1
+                return
+            latencies.append(elapsed)
+            for key, value in response.json().get("timings", {}).items():
+                server_timings.setdefault(key, []).append(value)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[ask(question) for question in questions])
+        seconds = time.perf_counter() - start
+
+    return {
+        "questions": len(questions),
+        "concurrency": concurrency,
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "questions_per_second": round(len(latencies) / seconds, 2),
+        **percentiles(latencies),
+        "server_timings_avg": {key: round(sum(values) / len(values), 2) for key, values in sorted(server_timings.items())},
+    }
+
+async def run_websockets(ws_url: str, questions, connections: int, per_connection: int, top_k: int, mode):
+    """Open `connections` /ws/chat connections at once, each asking `per_connection` questions in turn."""
+    import websockets
+    ttft, totals, errors = [], [], 0
+
+    async def converse(number: int):
+        nonlocal errors
+        async with websockets.connect(ws_url, max_size=None) as ws:
+            for turn in range(per_connection):
+                question = questions[(number * per_connection + turn) % len(questions)]
+                request_id = uuid.uuid4().hex
+                start = time.perf_counter()
+                first = None
+                await ws.send(json.dumps({"request_id": request_id, "question": question, "top_k": top_k, "mode": mode}))
+                while True:
+                    frame = json.loads(await ws.recv())
+                    if frame.get("request_id") != request_id:
+                        continue
+                    if frame["type"] in ("delta", "done") and first is None:
+                        first = time.perf_counter()
+                    if frame["type"] == "error":
+                        errors += 1
+                        break
+                    if frame["type"] == "done":
+                        ttft.append((first - start) * 1000)
+                        totals.append((time.perf_counter() - start) * 1000)
+                        break
+
+    start = time.perf_counter()
+    await asyncio.gather(*[converse(number) for number in range(connections)])
+    seconds = time.perf_counter() - start
+    return {
+        "connections": connections,
+        "questions": connections * per_connection,
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "questions_per_second": round(len(totals) / seconds, 2),
+        **percentiles(ttft, "ttft_"),
+        **percentiles(totals, "total_"),
+    }
+
+def stage_metrics(app):
+    """Summarize the server's stage histograms (count and mean per stage)."""
+    summary = {}
+    for line in app.stage_seconds.render():
+        if line.startswith("#") or "_bucket{" in line:
+            continue
+        name, value = line.rsplit(" ", 1)
+        stage = name.split('stage="', 1)[1].split('"', 1)[0]
+        field = "count" if name.startswith(f"{app.stage_seconds.name}_count") else "sum"
+        summary.setdefault(stage, {})[field] = float(value)
+    return {
+        stage: {"count": int(values["count"]), "mean_ms": round(values["sum"] / values["count"] * 1000, 3) if values["count"] else 0.0}
+        for stage, values in sorted(summary.items())
+    }
+
+def lookup(report, path: str):
+    for key in path.split("."):
+        if not isinstance(report, dict) or key not in report:
+            return None
+        report = report[key]
+    return report
+
+def compare(report, baseline, tolerance: float) -> bool:
+    """Print the change of each REGRESSION_METRICS entry; returns False when one got worse than `tolerance`."""
+    ok = True
+    print(f"\n{'métrica':<30}{'baseline':>12}{'atual':>12}{'variação':>10}")
+    for path, higher_is_better in REGRESSION_METRICS:
+        old, new = lookup(baseline, path), lookup(report, path)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        flag = "  REGRESSÃO" if worse > tolerance else ""
+        ok = ok and not flag
+        print(f"{path:<30}{old:>12}{new:>12}{change:>+10.1%}{flag}")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=20, help="Documentos do corpus sintético")
+    parser.add_argument("--doc-chars", type=int, default=20000, help="Caracteres por documento")
+    parser.add_argument("--upload-concurrency", type=int, default=4, help="Uploads enviados ao mesmo tempo")
+    parser.add_argument("--queries", type=int, default=200, help="Perguntas enviadas a /perguntar")
+    parser.add_argument("--concurrency", type=int, default=8, help="Perguntas simultâneas em /perguntar")
+    parser.add_argument("--ws-connections", type=int, default=8, help="Conexões simultâneas no /ws/chat")
+    parser.add_argument("--ws-questions", type=int, default=10, help="Perguntas por conexão (uma de cada vez)")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--mode", default=None, help="Modo de busca (vector, lexical, hybrid; padrão: RETRIEVAL_MODE)")
+    parser.add_argument("--dimension", type=int, default=1536, help="Dimensão das embeddings simuladas")
+    parser.add_argument("--embed-latency-ms", type=float, default=20.0, help="Latência simulada de cada chamada de embeddings")
+    parser.add_argument("--llm-ttft-ms", type=float, default=300.0, help="Tempo simulado até o primeiro token")
+    parser.add_argument("--llm-token-ms", type=float, default=10.0, help="Tempo simulado entre os tokens")
+    parser.add_argument("--answer-tokens", type=int, default=60, help="Tokens de cada resposta simulada")
+    parser.add_argument("--answer-cache", action="store_true", help="Manter o cache de respostas ligado")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workdir", help="Diretório do índice e dos uploads (padrão: temporário, removido no fim)")
+    parser.add_argument("--json", help="Gravar os resultados neste arquivo")
+    parser.add_argument("--baseline", help="Relatório JSON anterior para comparar")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Piora relativa tolerada em relação ao baseline")
+    args = parser.parse_args()
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix="bench-app-")
+    os.makedirs(workdir, exist_ok=True)
+    if os.path.exists(os.path.join(workdir, "faiss_index")):
+        print(f"{workdir} já tem um índice; use um diretório vazio")
+        return 1
+
+    corpus = synthetic_corpus(args.docs, args.doc_chars, args.seed)
+    questions = make_questions(corpus, max(args.queries, args.ws_connections * args.ws_questions), args.seed + 1)
+    app = load_app(workdir, args)
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    print(f"Corpus: {args.docs} documentos x {args.doc_chars} caracteres; diretório {workdir}")
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "index_type": app.INDEX_TYPE,
+            "vector_encoding": app.VECTOR_ENCODING,
+            "retrieval_mode": args.mode or app.RETRIEVAL_MODE,
+        },
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("json", "baseline", "workdir")},
+    }
+    memory = {}
+    server = BenchServer(app, port)
+    try:
+        cold = server.start()
+        warmup = warm_up_pool(app)
+        memory["after_startup_mb"] = peak_rss_mb()
+        print(f"Startup (índice vazio): {cold * 1000:.0f} ms; processos de extração prontos em {warmup * 1000:.0f} ms")
+
+        report["ingestion"] = asyncio.run(run_ingestion(base_url, corpus, args.upload_concurrency))
+        memory["after_ingestion_mb"] = peak_rss_mb()
+        ingestion = report["ingestion"]
+        print(
+            f"Ingestão: {ingestion['chunks']} chunks em {ingestion['seconds']}s "
+            f"({ingestion['chunks_per_second']} chunks/s, {ingestion['megabytes_per_second']} MB/s, {ingestion['failed']} falhas)"
+        )
+
+        report["query"] = asyncio.run(run_queries(base_url, questions[:args.queries], args.concurrency, args.top_k, args.mode))
+        query = report["query"]
+        print(
+            f"/perguntar: {query['questions_per_second']} perguntas/s; p50 {query['p50_ms']} ms, "
+            f"p95 {query['p95_ms']} ms, p99 {query['p99_ms']} ms ({query['errors']} erros)"
+        )
+
+        ws_url = f"ws://127.0.0.1:{port}/ws/chat"
+        report["ws"] = asyncio.run(run_websockets(ws_url, questions, args.ws_connections, args.ws_questions, args.top_k, args.mode))
+        memory["after_queries_mb"] = peak_rss_mb()
+        ws = report["ws"]
+        print(
+            f"/ws/chat: {ws['connections']} conexões; primeiro token p50 {ws['ttft_p50_ms']} ms, p95 {ws['ttft_p95_ms']} ms; "
+            f"total p95 {ws['total_p95_ms']} ms ({ws['errors']} erros)"
+        )
+        report["stages"] = stage_metrics(app)
+        memory["extraction_processes_peak_rss_mb"] = pool_peak_rss_mb(app)
+
+        # Subir o app de novo, noutro processo: o startup agora carrega o índice gravado
+        server.stop()
+        # O lock de writer é do processo: liberá-lo para o novo servidor
+        if app.writer_lock_file is not None:
+            app.writer_lock_file.close()
+            app.writer_lock_file = None
+        loaded = run_loaded_startup(workdir, args)
+        print(f"Startup (índice com {loaded['vectors']} vetores, processo novo): {loaded['startup_ms']:.0f} ms, mais {loaded['import_ms']:.0f} ms de import")
+        report["startup"] = {
+            "cold_ms": round(cold * 1000, 1),
+            "loaded_ms": loaded["startup_ms"],
+            "loaded_import_ms": loaded["import_ms"],
+            "extraction_pool_ms": round(warmup * 1000, 1),
+            "vectors": loaded["vectors"],
+        }
+    finally:
+        server.stop()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    memory["peak_rss_mb"] = peak_rss_mb()
+    report["memory"] = memory
+    print(f"Memória: pico de {memory['peak_rss_mb']} MB no processo, {memory['extraction_processes_peak_rss_mb']} MB nos processos de extração")
+
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Resultados gravados em {json_path}")
+    if baseline_path:
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if not compare(report, baseline, args.tolerance):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""Benchmark do chunker por tokens contra o RecursiveCharacterTextSplitter anterior.
+
+Uso:
+    python bench_chunker.py [arquivo.pdf|arquivo.md|arquivo.txt] [--chars N] [--repeat N]
+
+Sem arquivo, gera um texto sintético com parágrafos e frases de tamanhos variados.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+# app.py exige uma chave na importação; o benchmark não chama a API
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+import app
+
+WORDS = (
+    "documento sistema dados processamento modelo consulta resposta contexto busca vetor "
+    "índice página arquivo texto análise resultado cérebro memória rede camada função "
+    "the of and to in is for that with on as by this from are be"
+).split()
+
+def synthetic_text(chars: int, seed: int = 42) -> str:
+    """Generate deterministic text with paragraphs and sentences of varying length."""
+    rng = random.Random(seed)
+    paragraphs = []
+    size = 0
+    while size < chars:
+        sentences = []
+        for _ in range(rng.randint(1, 8)):
+            words = [rng.choice(WORDS) for _ in range(rng.randint(4, 40))]
+            sentences.append(" ".join(words).capitalize() + rng.choice([".", ".", ".", "?", "!", ";"]))
+        paragraph = " ".join(sentences)
+        paragraphs.append(paragraph)
+        size += len(paragraph) + 2
+    return "\n\n".join(paragraphs)[:chars]
+
+def recursive_chunks(text: str, chunk_size: int, chunk_overlap: int):
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=lambda text: len(app.tokenizer.encode(text)),
+    )
+    return splitter.split_text(text)
+
+def token_chunks(text: str, chunk_size: int, chunk_overlap: int):
+    return [chunk["text"] for chunk in app.chunk_text(text, chunk_size, chunk_overlap)]
+
+def measure(name, func, text, chunk_size, chunk_overlap, repeat):
+    best = float("inf")
+    chunks = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = func(text, chunk_size, chunk_overlap)
+        best = min(best, time.perf_counter() - start)
+    token_counts = [len(app.tokenizer.encode(chunk)) for chunk in chunks] or [0]
+    return {
+        "name": name,
+        "seconds": best,
+        "chunks": len(chunks),
+        "avg_tokens": sum(token_counts) / len(token_counts),
+        "max_tokens": max(token_counts),
+        "chars_per_second": len(text) / best if best > 0 else 0.0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", help="Documento a ser dividido (padrão: texto sintético)")
+    parser.add_argument("--chars", type=int, default=2_000_000, help="Tamanho do texto sintético")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetições (vale o melhor tempo)")
+    parser.add_argument("--chunk-size", type=int, default=app.CHUNK_SIZE_TOKENS)
+    parser.add_argument("--chunk-overlap", type=int, default=app.CHUNK_OVERLAP_TOKENS)
+    parser.add_argument("--skip-recursive", action="store_true", help="Medir apenas o chunker por tokens")
+    args = parser.parse_args()
+    
+    text = app.extract_text(args.path) if args.path else synthetic_text(args.chars)
+    print(f"Texto: {len(text):,} caracteres, {len(app.tokenizer.encode_ordinary(text)):,} tokens")
+    
+    # As tabelas por token são montadas uma vez por processo: ficam fora do tempo do chunker
+    start = time.perf_counter()
+    app.get_token_tables()
+    print(f"Tabelas por token: {time.perf_counter() - start:.3f}s (uma vez por processo, fora das medições)")
+    
+    results = [measure("token_chunker", token_chunks, text, args.chunk_size, args.chunk_overlap, args.repeat)]
+    if not args.skip_recursive:
+        results.append(measure("recursive_splitter", recursive_chunks, text, args.chunk_size, args.chunk_overlap, args.repeat))
+    
+    print(f"{'chunker':<20}{'segundos':>10}{'chunks':>8}{'média tok':>11}{'máx tok':>9}{'chars/s':>14}")
+    for r in results:
+        print(
+            f"{r['name']:<20}{r['seconds']:>10.3f}{r['chunks']:>8}"
+            f"{r['avg_tokens']:>11.1f}{r['max_tokens']:>9}{r['chars_per_second']:>14,.0f}"
+        )
+    if len(results) == 2 and results[0]["seconds"] > 0:
+        print(f"Speedup: {results[1]['seconds'] / results[0]['seconds']:.1f}x")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+"""Relatório de recall@k, latência e memória dos índices contra a busca exata (flat, float32).
+
+Uso:
+    python bench_index.py                      # vetores do índice em faiss_index/
+    python bench_index.py --synthetic 200000   # vetores sintéticos agrupados
+    python bench_index.py --types hnsw --ef-search 32,64,128 --json report.json
+    python bench_index.py --types "" --encodings float32,float16,sq8 --dimensions 0,512,256
+
+As consultas são vetores do corpus com ruído (perguntas próximas de trechos
+existentes); a verdade de referência vem de um IndexFlatL2. A latência é por
+consulta, uma de cada vez, como no servidor. A memória (MB/1M) é o tamanho do
+índice serializado por milhão de trechos, sem o docstore.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+# app.py exige uma chave na importação; o benchmark não chama a API
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import faiss
+import numpy as np
+
+import app
+
+def synthetic_vectors(n: int, dimension: int, seed: int = 42) -> np.ndarray:
+    """Generate unit vectors grouped in clusters, like embeddings of related chunks.
+    
+    The variance decays along the dimensions, concentrating information in
+    the first ones as in text-embedding-3, so truncation has a realistic cost.
+    """
+    rng = np.random.default_rng(seed)
+    decay = (1.0 / np.sqrt(1.0 + np.arange(dimension) / 32.0)).astype(np.float32)
+    centers = rng.standard_normal((max(1, n // 500), dimension)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), n)] + 0.6 * rng.standard_normal((n, dimension)).astype(np.float32)
+    vectors *= decay
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def make_queries(vectors: np.ndarray, count: int, noise: float = 0.3, seed: int = 7) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.integers(0, len(vectors), count)]
+    queries = queries + noise * rng.standard_normal(queries.shape).astype(np.float32) / np.sqrt(vectors.shape[1])
+    return (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+def run_queries(index, queries: np.ndarray, k: int):
+    latencies = []
+    labels = []
+    for query in queries:
+        start = time.perf_counter()
+        _, found = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        labels.append(found[0])
+    return np.array(labels), np.array(latencies)
+
+def recall_at_k(labels: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    return float(np.mean([len(set(found) & set(expected)) / k for found, expected in zip(labels, truth)]))
+
+def parse_list(value: str):
+    return [int(v) for v in value.split(",") if v]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--synthetic", type=int, default=0, help="Usar N vetores sintéticos em vez do índice salvo")
+    parser.add_argument("--dimension", type=int, default=1536, help="Dimensão dos vetores sintéticos")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--types", default="hnsw,ivf_flat,ivf_pq", help="Tipos comparados com o flat")
+    parser.add_argument("--ef-search", default="16,32,64,128,256", help="Valores de efSearch (HNSW)")
+    parser.add_argument("--nprobe", default="1,4,16,64", help="Valores de nprobe (IVF)")
+    parser.add_argument("--encodings", default="float32,float16,sq8", help="Codificações dos vetores comparadas")
+    parser.add_argument("--dimensions", default="0", help="Dimensões mantidas, ex.: 0,512,256 (0 = todas)")
+    parser.add_argument("--json", help="Gravar os resultados neste arquivo")
+    args = parser.parse_args()
+    
+    if args.synthetic:
+        vectors = synthetic_vectors(args.synthetic, args.dimension)
+        source = f"synthetic ({args.synthetic} x {args.dimension})"
+    else:
+        # Só leitura: o índice pode estar em uso por um servidor
+        app.worker_role = "reader"
+        db = app.load_vector_db()
+        if db is None:
+            print(f"Nenhum índice encontrado em {app.FAISS_INDEX_PATH}; use --synthetic N")
+            return 1
+        vectors = db.reconstruct(np.arange(db.ntotal, dtype=np.int64))
+        source = f"{app.FAISS_INDEX_PATH} ({len(vectors)} x {vectors.shape[1]})"
+    queries = make_queries(vectors, args.queries)
+    print(f"Vetores: {source}; {len(queries)} consultas; k={args.k}")
+    
+    flat = app.new_faiss_index(vectors, "flat", "float32")
+    flat.add(vectors)
+    truth, _ = run_queries(flat, queries, args.k)
+    
+    results = []
+    encodings = [e for e in args.encodings.split(",") if e]
+    for dimensions in parse_list(args.dimensions):
+        shortened = app.truncate_vectors(vectors, dimensions)
+        shortened_queries = app.truncate_vectors(queries, dimensions)
+        for index_type in ["flat"] + [t for t in args.types.split(",") if t and t != "flat"]:
+            # O IVF-PQ tem códigos próprios: a codificação dos vetores não se aplica
+            for encoding in (encodings[:1] if index_type == "ivf_pq" else encodings):
+                # Construção com todos os núcleos; as buscas usam as threads do servidor
+                faiss.omp_set_num_threads(os.cpu_count() or 1)
+                start = time.perf_counter()
+                index = app.new_faiss_index(shortened, index_type, encoding)
+                index.add(shortened)
+                build_s = time.perf_counter() - start
+                faiss.omp_set_num_threads(app.FAISS_OMP_THREADS)
+                if app.index_type_of(index) != index_type:
+                    print(f"{index_type}: poucos vetores para treinar, ignorado")
+                    continue
+                
+                mb_per_million = len(faiss.serialize_index(index)) / len(shortened) * 1_000_000 / 2**20
+                if index_type == "hnsw":
+                    param, values = "ef_search", parse_list(args.ef_search)
+                elif index_type == "flat":
+                    param, values = None, [None]
+                else:
+                    param, values = "nprobe", parse_list(args.nprobe)
+                for value in values:
+                    if param:
+                        app.configure_index(index, **{param: value})
+                    labels, latencies = run_queries(index, shortened_queries, args.k)
+                    results.append({
+                        "type": index_type,
+                        "encoding": app.index_encoding_of(index),
+                        "dimensions": index.d,
+                        "param": param,
+                        "value": value,
+                        "build_s": round(build_s, 2),
+                        "mb_per_million": round(mb_per_million, 1),
+                        "recall": recall_at_k(labels, truth),
+                        "p50_ms": float(np.percentile(latencies, 50)),
+                        "p95_ms": float(np.percentile(latencies, 95)),
+                    })
+    
+    print(
+        f"{'tipo':<10}{'vetores':<10}{'dims':>6}  {'parâmetro':<16}{'recall@' + str(args.k):>10}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'MB/1M':>10}{'build s':>10}"
+    )
+    for r in results:
+        setting = f"{r['param']}={r['value']}" if r["param"] else "-"
+        print(
+            f"{r['type']:<10}{r['encoding']:<10}{r['dimensions']:>6}  {setting:<16}{r['recall']:>10.3f}"
+            f"{r['p50_ms']:>10.3f}{r['p95_ms']:>10.3f}{r['mb_per_million']:>10.0f}{r['build_s']:>10.2f}"
+        )
+    
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"source": source, "queries": len(queries), "k": args.k, "results": results}, f, indent=2)
+        print(f"Resultados gravados em {args.json}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
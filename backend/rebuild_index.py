@@ -0,0 +1,66 @@
+"""Reconstrói o índice em faiss_index/ com outro tipo de índice FAISS.
+
+Uso (com o servidor parado):
+    python rebuild_index.py --type hnsw
+    python rebuild_index.py --type ivf_flat --encoding sq8 --dimensions 512
+    python rebuild_index.py --type ivf_pq --dry-run
+
+Os parâmetros de construção vêm das mesmas variáveis de ambiente do servidor
+(HNSW_M, HNSW_EF_CONSTRUCTION, IVF_NLIST, PQ_M, PQ_NBITS). Depois da
+reconstrução, inicie o servidor com INDEX_TYPE, VECTOR_ENCODING e
+VECTOR_DIMENSIONS iguais aos escolhidos.
+"""
+import os
+import sys
+import time
+import argparse
+
+# app.py exige uma chave na importação; a reconstrução não chama a API
+os.environ.setdefault("OPENAI_API_KEY", "rebuild")
+
+import faiss
+
+import app
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--type", choices=app.INDEX_TYPES, default=app.INDEX_TYPE, help="Tipo do novo índice (padrão: INDEX_TYPE)")
+    parser.add_argument("--encoding", choices=list(app.VECTOR_ENCODINGS), default=app.VECTOR_ENCODING, help="Armazenamento dos vetores (padrão: VECTOR_ENCODING)")
+    parser.add_argument("--dimensions", type=int, default=app.VECTOR_DIMENSIONS, help="Dimensões mantidas (padrão: VECTOR_DIMENSIONS, 0 = todas)")
+    parser.add_argument("--dry-run", action="store_true", help="Construir o índice sem gravar o snapshot")
+    args = parser.parse_args()
+    
+    # Fora do servidor, o treino e a construção podem usar todos os núcleos
+    faiss.omp_set_num_threads(os.cpu_count() or 1)
+    # Os vetores são todos lidos de volta: não há ganho em mapear o índice atual
+    app.INDEX_MMAP = False
+    
+    # Só o writer grava snapshots: com o servidor no ar, o lock de escrita é dele
+    if not app.acquire_writer_lock():
+        if not args.dry_run:
+            print(f"Outro processo é o writer de {app.FAISS_INDEX_PATH}; pare o servidor ou use --dry-run")
+            return 1
+        app.worker_role = "reader"
+    
+    db = app.load_vector_db()
+    if db is None:
+        print(f"Nenhum índice encontrado em {app.FAISS_INDEX_PATH}")
+        return 1
+    
+    print(f"Índice atual: {app.index_info(db.index)}")
+    if app.index_encoding_of(db.index) in ("sq8", "pq"):
+        print("Aviso: os vetores do índice atual são quantizados; o novo índice herdará esse erro")
+    
+    start = time.perf_counter()
+    rebuilt = app.rebuild_vector_db(db, args.type, args.encoding, args.dimensions)
+    print(f"Novo índice: {app.index_info(rebuilt.index)} ({time.perf_counter() - start:.1f}s)")
+    print(f"Tamanho: {len(faiss.serialize_index(db.index)) / 2**20:.1f} MB -> {len(faiss.serialize_index(rebuilt.index)) / 2**20:.1f} MB")
+    
+    if args.dry_run:
+        print("Dry run: snapshot não gravado")
+        return 0
+    app.save_vector_db(rebuilt)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
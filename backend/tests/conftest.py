@@ -0,0 +1,35 @@
+"""Importa o app num diretório temporário, sem a API da OpenAI."""
+import os
+import sys
+import shutil
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# app.py exige uma chave na importação e grava o índice no diretório atual
+os.environ.setdefault("OPENAI_API_KEY", "test")
+_cwd = os.getcwd()
+os.chdir(tempfile.mkdtemp(prefix="super-cerebro-test-"))
+try:
+    import app
+finally:
+    os.chdir(_cwd)
+
+@pytest.fixture
+def empty_index():
+    """Índice vazio, na memória e no disco (snapshots, manifest e segmentos), antes e depois do teste."""
+    def reset():
+        app.vector_db = None
+        app.chunk_store.truncate(0)
+        shutil.rmtree(app.SEGMENTS_DIR, ignore_errors=True)
+        if os.path.exists(app.MANIFEST_PATH):
+            os.remove(app.MANIFEST_PATH)
+        for entry in os.listdir(app.FAISS_INDEX_PATH):
+            if entry.startswith("snapshot-"):
+                shutil.rmtree(os.path.join(app.FAISS_INDEX_PATH, entry), ignore_errors=True)
+        app.segment_seq = app.compacted_seq = app.snapshot_version = 0
+
+    reset()
+    yield
+    reset()
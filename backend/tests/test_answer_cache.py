@@ -0,0 +1,111 @@
+"""Testes do cache de respostas: acertos exatos e semânticos, expiração e invalidação por documento."""
+import numpy as np
+import pytest
+
+import app
+
+DIMENSION = 16
+
+def unit(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+def put(cache, question, file_paths=(), embedding=None, answer="resposta", top_k=5, mode="vector"):
+    scope = cache.version(top_k, list(file_paths), mode)
+    cache.put(scope, question, None if embedding is None else list(embedding), answer, [])
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(app.time, "time", lambda: now[0])
+    return now
+
+def test_exact_hit_ignores_case_spacing_and_final_punctuation():
+    cache = app.AnswerCache(max_entries=10)
+    put(cache, "O que é o alarme ERR-3?", ["uploads/manual.txt"])
+    entry = cache.get("  o que é o ALARME err-3 ", 5, ["uploads/manual.txt"], "vector")
+    assert entry is not None and entry["answer"] == "resposta"
+    # Outro escopo é outra resposta
+    assert cache.get("O que é o alarme ERR-3?", 3, ["uploads/manual.txt"], "vector") is None
+    assert cache.get("O que é o alarme ERR-3?", 5, ["uploads/manual.txt"], "hybrid") is None
+    assert cache.get("O que é o alarme ERR-3?", 5, [], "vector") is None
+    assert cache.get("O que é o alarme ERR-4?", 5, ["uploads/manual.txt"], "vector") is None
+    assert cache.exact_hits == 1
+
+def test_semantic_hit_above_the_threshold_only():
+    cache = app.AnswerCache(max_entries=10, similarity=0.95)
+    rng = np.random.default_rng(0)
+    base = unit(rng.normal(0, 1, DIMENSION))
+    put(cache, "Como reinicio o sensor?", embedding=base)
+    close = unit(base + 0.05 * rng.normal(0, 1, DIMENSION))
+    far = unit(base + 1.0 * rng.normal(0, 1, DIMENSION))
+    assert float(close @ base) >= 0.95 > float(far @ base)
+
+    entry = cache.get_similar(close.tolist(), 5, [], "vector")
+    assert entry is not None and entry["similarity"] >= 0.95
+    assert cache.get_similar(far.tolist(), 5, [], "vector") is None
+    assert cache.get_similar(close.tolist(), 5, ["uploads/manual.txt"], "vector") is None
+    assert cache.semantic_hits == 1
+
+def test_semantic_lookup_disabled_above_one():
+    cache = app.AnswerCache(max_entries=10, similarity=1.5)
+    base = unit(np.ones(DIMENSION))
+    put(cache, "Como reinicio o sensor?", embedding=base)
+    assert cache.get_similar(base.tolist(), 5, [], "vector") is None
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = app.AnswerCache(max_entries=10, ttl_seconds=60)
+    base = unit(np.ones(DIMENSION))
+    put(cache, "Como reinicio o sensor?", embedding=base)
+    clock[0] += 59
+    assert cache.get("Como reinicio o sensor?", 5, [], "vector") is not None
+    clock[0] += 2
+    assert cache.get("Como reinicio o sensor?", 5, [], "vector") is None
+    assert cache.get_similar(base.tolist(), 5, [], "vector") is None
+    assert cache.expirations == 1
+
+def test_invalidation_bumps_only_the_scopes_of_the_document():
+    cache = app.AnswerCache(max_entries=10)
+    put(cache, "Pergunta", ["uploads/a.txt"])
+    put(cache, "Pergunta", ["uploads/b.txt"])
+    put(cache, "Pergunta")
+    cache.invalidate(["uploads/a.txt"])
+    assert cache.get("Pergunta", 5, ["uploads/a.txt"], "vector") is None
+    # Sem filtro a resposta pode mudar com qualquer documento
+    assert cache.get("Pergunta", 5, [], "vector") is None
+    assert cache.get("Pergunta", 5, ["uploads/b.txt"], "vector") is not None
+
+def test_answer_computed_during_a_change_is_not_stored():
+    cache = app.AnswerCache(max_entries=10)
+    scope = cache.version(5, ["uploads/a.txt"], "vector")
+    cache.invalidate(["uploads/a.txt"])
+    cache.put(scope, "Pergunta", None, "resposta antiga", [])
+    assert cache.get("Pergunta", 5, ["uploads/a.txt"], "vector") is None
+    assert not cache.entries
+
+def test_adding_and_deleting_documents_invalidates_their_answers(empty_index, monkeypatch):
+    cache = app.AnswerCache(max_entries=10)
+    monkeypatch.setattr(app, "answer_cache", cache)
+    rng = np.random.default_rng(1)
+
+    def commit(name):
+        metadatas = [{"file_path": f"uploads/{name}.txt", "source": f"{name}.txt", "chunk": i} for i in range(3)]
+        app.commit_documents([f"{name} {i}" for i in range(3)], metadatas, rng.normal(0, 1, (3, DIMENSION)).astype(np.float32))
+
+    commit("a")
+    commit("b")
+    put(cache, "Pergunta", ["uploads/a.txt"])
+    put(cache, "Pergunta", ["b.txt"])
+    put(cache, "Pergunta")
+
+    # Um documento novo invalida as respostas sem filtro, não as de outros documentos
+    commit("c")
+    assert cache.get("Pergunta", 5, [], "vector") is None
+    assert cache.get("Pergunta", 5, ["uploads/a.txt"], "vector") is not None
+    assert cache.get("Pergunta", 5, ["b.txt"], "vector") is not None
+
+    # Uma nova versão de "a" e a remoção de "b" (filtrado pelo source) invalidam as suas
+    commit("a")
+    assert cache.get("Pergunta", 5, ["uploads/a.txt"], "vector") is None
+    app.remove_document("uploads/b.txt")
+    assert cache.get("Pergunta", 5, ["b.txt"], "vector") is None
@@ -0,0 +1,105 @@
+"""Testes do /ws/chat: ordem dos frames, perguntas simultâneas e cancelamento, sem a API da OpenAI."""
+import asyncio
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from starlette.testclient import TestClient
+
+import app
+
+DIMENSION = 16
+TOKENS = ["O ", "sensor ", "de ", "pressão ", "falhou."]
+
+class StubChat:
+    """Chat que responde sempre os mesmos tokens, com uma pausa antes de cada um."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    async def astream(self, messages):
+        for token in TOKENS:
+            await asyncio.sleep(self.delay)
+            yield SimpleNamespace(content=token)
+
+@pytest.fixture
+def client(monkeypatch):
+    rng = np.random.default_rng(0)
+    texts = [f"Manual do equipamento, seção {i}." for i in range(10)]
+    metadatas = [{"file_path": "uploads/manual.txt", "source": "manual.txt", "chunk": i} for i in range(len(texts))]
+    app.vector_db = None
+    app.chunk_store.truncate(0)
+    app.commit_documents(texts, metadatas, rng.normal(0, 1, (len(texts), DIMENSION)).astype(np.float32))
+
+    async def embed_question(question):
+        return rng.normal(0, 1, DIMENSION).tolist()
+
+    # Sem o startup do app: só o que o chat usa
+    monkeypatch.setattr(app, "embed_question", embed_question)
+    monkeypatch.setattr(app, "chat_model", StubChat(0.01))
+    monkeypatch.setattr(app, "answer_cache", app.AnswerCache(max_entries=0))
+    monkeypatch.setattr(app, "query_semaphore", asyncio.Semaphore(8))
+    yield TestClient(app.app)
+    app.chunk_store.truncate(0)
+    app.vector_db = None
+
+def receive_until_done(websocket, request_ids):
+    """Read frames until every request in `request_ids` got its "done" (or "cancelled")."""
+    frames = []
+    pending = set(request_ids)
+    while pending:
+        frame = json.loads(websocket.receive_text())
+        frames.append(frame)
+        if frame["type"] in ("done", "cancelled", "error"):
+            pending.discard(frame.get("request_id"))
+    return frames
+
+def assert_answer_frames(frames):
+    types = [frame["type"] for frame in frames]
+    assert types[0] == "sources"
+    assert types[-1] == "done"
+    assert set(types[1:-1]) == {"delta"}
+    assert "".join(frame["delta"] for frame in frames[1:-1]) == "".join(TOKENS)
+    assert frames[-1]["answer"] == "".join(TOKENS).strip()
+    assert frames[-1]["sources"] == frames[0]["sources"]
+
+def test_frames_arrive_in_order(client):
+    with client.websocket_connect("/ws/chat") as websocket:
+        websocket.send_text(json.dumps({"question": "O que falhou?", "request_id": "a", "top_k": 3}))
+        frames = receive_until_done(websocket, ["a"])
+    assert all(frame["request_id"] == "a" for frame in frames)
+    assert_answer_frames(frames)
+    assert len(frames[0]["sources"]) == 3
+    assert "ttft_ms" in frames[-1]["timings"]
+
+def test_concurrent_requests_on_one_socket(client):
+    with client.websocket_connect("/ws/chat") as websocket:
+        websocket.send_text(json.dumps({"question": "O que falhou?", "request_id": "a"}))
+        websocket.send_text(json.dumps({"question": "Qual sensor?", "request_id": "b"}))
+        frames = receive_until_done(websocket, ["a", "b"])
+    for request_id in ("a", "b"):
+        assert_answer_frames([frame for frame in frames if frame["request_id"] == request_id])
+    # As duas respostas correm ao mesmo tempo: os deltas se intercalam
+    order = [frame["request_id"] for frame in frames if frame["type"] == "delta"]
+    last_a = max(position for position, request_id in enumerate(order) if request_id == "a")
+    assert order.index("b") < last_a
+
+def test_immediate_cancel_is_acknowledged_once(client, monkeypatch):
+    monkeypatch.setattr(app, "chat_model", StubChat(0.2))
+    with client.websocket_connect("/ws/chat") as websocket:
+        websocket.send_text(json.dumps({"question": "O que falhou?", "request_id": "a"}))
+        websocket.send_text(json.dumps({"type": "cancel", "request_id": "a"}))
+        # Uma segunda pergunta, mais lenta que o cancelamento, mostra tudo o que chegou para "a"
+        websocket.send_text(json.dumps({"question": "Qual sensor?", "request_id": "b"}))
+        frames = receive_until_done(websocket, ["b"])
+    cancelled = [frame for frame in frames if frame["request_id"] == "a" and frame["type"] == "cancelled"]
+    assert len(cancelled) == 1
+    assert not any(frame["request_id"] == "a" and frame["type"] in ("delta", "done") for frame in frames)
+    assert_answer_frames([frame for frame in frames if frame["request_id"] == "b"])
+
+def test_cancel_of_unknown_request_is_an_error(client):
+    with client.websocket_connect("/ws/chat") as websocket:
+        websocket.send_text(json.dumps({"type": "cancel", "request_id": "x"}))
+        frame = json.loads(websocket.receive_text())
+    assert frame == {"type": "error", "request_id": "x", "error": "No such request in flight"}
@@ -0,0 +1,102 @@
+"""Testes do chunker por tokens e dos offsets dos chunks de um documento dividido em partes."""
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+import app
+
+WORDS = "documento sistema dados modelo consulta resposta contexto busca vetor índice página arquivo texto the of and to".split()
+
+def synthetic_text(chars: int, seed: int) -> str:
+    """Parágrafos de frases de tamanhos variados, sem trechos repetidos."""
+    rng = random.Random(seed)
+    paragraphs = []
+    size = 0
+    while size < chars:
+        sentences = []
+        for _ in range(rng.randint(1, 6)):
+            words = [f"{rng.choice(WORDS)}{rng.randint(0, 999)}" for _ in range(rng.randint(4, 30))]
+            sentences.append(" ".join(words).capitalize() + rng.choice([".", "?", "!"]))
+        paragraphs.append(" ".join(sentences))
+        size += len(paragraphs[-1]) + 2
+    return "\n\n".join(paragraphs)[:chars]
+
+def test_chunk_size_overlap_and_coverage():
+    text = synthetic_text(20000, seed=1)
+    chunks = app.chunk_text(text, chunk_size=100, chunk_overlap=20)
+    assert len(chunks) > 10
+    for chunk in chunks:
+        assert 0 < chunk["tokens"] <= 100
+        assert text[chunk["start_char"]:chunk["end_char"]] == chunk["text"]
+        assert chunk["text"] == chunk["text"].strip()
+    for previous, chunk in zip(chunks, chunks[1:]):
+        # Chunks consecutivos avançam e se sobrepõem em até chunk_overlap tokens
+        assert previous["start_char"] < chunk["start_char"]
+        overlap = text[chunk["start_char"]:previous["end_char"]]
+        assert len(app.tokenizer.encode_ordinary(overlap)) <= 20 + 1
+    assert sum(chunk["start_char"] < previous["end_char"] for previous, chunk in zip(chunks, chunks[1:])) > len(chunks) // 2
+    # Nenhum trecho do texto fica de fora (só espaços entre os chunks)
+    covered = np.zeros(len(text), dtype=bool)
+    for chunk in chunks:
+        covered[chunk["start_char"]:chunk["end_char"]] = True
+    assert all(text[i].isspace() for i in np.flatnonzero(~covered))
+
+def test_chunks_without_overlap_do_not_overlap():
+    text = synthetic_text(8000, seed=2)
+    chunks = app.chunk_text(text, chunk_size=80, chunk_overlap=0)
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert previous["end_char"] <= chunk["start_char"]
+
+def test_page_numbers():
+    pages = [synthetic_text(600, seed=3), synthetic_text(600, seed=4)]
+    text = "\n\n".join(pages)
+    chunks = app.chunk_text(text, chunk_size=40, chunk_overlap=0, page_starts=[(0, 1), (len(pages[0]) + 2, 2)])
+    for chunk in chunks:
+        assert chunk["page"] == (1 if chunk["start_char"] < len(pages[0]) + 2 else 2)
+
+@pytest.fixture
+def pages(monkeypatch):
+    """Documento de seis páginas, extraído de duas em duas e dividido a cada duas páginas."""
+    pages = [synthetic_text(6000, seed=10 + number) for number in range(6)]
+
+    def page_ranges(file_path):
+        return [(0, 2), (2, 4), (4, 6)]
+
+    def extract_pages(file_path, start, end):
+        return [{"page": number + 1, "text": pages[number], "ms": 0.0, "error": None} for number in range(start, end)]
+
+    async def embed_documents_cached(texts, on_progress=None):
+        if on_progress:
+            on_progress(len(texts))
+        vectors = np.random.default_rng(len(texts)).normal(0, 1, (len(texts), 16)).astype(np.float32)
+        return vectors, {"embedded": len(texts), "cache_hits": 0}
+
+    executor = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(app, "ingest_process_pool", executor)
+    monkeypatch.setattr(app, "page_ranges", page_ranges)
+    monkeypatch.setattr(app, "extract_pages", extract_pages)
+    monkeypatch.setattr(app, "embed_documents_cached", embed_documents_cached)
+    monkeypatch.setattr(app, "INGEST_STREAM_CHARS", 12000)
+    yield pages
+    executor.shutdown()
+
+def test_offsets_across_flushes(empty_index, pages):
+    job = app.JobInfo(job_id="job", filename="manual.pdf", file_path="uploads/manual.pdf", created_at=time.time())
+    asyncio.run(app.run_ingestion_job(job, "2026-01-01 00:00:00"))
+    assert job.status == "done", job.error
+
+    docs = app.chunk_store.get_many(list(range(app.vector_db.next_id)))
+    docs.sort(key=lambda doc: doc.metadata["chunk"])
+    assert [doc.metadata["chunk"] for doc in docs] == list(range(len(docs)))
+    # Os offsets valem para o texto completo, não para o trecho de cada flush
+    text = "\n\n".join(pages)
+    page_starts = np.cumsum([0] + [len(page) + 2 for page in pages])
+    for doc in docs:
+        start, end = doc.metadata["start_char"], doc.metadata["end_char"]
+        assert text[start:end] == doc.page_content
+        assert doc.metadata["page"] == int(np.searchsorted(page_starts, start, side="right"))
+    assert {doc.metadata["page"] for doc in docs} == set(range(1, 7))
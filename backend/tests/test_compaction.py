@@ -0,0 +1,51 @@
+"""Testes da compactação do índice com escritas chegando durante a montagem do novo índice."""
+import threading
+
+import numpy as np
+
+import app
+
+DIMENSION = 16
+
+def chunks(name: str, count: int, rng: np.random.Generator):
+    texts = [f"{name}: trecho {i}." for i in range(count)]
+    metadatas = [{"file_path": f"uploads/{name}.txt", "source": f"{name}.txt", "chunk": i} for i in range(count)]
+    vectors = rng.normal(0, 1, (count, DIMENSION)).astype(np.float32)
+    return texts, metadatas, vectors
+
+def test_writes_during_compaction_are_kept(empty_index, monkeypatch):
+    rng = np.random.default_rng(0)
+    app.commit_documents(*chunks("antigo", 20, rng))
+    app.commit_documents(*chunks("removido", 5, rng))
+    app.remove_document("uploads/removido.txt")
+    purged = app.vector_db.deleted
+    
+    late_texts, late_metadatas, late_vectors = chunks("novo", 3, rng)
+    merge = app.merge_vector_db
+    
+    def merge_with_concurrent_writes(db):
+        merged = merge(db)
+        # Escritas de outra thread não podem esperar a montagem do índice
+        writer = threading.Thread(target=lambda: (
+            app.commit_documents(late_texts, late_metadatas, late_vectors),
+            app.remove_document("uploads/antigo.txt"),
+        ))
+        writer.start()
+        writer.join(timeout=10)
+        assert not writer.is_alive()
+        return merged
+    
+    monkeypatch.setattr(app, "merge_vector_db", merge_with_concurrent_writes)
+    app.compact_vector_db()
+    
+    db = app.vector_db
+    assert not purged & set(db.ids.tolist())
+    assert len(db.deleted) == 20
+    assert app.compacted_seq < app.segment_seq
+    docs = app.search_vector_db(db, late_vectors[0].tolist(), 3, [])
+    assert {doc.page_content for doc in docs} == set(late_texts)
+    
+    # O snapshot e os segmentos posteriores a ele reproduzem o mesmo estado
+    reloaded = app.load_vector_db()
+    assert reloaded.ids.tolist() == db.ids.tolist()
+    assert reloaded.deleted == db.deleted
@@ -0,0 +1,83 @@
+"""Testes do formato em disco do índice: segmentos, snapshots e recarga depois de uma queda."""
+import os
+
+import numpy as np
+
+import app
+
+DIMENSION = 16
+
+def commit(name: str, count: int, rng: np.random.Generator) -> np.ndarray:
+    texts = [f"{name}: trecho {i}." for i in range(count)]
+    metadatas = [{"file_path": f"uploads/{name}.txt", "source": f"{name}.txt", "chunk": i} for i in range(count)]
+    vectors = rng.normal(0, 1, (count, DIMENSION)).astype(np.float32)
+    app.commit_documents(texts, metadatas, vectors)
+    return vectors
+
+def state(db: app.VectorStore):
+    return db.ids.tolist(), db.reconstruct(np.arange(db.ntotal)), db.deleted
+
+def assert_reload_matches(db: app.VectorStore) -> app.VectorStore:
+    ids, vectors, deleted = state(db)
+    app.vector_db = None
+    reloaded = app.load_vector_db()
+    reloaded_ids, reloaded_vectors, reloaded_deleted = state(reloaded)
+    assert reloaded_ids == ids
+    np.testing.assert_array_equal(reloaded_vectors, vectors)
+    assert reloaded_deleted == deleted
+    return reloaded
+
+def test_segments_reload_without_compaction(empty_index):
+    rng = np.random.default_rng(0)
+    first = commit("manual", 7, rng)
+    commit("removido", 3, rng)
+    second = commit("guia", 5, rng)
+    app.remove_document("uploads/removido.txt")
+
+    # Nada compactado: só os segmentos estão no disco
+    assert not os.path.exists(app.MANIFEST_PATH)
+    assert [seq for seq, _ in app.list_segments()] == [1, 2, 3, 4]
+    db = app.vector_db
+    assert db.deleted == frozenset(range(7, 10))
+
+    reloaded = assert_reload_matches(db)
+    np.testing.assert_array_equal(reloaded.reconstruct(reloaded.positions(list(range(7)))), first)
+    np.testing.assert_array_equal(reloaded.reconstruct(reloaded.positions(list(range(10, 15)))), second)
+    assert app.segment_seq == 4 and app.compacted_seq == 0
+
+def test_snapshot_plus_segments_reload(empty_index):
+    rng = np.random.default_rng(1)
+    commit("manual", 6, rng)
+    commit("removido", 2, rng)
+    app.remove_document("uploads/removido.txt")
+    app.compact_vector_db()
+    # Depois do snapshot: um documento novo e uma remoção ainda em segmentos
+    commit("guia", 4, rng)
+    app.remove_document("uploads/manual.txt")
+
+    assert app.compacted_seq == 3
+    assert [seq for seq, _ in app.list_segments()] == [4, 5]
+    assert_reload_matches(app.vector_db)
+
+def test_truncated_last_segment_is_skipped(empty_index):
+    rng = np.random.default_rng(2)
+    kept = commit("manual", 5, rng)
+    commit("perdido", 4, rng)
+    # Queda no meio da gravação do último segmento
+    _, path = app.list_segments()[-1]
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) // 2)
+
+    app.vector_db = None
+    db = app.load_vector_db()
+    assert db is not None
+    assert db.ids.tolist() == list(range(5))
+    np.testing.assert_array_equal(db.reconstruct(np.arange(5)), kept)
+    assert app.segment_seq == 1
+    # Os chunks do segmento perdido saem do chunk store
+    assert app.chunk_store.count() == 5
+
+    # O próximo segmento ocupa o lugar do truncado
+    app.vector_db = db
+    commit("novo", 2, rng)
+    assert_reload_matches(app.vector_db)
@@ -0,0 +1,65 @@
+"""Testes do micro-batcher das embeddings das perguntas."""
+import asyncio
+
+import pytest
+
+import app
+
+class StubEmbeddings:
+    """Embeddings falsas: registra cada chamada e devolve um vetor derivado do texto."""
+
+    def __init__(self, error: Exception = None):
+        self.calls = []
+        self.error = error
+
+    async def aembed_documents(self, texts):
+        self.calls.append(list(texts))
+        await asyncio.sleep(0.01)
+        if self.error is not None:
+            raise self.error
+        return [[float(len(text)), float(sum(map(ord, text)))] for text in texts]
+
+async def embed_all(batcher, questions):
+    return await asyncio.wait_for(asyncio.gather(*(batcher.embed(question) for question in questions), return_exceptions=True), 5)
+
+def test_concurrent_questions_share_one_call():
+    embeddings = StubEmbeddings()
+    batcher = app.QueryEmbeddingBatcher(embeddings, max_batch_size=32, max_wait_ms=20)
+    questions = ["primeira", "segunda pergunta", "terceira", "segunda pergunta"]
+    vectors = asyncio.run(embed_all(batcher, questions))
+
+    # Uma chamada só, sem repetir a pergunta idêntica, e cada um recebe o seu vetor
+    assert embeddings.calls == [["primeira", "segunda pergunta", "terceira"]]
+    assert vectors == [[float(len(q)), float(sum(map(ord, q)))] for q in questions]
+    stats = batcher.stats()
+    assert stats["requests"] == 4 and stats["batches"] == 1 and stats["api_inputs"] == 3
+
+def test_full_batches_are_sent_without_waiting():
+    embeddings = StubEmbeddings()
+    batcher = app.QueryEmbeddingBatcher(embeddings, max_batch_size=2, max_wait_ms=10000)
+    vectors = asyncio.run(embed_all(batcher, ["a", "b", "c", "d"]))
+    assert embeddings.calls == [["a", "b"], ["c", "d"]]
+    assert [vector[0] for vector in vectors] == [1.0] * 4
+
+def test_failed_batch_raises_in_every_waiter():
+    embeddings = StubEmbeddings(error=RuntimeError("rate limit"))
+    batcher = app.QueryEmbeddingBatcher(embeddings, max_batch_size=32, max_wait_ms=5)
+    results = asyncio.run(embed_all(batcher, ["a", "b", "c"]))
+    assert len(embeddings.calls) == 1
+    assert all(isinstance(result, RuntimeError) and str(result) == "rate limit" for result in results)
+    assert batcher.stats()["errors"] == 1
+
+def test_cancelled_waiter_does_not_break_the_batch():
+    embeddings = StubEmbeddings()
+    batcher = app.QueryEmbeddingBatcher(embeddings, max_batch_size=32, max_wait_ms=20)
+
+    async def run():
+        gone = asyncio.ensure_future(batcher.embed("desistiu"))
+        kept = asyncio.ensure_future(batcher.embed("ficou"))
+        await asyncio.sleep(0)
+        gone.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await gone
+        return await asyncio.wait_for(kept, 5)
+
+    assert asyncio.run(run()) == [5.0, float(sum(map(ord, "ficou")))]
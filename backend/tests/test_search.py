@@ -0,0 +1,67 @@
+"""Testes da busca (vetorial, léxica e híbrida) sobre um índice pequeno e sem a API da OpenAI."""
+import numpy as np
+import pytest
+
+import app
+
+DIMENSION = 16
+
+def unit(vector: np.ndarray) -> np.ndarray:
+    return (vector / np.linalg.norm(vector)).astype(np.float32)
+
+@pytest.fixture
+def db():
+    """Índice com chunks genéricos próximos da pergunta e um único chunk com o código exato, longe dela."""
+    rng = np.random.default_rng(0)
+    query = unit(np.eye(DIMENSION, dtype=np.float32)[0])
+    texts, vectors = [], []
+    for i in range(30):
+        texts.append(f"Notas gerais de operação, parte {i}, sem nenhum identificador.")
+        vectors.append(unit(query + rng.normal(0, 0.6, DIMENSION)))
+    texts.append("O alarme ERR-3 indica falha no sensor de pressão.")
+    vectors.append(unit(-query + rng.normal(0, 0.2, DIMENSION)))
+    metadatas = [{"file_path": "uploads/manual.txt", "source": "manual.txt", "chunk": i} for i in range(len(texts))]
+    
+    app.vector_db = None
+    app.chunk_store.truncate(0)
+    app.commit_documents(texts, metadatas, np.array(vectors))
+    yield app.vector_db
+    app.chunk_store.truncate(0)
+    app.vector_db = None
+
+def test_hybrid_keeps_exact_lexical_match(db):
+    query = np.eye(DIMENSION, dtype=np.float32)[0]
+    docs = app.search_vector_db(db, query.tolist(), 5, [], question="ERR-3", mode="hybrid")
+    assert len(docs) == 5
+    assert any("ERR-3" in doc.page_content for doc in docs)
+
+def test_vector_mode_ranks_by_similarity(db):
+    query = np.eye(DIMENSION, dtype=np.float32)[0]
+    docs = app.search_vector_db(db, query.tolist(), 5, [], question="ERR-3", mode="vector")
+    assert len(docs) == 5
+    assert not any("ERR-3" in doc.page_content for doc in docs)
+
+def test_remove_document_invalidates_answers_filtered_by_source(db):
+    scope = app.answer_cache.version(5, ["manual.txt"], "vector")
+    app.answer_cache.put(scope, "O que é ERR-3?", None, "Falha no sensor.", [])
+    assert app.answer_cache.get("O que é ERR-3?", 5, ["manual.txt"], "vector") is not None
+    assert app.remove_document("uploads/manual.txt") == 31
+    assert app.answer_cache.get("O que é ERR-3?", 5, ["manual.txt"], "vector") is None
+
+def test_duplicates_do_not_shrink_the_results():
+    rng = np.random.default_rng(1)
+    query = unit(np.eye(DIMENSION, dtype=np.float32)[0])
+    # Cinco cópias do chunk mais próximo da pergunta, depois chunks distintos
+    vectors = [query] * 5 + [unit(query + rng.normal(0, 0.6, DIMENSION)) for _ in range(10)]
+    texts = [f"Trecho {i}." for i in range(len(vectors))]
+    metadatas = [{"file_path": "uploads/copias.txt", "source": "copias.txt", "chunk": i} for i in range(len(texts))]
+    app.vector_db = None
+    app.chunk_store.truncate(0)
+    try:
+        app.commit_documents(texts, metadatas, np.array(vectors))
+        docs = app.search_vector_db(app.vector_db, query.tolist(), 5, [], mode="vector")
+        assert len(docs) == 5
+        assert sum(doc.metadata["chunk"] < 5 for doc in docs) == 1
+    finally:
+        app.chunk_store.truncate(0)
+        app.vector_db = None
@@ -57,9 +57,13 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({
 }) => {
   const [input, setInput] = useState<string>('');
   const [isLoading, setIsLoading] = useState<boolean>(false);
+  const [isStreaming, setIsStreaming] = useState<boolean>(false);
   const [sources, setSources] = useState<Source[]>([]);
   const [socket, setSocket] = useState<WebSocket | null>(null);
   const messagesEndRef = useRef<HTMLDivElement>(null);
+  // Pergunta em andamento (request_id enviado ao servidor) e a mensagem que recebe a resposta em partes
+  const requestIdRef = useRef<string | null>(null);
+  const streamingIdRef = useRef<string | null>(null);
 
   useEffect(() => {
     // Conectar ao WebSocket quando o componente montar
@@ -81,13 +85,62 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({
         const data = JSON.parse(event.data);
         console.log('Received message:', data);
 
-        if (data.error) {
+        // Ignorar o que ainda chegar de uma pergunta cancelada
+        if (data.request_id && data.request_id !== requestIdRef.current) {
+          return;
+        }
+
+        if (data.type === 'cancelled') {
+          requestIdRef.current = null;
+          streamingIdRef.current = null;
+          setIsStreaming(false);
+          setIsLoading(false);
+        } else if (data.error) {
           const errorMessage: Message = {
             id: uuidv4(),
             content: `Erro: ${data.error}`,
             role: 'assistant'
           };
           setMessages(prev => [...prev, errorMessage]);
+          requestIdRef.current = null;
+          streamingIdRef.current = null;
+          setIsStreaming(false);
+          setIsLoading(false);
+        } else if (data.type === 'sources') {
+          // As fontes chegam antes da resposta
+          setSources(data.sources || []);
+        } else if (data.type === 'delta') {
+          // Acrescentar o pedaço da resposta à mensagem em andamento
+          const streamingId = streamingIdRef.current;
+          if (streamingId === null) {
+            const id = uuidv4();
+            streamingIdRef.current = id;
+            setMessages(prev => [...prev, { id, content: data.delta, role: 'assistant' }]);
+            setIsStreaming(true);
+          } else {
+            setMessages(prev => prev.map(message =>
+              message.id === streamingId ? { ...message, content: message.content + data.delta } : message
+            ));
+          }
+        } else if (data.type === 'done') {
+          // Mensagem final: resposta completa, fontes e tempos
+          const streamingId = streamingIdRef.current;
+          requestIdRef.current = null;
+          streamingIdRef.current = null;
+          if (streamingId === null) {
+            setMessages(prev => [...prev, { id: uuidv4(), content: data.answer, role: 'assistant' }]);
+          } else {
+            setMessages(prev => prev.map(message =>
+              message.id === streamingId ? { ...message, content: data.answer } : message
+            ));
+          }
+          if (data.sources) {
+            setSources(data.sources);
+          }
+          if (data.timings) {
+            console.log('Answer timings:', data.timings);
+          }
+          setIsStreaming(false);
           setIsLoading(false);
         } else if (data.answer) {
           const newMessage: Message = {
@@ -142,7 +195,11 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({
       setMessages(prev => [...prev, userMessage]);
       
       // Preparar dados para enviar, incluindo arquivos selecionados
+      const requestId = uuidv4();
+      requestIdRef.current = requestId;
+      streamingIdRef.current = null;
       const messageData = {
+        request_id: requestId,
         question: input,
         top_k: 5,
         file_paths: selectedFiles.length > 0 ? selectedFiles : []
@@ -160,6 +217,13 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({
     }
   };
 
+  // Interromper a resposta em andamento (o servidor cancela a chamada à OpenAI)
+  const handleCancel = () => {
+    if (socket && socket.readyState === WebSocket.OPEN && requestIdRef.current) {
+      socket.send(JSON.stringify({ type: 'cancel', request_id: requestIdRef.current }));
+    }
+  };
+
   const handleKeyPress = (e: React.KeyboardEvent) => {
     if (e.key === 'Enter' && !e.shiftKey) {
       e.preventDefault();
@@ -199,7 +263,7 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({
             />
           ))
         )}
-        {isLoading && (
+        {isLoading && !isStreaming && (
           <div className="message message-assistant typing-message">
             <div className="typing-indicator">
               <span></span>
@@ -219,13 +283,22 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({
           placeholder="Digite sua pergunta..."
           disabled={isLoading}
         />
-        <button
-          className="chat-button"
-          onClick={handleSendMessage}
-          disabled={!input.trim() || isLoading}
-        >
-          Enviar
-        </button>
+        {isLoading ? (
+          <button
+            className="chat-button"
+            onClick={handleCancel}
+          >
+            Parar
+          </button>
+        ) : (
+          <button
+            className="chat-button"
+            onClick={handleSendMessage}
+            disabled={!input.trim()}
+          >
+            Enviar
+          </button>
+        )}
       </div>
       {sources.length > 0 && (
         <div className="sources-container">
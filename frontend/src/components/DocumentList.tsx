@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import axios from 'axios';
 
 interface Document {
+  document_id: string;
   filename: string;
   upload_time: string;
   file_path: string;
@@ -47,6 +48,19 @@ const DocumentList: React.FC<DocumentListProps> = ({ selectedFiles, setSelectedF
     return () => clearInterval(intervalId);
   }, []);
 
+  // Remover um documento (os trechos dele deixam de aparecer nas respostas)
+  const deleteDocument = async (doc: Document) => {
+    if (!window.confirm(`Remover o documento "${doc.filename}"?`)) return;
+    try {
+      await axios.delete(`/api/documents/${encodeURIComponent(doc.document_id)}`);
+      setSelectedFiles(selectedFiles.filter(file => file !== doc.file_path));
+      fetchDocuments();
+    } catch (err) {
+      console.error('Erro ao remover documento:', err);
+      setError('Não foi possível remover o documento. Por favor, tente novamente.');
+    }
+  };
+
   const handleSelectAll = (e: React.ChangeEvent<HTMLInputElement>) => {
     const checked = e.target.checked;
     setSelectAll(checked);
@@ -119,6 +133,7 @@ const DocumentList: React.FC<DocumentListProps> = ({ selectedFiles, setSelectedF
               <div>Nome</div>
               <div>Data de Upload</div>
               <div>Tamanho</div>
+              <div className="document-actions"></div>
             </div>
             
             <div className="document-items-container">
@@ -176,6 +191,18 @@ const DocumentList: React.FC<DocumentListProps> = ({ selectedFiles, setSelectedF
                   </div>
                   <div className="document-date">{doc.upload_time}</div>
                   <div className="document-size">{formatFileSize(doc.size)}</div>
+                  <div className="document-actions">
+                    <button
+                      className="document-delete-button"
+                      title="Remover documento"
+                      onClick={(e) => {
+                        e.stopPropagation();
+                        deleteDocument(doc);
+                      }}
+                    >
+                      🗑️
+                    </button>
+                  </div>
                 </div>
               ))}
             </div>
@@ -2,6 +2,26 @@ import React, { useCallback, useState } from 'react';
 import { useDropzone } from 'react-dropzone';
 import axios from 'axios';
 
+interface UploadJob {
+  job_id: string;
+  status: string;
+  chunks_total: number;
+  chunks_done: number;
+  error: string | null;
+}
+
+// Aguarda o processamento do documento no backend (extração, embeddings e indexação)
+const waitForJob = async (jobId: string, onStatus: (job: UploadJob) => void): Promise<UploadJob> => {
+  while (true) {
+    const { data } = await axios.get<UploadJob>(`/api/jobs/${jobId}`);
+    onStatus(data);
+    if (data.status === 'done' || data.status === 'failed') {
+      return data;
+    }
+    await new Promise(resolve => setTimeout(resolve, 1000));
+  }
+};
+
 interface FileUploaderProps {
   onUploadStatus: (status: { uploading: boolean, success: boolean, error: string | null }) => void;
 }
@@ -10,6 +30,7 @@ const FileUploader: React.FC<FileUploaderProps> = ({ onUploadStatus }) => {
   const [files, setFiles] = useState<File[]>([]);
   const [uploading, setUploading] = useState(false);
   const [uploadProgress, setUploadProgress] = useState<number>(0);
+  const [processingStatus, setProcessingStatus] = useState<string | null>(null);
 
   const onDrop = useCallback(async (acceptedFiles: File[]) => {
     setFiles(acceptedFiles);
@@ -50,6 +71,23 @@ const FileUploader: React.FC<FileUploaderProps> = ({ onUploadStatus }) => {
 
       console.log('Upload successful:', response.data);
       setFiles([]);
+      
+      // O upload só enfileira o documento; acompanhar o job até o fim
+      // (arquivos idênticos a um já processado não geram job)
+      if (response.data.job_id) {
+        const job = await waitForJob(response.data.job_id, (status) => {
+          setProcessingStatus(
+            status.chunks_total > 0
+              ? `Processando (${status.status}): ${status.chunks_done}/${status.chunks_total} trechos`
+              : `Processando (${status.status})...`
+          );
+        });
+        setProcessingStatus(null);
+        
+        if (job.status === 'failed') {
+          throw new Error(job.error || 'Falha ao processar o documento');
+        }
+      }
       onUploadStatus({ uploading: false, success: true, error: null });
       
       // Resetar o progresso após um tempo
@@ -58,6 +96,7 @@ const FileUploader: React.FC<FileUploaderProps> = ({ onUploadStatus }) => {
       }, 3000);
     } catch (error) {
       console.error('Error uploading file:', error);
+      setProcessingStatus(null);
       onUploadStatus({ 
         uploading: false, 
         success: false, 
@@ -115,6 +154,10 @@ const FileUploader: React.FC<FileUploaderProps> = ({ onUploadStatus }) => {
         </div>
       )}
       
+      {processingStatus && (
+        <div className="upload-processing-status">{processingStatus}</div>
+      )}
+
       {uploadProgress > 0 && uploadProgress < 100 && (
         <div className="upload-progress-container">
           <div 